@@ -0,0 +1,85 @@
+"""Startup benchmark of every Lambda handler.
+
+Imports each src/<function>/app.py in a fresh interpreter, with the shared
+layer on the path like the Lambda runtime, and reports the interpreter start
+plus import time (the init duration of a cold start) and the heaviest imports.
+
+    python benchmarks/bench_cold_start.py [--runs 5] [--top 5]
+"""
+import os
+import sys
+import glob
+import time
+import argparse
+import statistics
+import subprocess
+
+SRC_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "src")
+LAYER_DIRS = [os.path.join(SRC_DIR, "layer"), os.path.join(SRC_DIR, "db-layer")]
+
+IMPORT_SCRIPT = """
+import time
+start = time.perf_counter()
+import app
+print(time.perf_counter() - start)
+"""
+
+
+def parse_import_times(stderr):
+    # Lines look like "import time:       self [us] |  cumulative | imported package"
+    imports = []
+    for line in stderr.splitlines():
+        if not line.startswith("import time:") or "imported package" in line:
+            continue
+
+        _, cumulative, package = line[len("import time:"):].split("|")
+        package = package.strip()
+        # Report whole packages imported by the handler, their submodules are part of the cumulative time
+        if "." not in package and package != "app":
+            imports.append((int(cumulative), package))
+
+    return imports
+
+
+def measure(function_dir):
+    env = dict(os.environ, PYTHONPATH=os.pathsep.join([function_dir] + LAYER_DIRS))
+    start = time.perf_counter()
+    result = subprocess.run(
+        [sys.executable, "-X", "importtime", "-c", IMPORT_SCRIPT],
+        env=env, cwd=function_dir, capture_output=True, text=True
+    )
+    init_time = time.perf_counter() - start
+
+    if result.returncode != 0:
+        raise Exception(result.stderr.strip().splitlines()[-1])
+
+    return init_time, float(result.stdout.strip()), parse_import_times(result.stderr)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--runs", type=int, default=5)
+    parser.add_argument("--top", type=int, default=5)
+    args = parser.parse_args()
+
+    for app_path in sorted(glob.glob(os.path.join(SRC_DIR, "*", "app.py"))):
+        function_dir = os.path.dirname(app_path)
+        name = os.path.basename(function_dir)
+
+        try:
+            runs = [measure(function_dir) for _ in range(args.runs)]
+        except Exception as e:
+            print("{:<24} failed to import: {}".format(name, e))
+            continue
+
+        init_time = statistics.median(run[0] for run in runs)
+        import_time = statistics.median(run[1] for run in runs)
+        heaviest = sorted(runs[-1][2], reverse=True)[:args.top]
+
+        print("{:<24} init {:8.1f} ms, import {:8.1f} ms".format(name, init_time * 1000, import_time * 1000))
+        for cumulative, package in heaviest:
+            print("{:<24}   {:8.1f} ms  {}".format("", cumulative / 1000, package))
+
+
+if __name__ == "__main__":
+    main()
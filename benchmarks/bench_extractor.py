@@ -0,0 +1,127 @@
+"""Micro-benchmark of listing page extraction against the saved HTML fixtures.
+
+Compares the original BeautifulSoup/html.parser extraction with listing_extractor
+and checks that both return the same dict.
+
+    python benchmarks/bench_extractor.py [--rounds 200]
+"""
+import os
+import sys
+import glob
+import time
+import argparse
+from datetime import datetime
+from bs4 import BeautifulSoup
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), "..", "src", "layer"))
+
+from listing_extractor import extract_listing, parse_price, parse_mileage, PRICE_CURRENCY
+
+FIXTURES_DIR = os.path.join(os.path.dirname(__file__), "fixtures")
+
+
+def extract_listing_html_parser(html, listing_url):
+    # The extraction get_data_from_listing used before listing_extractor, kept as the baseline. The price and mileage
+    # text go through the same parsers, the original ones stored "$18500" and split "84 000 km" into "84" and "000"
+    soup = BeautifulSoup(html, 'html.parser')
+    car_year = soup.select('h1 a')[-3].text
+    car_make = soup.select('h1 a')[-2].text
+    car_model = soup.select('h1 a')[-1].text
+    car_insert_date = soup.select('.attrs span')[0].text
+    car_location = soup.select('.attrs span')[1].text.split(", ")[1] if len(soup.select('.attrs span')[1].text.split(", ")) > 1 else None
+    car_price, car_price_currency, car_is_negotiable = parse_price(soup.select('.offer-top-price .price span, .offer-top-price .price small')[0].text)
+    car_seller_id = soup.select('.ad-seller-details a.call-seller')[0].get('data-sellerid')
+    car_pricing_attributes = soup.select('.offer-top-price .price-attrs')[0].text.lower()
+    car_vin = soup.select('.pad-left-6')[0].text.strip() if len(soup.select('.pad-left-6')) > 0 else None
+    car_is_exchangable = False
+    car_pay_with_installments = False
+    car_is_urgent = False
+    car_options = soup.select('.ad-options')[0].text.strip() if len(soup.select('.ad-options')) > 0 else None
+
+    if "exchange" in car_pricing_attributes:
+        car_is_exchangable = True
+    if "installments" in car_pricing_attributes:
+        car_pay_with_installments = True
+    if car_is_negotiable:
+        car_price = -1
+    if len(soup.select('.urgent-stiker')) > 0:
+        car_is_urgent = True
+
+    car_details = {}
+    car_details_table = soup.select('.ad-det tr')
+    for detail in car_details_table:
+        key = detail.select('td')[0].text.lower().replace(" ", "_")
+        value = detail.select('td')[1].span.text.strip().lower().strip('"') if detail.select('td')[1].span else detail.select('td')[1].text.strip().lower()
+        car_details[key] = value
+
+    if car_details["mileage"]:
+        car_details["mileage"], car_details["milage_measurement"] = parse_mileage(car_details["mileage"])
+    if car_price_currency not in (None, PRICE_CURRENCY):
+        car_details["price"] = str(car_price)
+        car_details["price_currency"] = car_price_currency
+        car_price = None
+
+    return {
+        "listing_id": listing_url.split("/")[2],
+        "car_year": car_year,
+        "car_make": car_make,
+        "car_model": car_model,
+        "car_vin": car_vin,
+        "car_is_urgent": car_is_urgent,
+        "car_is_negotiable": car_is_negotiable,
+        "car_is_exchangable": car_is_exchangable,
+        "car_pay_with_installments": car_pay_with_installments,
+        "car_insert_date": datetime.strptime(car_insert_date, "%d.%m.%Y").strftime("%Y-%m-%d"),
+        "car_location": car_location,
+        "car_price": car_price,
+        "car_seller_id": car_seller_id,
+        "car_details": car_details,
+        "car_options": car_options
+    }
+
+
+def load_fixtures():
+    fixtures = []
+    for path in sorted(glob.glob(os.path.join(FIXTURES_DIR, "listing-*.html"))):
+        listing_id = os.path.basename(path)[len("listing-"):-len(".html")]
+        with open(path, encoding="utf-8") as f:
+            fixtures.append(("/offer/{}".format(listing_id), f.read()))
+
+    return fixtures
+
+
+def bench(extract, fixtures, rounds):
+    start = time.perf_counter()
+    for _ in range(rounds):
+        for listing_url, html in fixtures:
+            extract(html, listing_url)
+
+    return (time.perf_counter() - start) / (rounds * len(fixtures))
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--rounds", type=int, default=200)
+    args = parser.parse_args()
+
+    fixtures = load_fixtures()
+    if not fixtures:
+        raise SystemExit("No listing fixtures found in {}".format(FIXTURES_DIR))
+
+    for listing_url, html in fixtures:
+        expected = extract_listing_html_parser(html, listing_url)
+        actual = extract_listing(html, listing_url)
+        if expected != actual:
+            raise SystemExit("Extraction mismatch for {}:\n{}\n{}".format(listing_url, expected, actual))
+
+    baseline = bench(extract_listing_html_parser, fixtures, args.rounds)
+    current = bench(extract_listing, fixtures, args.rounds)
+
+    print("fixtures: {}, rounds: {}".format(len(fixtures), args.rounds))
+    print("bs4/html.parser:   {:8.3f} ms per listing".format(baseline * 1000))
+    print("listing_extractor: {:8.3f} ms per listing".format(current * 1000))
+    print("speedup:           {:8.1f}x".format(baseline / current))
+
+
+if __name__ == "__main__":
+    main()
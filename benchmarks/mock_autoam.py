@@ -0,0 +1,153 @@
+"""Local stand-in for auto.am serving the saved HTML fixtures.
+
+Serves the homepage with the CSRF token and session cookies on /lang/en, the
+search results page on POST /search and the listing pages on /offer/<id>.
+Every search page links to its own listing ids, and every listing id is
+answered with one of the listing fixtures, so a crawl of many pages produces
+distinct listings. Latency is injected before each response to model the
+round trip to auto.am, and a share of the requests can fail with 503 to model
+an overloaded site.
+
+    python benchmarks/mock_autoam.py [--port 8080] [--latency 0.05] [--jitter 0.02]
+
+Point the functions at it with AUTOAM_IP_ADDRESS=127.0.0.1:8080 AUTOAM_SCHEME=http.
+"""
+import os
+import re
+import glob
+import json
+import time
+import random
+import argparse
+import threading
+from urllib.parse import parse_qs
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+
+FIXTURES_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "fixtures")
+LISTINGS_PER_PAGE = 20
+FIRST_LISTING_ID = 3000000
+OFFER_PATTERN = re.compile(r"/offer/\d+")
+
+
+def read_fixture(name):
+    with open(os.path.join(FIXTURES_DIR, name), encoding="utf-8") as f:
+        return f.read()
+
+
+class Fixtures:
+    def __init__(self):
+        self.home = read_fixture("home.html")
+        self.search = read_fixture("search.html")
+        self.listings = [read_fixture(os.path.basename(path)) for path in sorted(glob.glob(os.path.join(FIXTURES_DIR, "listing-*.html")))]
+
+    def search_page(self, page_number):
+        # Number the cards of every page consecutively, like the listings of a real result set
+        ids = iter(range(FIRST_LISTING_ID + (page_number - 1) * LISTINGS_PER_PAGE, FIRST_LISTING_ID + page_number * LISTINGS_PER_PAGE))
+        return OFFER_PATTERN.sub(lambda match: "/offer/{}".format(next(ids, FIRST_LISTING_ID)), self.search)
+
+    def listing(self, listing_id):
+        return self.listings[listing_id % len(self.listings)]
+
+
+class MockAutoAmHandler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+    fixtures = None
+    latency = 0.0
+    jitter = 0.0
+    gone_rate = 0.0
+    error_rate = 0.0
+
+    def log_message(self, format, *args):
+        pass
+
+    def delay(self):
+        if self.latency or self.jitter:
+            time.sleep(max(self.latency + random.uniform(-self.jitter, self.jitter), 0))
+
+    def overloaded(self):
+        # auto.am struggling, answer with 503 and ask the client to come back later
+        if self.error_rate and random.random() < self.error_rate:
+            self.respond(503, "", [("Retry-After", "1")])
+            return True
+
+        return False
+
+    def respond(self, status_code, body="", headers=None):
+        data = body.encode("utf-8")
+        self.send_response(status_code)
+        self.send_header("Content-Type", "text/html; charset=UTF-8")
+        self.send_header("Content-Length", str(len(data)))
+        for name, value in (headers or []):
+            self.send_header(name, value)
+        self.end_headers()
+        self.wfile.write(data)
+
+    def do_GET(self):
+        self.delay()
+
+        if self.overloaded():
+            return
+
+        if self.path == "/lang/en":
+            return self.respond(200, self.fixtures.home, [
+                ("Set-Cookie", "XSRF-TOKEN=fixtureXsrfToken; Path=/"),
+                ("Set-Cookie", "autoam_session=fixtureSession; Path=/; HttpOnly")
+            ])
+
+        if self.path.startswith("/offer/") and self.path[len("/offer/"):].isdigit():
+            listing_id = int(self.path[len("/offer/"):])
+
+            # A share of the listings answer as sold or deleted
+            if self.gone_rate and random.random() < self.gone_rate:
+                return self.respond(404)
+
+            return self.respond(200, self.fixtures.listing(listing_id))
+
+        self.respond(404)
+
+    def do_POST(self):
+        body = self.rfile.read(int(self.headers.get("Content-Length", 0))).decode("utf-8")
+        self.delay()
+
+        if self.overloaded():
+            return
+
+        if self.path == "/search":
+            search = json.loads(parse_qs(body).get("search", ["{}"])[0])
+            return self.respond(200, self.fixtures.search_page(int(search.get("page", 1))))
+
+        self.respond(404)
+
+
+def start_server(port=0, latency=0.0, jitter=0.0, gone_rate=0.0, error_rate=0.0):
+    handler = type("Handler", (MockAutoAmHandler,), {
+        "fixtures": Fixtures(), "latency": latency, "jitter": jitter, "gone_rate": gone_rate, "error_rate": error_rate
+    })
+
+    server = ThreadingHTTPServer(("127.0.0.1", port), handler)
+    server.daemon_threads = True
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+
+    return server
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--port", type=int, default=8080)
+    parser.add_argument("--latency", type=float, default=0.05, help="seconds added to every response")
+    parser.add_argument("--jitter", type=float, default=0.02, help="random +/- seconds added to the latency")
+    parser.add_argument("--gone-rate", type=float, default=0.0, help="share of listings answered with 404")
+    parser.add_argument("--error-rate", type=float, default=0.0, help="share of requests answered with 503 and Retry-After")
+    args = parser.parse_args()
+
+    server = start_server(args.port, args.latency, args.jitter, args.gone_rate, args.error_rate)
+    print("Serving auto.am fixtures on http://127.0.0.1:{}".format(server.server_address[1]))
+
+    try:
+        threading.Event().wait()
+    except KeyboardInterrupt:
+        server.shutdown()
+
+
+if __name__ == "__main__":
+    main()
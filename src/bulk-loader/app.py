@@ -0,0 +1,39 @@
+import os
+import json
+from autoam_db import get_connection, reset_connection
+from bulk_loader import get_archive_store, load_pending, DEFAULT_FILES_PER_LOAD, DEFAULT_LOAD_LAG
+from seen_index import record_listings
+from metrics import metric_scope, add_metric
+
+# Time left for one more load before the function times out
+LOAD_TIME_MARGIN_MS = 120000
+
+@metric_scope("bulk-loader")
+def lambda_handler(event, context):
+    files_per_load = int(os.environ.get("LOAD_FILES_PER_TRANSACTION", DEFAULT_FILES_PER_LOAD))
+    lag = int(os.environ.get("LOAD_LAG", DEFAULT_LOAD_LAG))
+    conn = get_connection()
+    loaded = {}
+
+    try:
+        # Runs on a schedule and loads every file written since the last run, many files per transaction
+        for keys, listing_ids in load_pending(conn, get_archive_store(), files_per_load, lag):
+            loaded[keys[-1]] = len(listing_ids)
+            add_metric("FilesLoaded", len(keys))
+
+            try:
+                # Committed listings are added to the index, so the scrapers stop enqueueing them
+                record_listings(listing_ids)
+            except Exception as e:
+                print(f"Error updating seen index: {str(e)}")
+
+            # The files left are picked up by the next run
+            if context and context.get_remaining_time_in_millis() < LOAD_TIME_MARGIN_MS:
+                break
+    except Exception:
+        # Fail the invocation, the next run starts again after the last committed load
+        reset_connection()
+        raise
+
+    # Return the result
+    return {"statusCode": 200, "body": json.dumps({"loaded": loaded})}
@@ -0,0 +1,34 @@
+import os
+from crawl_state import get_crawl_state, summarize, unfinished
+from metrics import metric_scope, add_metric
+
+@metric_scope("check-crawl-state")
+def lambda_handler(event, context):
+    try:
+        # Rounds of this execution so far, every retry round scrapes the unfinished chunks again
+        max_rounds = int(os.environ.get("CRAWL_MAX_ROUNDS", 3))
+        crawl_round = (event.get('crawl_state') or {}).get('round', 0) + 1
+
+        state = get_crawl_state()
+        crawl_id = state.get_current_crawl() if state else None
+
+        # Nothing is tracked without a state store, the crawl counts as complete like before
+        if not crawl_id:
+            return {"status": "complete", "round": crawl_round}
+
+        chunks = state.list_chunks(crawl_id)
+        summary = summarize(chunks)
+        unfinished_count = len(unfinished(chunks))
+        add_metric("UnfinishedChunks", unfinished_count)
+
+        if unfinished_count == 0:
+            status = "complete"
+        elif crawl_round < max_rounds:
+            status = "retry"
+        else:
+            # Left to the next scheduled execution, which resumes the same crawl
+            status = "incomplete"
+
+        return {"status": status, "round": crawl_round, "crawl_id": crawl_id, "chunks": summary}
+    except Exception as e:
+        return {"status": "error", "error": str(e)}
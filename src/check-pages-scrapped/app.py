@@ -1,13 +1,13 @@
-import boto3
-import botocore
+from config_cache import get_parameter
+from metrics import metric_scope
 
-def lambda_handler(event, context):
-    ssm = boto3.client('ssm')
-    parameter_name = '/auto.am/pages-scrapped'
+PARAMETER_NAME = '/auto.am/pages-scrapped'
 
+@metric_scope("check-pages-scrapped")
+def lambda_handler(event, context):
     try:
-        response = ssm.get_parameter(Name=parameter_name, WithDecryption=True)
-        parameter_value = response['Parameter']['Value']
+        # The flag is cached in the process, warm invocations don't call SSM until PARAMETER_CACHE_TTL expires
+        parameter_value = get_parameter(PARAMETER_NAME)
 
         if parameter_value == 'true':
             result = 'scrapped'
@@ -16,8 +16,5 @@ def lambda_handler(event, context):
 
         return result
 
-    except botocore.exceptions.ClientError as e:
-        if e.response['Error']['Code'] == 'ParameterNotFound':
-            return 'not_scrapped'
-        else:
-            return str(e)
+    except Exception as e:
+        return str(e)
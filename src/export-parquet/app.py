@@ -0,0 +1,21 @@
+import os
+import json
+from autoam_db import get_connection, reset_connection
+from parquet_export import export, get_export_store, DEFAULT_BATCH_SIZE, DEFAULT_WATERMARK_LAG
+from metrics import metric_scope
+
+@metric_scope("export-parquet")
+def lambda_handler(event, context):
+    try:
+        batch_size = int(os.environ.get("EXPORT_BATCH_SIZE", DEFAULT_BATCH_SIZE))
+        lag = int(os.environ.get("EXPORT_WATERMARK_LAG", DEFAULT_WATERMARK_LAG))
+
+        # Write the rows created since the last export to the analytics bucket
+        watermark, next_watermark, rows = export(get_connection(), get_export_store(), batch_size, lag)
+
+        # Return the result
+        return {"statusCode": 200, "body": json.dumps({"from": watermark, "to": next_watermark, "rows": rows})}
+    except Exception as e:
+        # The watermark did not move, the next run exports the same rows again
+        reset_connection()
+        return {"statusCode": 500, "body": json.dumps({"error": str(e)})}
@@ -1,11 +1,16 @@
 import os
-import requests
-import json
-from bs4 import BeautifulSoup
-from requests.packages.urllib3.exceptions import InsecureRequestWarning
+from concurrent.futures import ThreadPoolExecutor
+from autoam_client import get_client, get_shard_filters, SEARCH_FILTERS, INCLUSIVE_BOUNDS, EXCLUSIVE_BOUNDS
+from listing_fetcher import get_pages_count
+from crawl_state import get_crawl_state, unfinished
+from seen_index import get_index_store, rebuild_index
+from autoam_db import get_connection, reset_connection
+from metrics import metric_scope, timed, add_metric
 
-requests.packages.urllib3.disable_warnings(InsecureRequestWarning)
+# Model years probed for the bound semantics of the search, until one of them has listings
+BOUNDS_PROBE_YEARS = (2018, 2015, 2012, 2008, 2004)
 
+@metric_scope("get-pages")
 def lambda_handler(event, context):
     try:
         # Read the IP address from Lambda environment variables
@@ -14,11 +19,8 @@ def lambda_handler(event, context):
         if not ip_address:
             raise Exception("AUTOAM_IP_ADDRESS environment variable is not set.")
 
-        # Hardcoded website URL (using the IP address)
-        url = "https://{}/lang/en".format(ip_address)
-
         # Call the function to get the pages count
-        pages = get_pages(url, ip_address)
+        pages = get_pages(ip_address)
 
         # Return the result
         return pages
@@ -26,59 +28,142 @@ def lambda_handler(event, context):
         # Handle exceptions and return an error response
         return str(e)
 
-def get_pages(url, ip_address):
-    # Step 1: Send an HTTP GET request to the URL
-    response = requests.get(url, verify=False)
-
-    # Check if the request was successful (status code 200)
-    if response.status_code == 200:
-        # Extract the cookies and CSRF token from the response
-        autoam_session_cookie = response.cookies.get("autoam_session")
-        xsrf_token_cookie = response.cookies.get("XSRF-TOKEN")
-        soup = BeautifulSoup(response.text, 'html.parser')
-        csrf_token = soup.find('meta', {'name': 'csrf-token'})['content']
-
-        # Step 2: Make a POST request to the search endpoint using the obtained CSRF token and cookies
-        post_url = "https://{}/search".format(ip_address)  # Update URL for the POST request
-        post_headers = {
-            'Host': 'auto.am',  # Set the Host header
-            'Accept': '*/*',
-            'Accept-Language': 'en-US,en;q=0.5',
-            'Accept-Encoding': 'gzip, deflate, br',
-            'Content-Type': 'application/x-www-form-urlencoded; charset=UTF-8',
-            'X-CSRF-Token': csrf_token,
-            'X-Requested-With': 'XMLHttpRequest',
-            'Origin': 'https://auto.am',
-            'Connection': 'keep-alive',
-            'Referer': url,
-            'Cookie': f'XSRF-TOKEN={xsrf_token_cookie}; autoam_session={autoam_session_cookie}'
-        }
-
-        post_data = {
-            'search': json.dumps({
-                "category": "1",
-                "page": "1",
-                "sort": "latest",
-                "layout": "list",
-                "user": {"dealer": "0", "official": "0", "id": ""},
-                "year": {"gt": "1911", "lt": "2025"},
-                "usdprice": {"gt": "0", "lt": "100000000"},
-                "custcleared": "1",
-                "mileage": {"gt": "10", "lt": "10000000"}
-            })
-        }
-
-        # Step 3: Send an HTTP POST request to the search endpoint with CSRF token, cookies, and data
-        post_response = requests.post(post_url, headers=post_headers, data=post_data, verify=False)
-
-        # Check if the POST request was successful (status code 200)
-        if post_response.status_code == 200:
-            soup = BeautifulSoup(post_response.text, 'html.parser')
-            pages_count = int(soup.select(".pagination li a")[-2].text)
-
-            return list(range(1, pages_count+1))
-        else:
-            raise Exception("Failed to make the POST request to the search endpoint. Status code: {}".format(post_response.status_code))
+@timed("get_pages")
+def get_pages(ip_address):
+    state = get_crawl_state()
+    crawl_id = state.get_current_crawl() if state else None
+
+    if crawl_id:
+        # Resume the crawl in progress, only the chunks not done yet are scraped again
+        chunks = unfinished(state.list_chunks(crawl_id))
+        add_metric("ResumedChunks", len(chunks))
     else:
-        raise Exception("Failed to retrieve cookies. Status code: {}".format(response.status_code))
+        refresh_seen_index()
+        pages = split_pages(ip_address)
+
+        # Without a state store the chunks are scraped as they are
+        if not state:
+            return pages
+
+        crawl_id = state.start_crawl(pages)
+        chunks = state.list_chunks(crawl_id)
+
+    # Every PageScrapper invocation records the progress of its chunk under these ids
+    return [dict(chunk["pages"], crawl_id=crawl_id, chunk_id=chunk["chunk_id"]) for chunk in chunks]
+
+def refresh_seen_index():
+    store = get_index_store()
+    if not store:
+        return
+
+    # Every crawl starts from an index rebuilt from the warehouse, so whatever it missed since the last crawl is back in
+    try:
+        conn = get_connection()
+        try:
+            rebuild_index(conn, store)
+        except Exception:
+            reset_connection()
+            raise
+    except Exception as e:
+        # The crawl goes on with the index as it is, a stale index only costs duplicate fetches
+        print(f"Error rebuilding seen index: {str(e)}")
+
+def split_pages(ip_address):
+    chunk_size = int(os.environ.get("PAGES_CHUNK_SIZE", 1))
+    shard_max_pages = int(os.environ.get("SHARD_MAX_PAGES", 0))
+
+    # Split the search into small disjoint shards instead of paginating deep into one query
+    if shard_max_pages > 0:
+        return [
+            dict(chunk, filters=shard)
+            for shard, pages_count in get_shards(ip_address, shard_max_pages)
+            for chunk in get_page_chunks(pages_count, chunk_size)
+        ]
+
+    pages_count = count_pages(ip_address, None)
+
+    return get_page_chunks(pages_count, chunk_size)
+
+def count_pages(ip_address, shard):
+    # The shared client reuses cached cookies and CSRF token across warm invocations, an empty shard counts 0 pages
+    return get_pages_count(get_client(ip_address), get_shard_filters(shard) if shard else None)
+
+def get_page_chunks(pages_count, chunk_size):
+    # Every PageScrapper invocation walks one range of pages with a single session
+    return [
+        {"start": start, "end": min(start + chunk_size - 1, pages_count)}
+        for start in range(1, pages_count + 1, chunk_size)
+    ]
+
+def split_range(low, high, parts, geometric):
+    # Returns up to parts inclusive, disjoint ranges covering low..high
+    bounds = []
+    for part in range(1, parts):
+        if geometric:
+            # Prices are spread over orders of magnitude, a geometric split keeps a similar number of listings in each part
+            bound = int((low + 1) * ((high + 1) / (low + 1)) ** (part / parts)) - 1
+        else:
+            bound = low + (high - low + 1) * part // parts - 1
+        if bound >= (bounds[-1] + 1 if bounds else low) and bound < high:
+            bounds.append(bound)
+
+    starts = [low] + [bound + 1 for bound in bounds]
+    return [[start, end] for start, end in zip(starts, bounds + [high])]
+
+def split_shard(shard, parts):
+    year_low, year_high = shard["year"]
+    price_low, price_high = shard["usdprice"]
+
+    # Split by year first, every model year is a natural boundary
+    if year_high > year_low:
+        return [dict(shard, year=years) for years in split_range(year_low, year_high, min(parts, year_high - year_low + 1), False)]
+
+    if price_high > price_low:
+        return [dict(shard, usdprice=prices) for prices in split_range(price_low, price_high, parts, True)]
+
+    return None
+
+def detect_bounds(ip_address):
+    # gt=y, lt=y only finds the listings of year y when the bounds are inclusive, and gt=y-1, lt=y+1 finds them either way
+    for year in BOUNDS_PROBE_YEARS:
+        probe = {"year": [year, year], "usdprice": [int(SEARCH_FILTERS["usdprice"]["gt"]), int(SEARCH_FILTERS["usdprice"]["lt"])]}
+
+        if count_pages(ip_address, dict(probe, bounds=INCLUSIVE_BOUNDS)) > 0:
+            return INCLUSIVE_BOUNDS
+        if count_pages(ip_address, dict(probe, bounds=EXCLUSIVE_BOUNDS)) > 0:
+            return EXCLUSIVE_BOUNDS
+
+    raise Exception("Failed to detect the bounds of the search filters, no listings in years {}".format(BOUNDS_PROBE_YEARS))
+
+def get_shards(ip_address, max_pages):
+    client = get_client(ip_address)
+    bounds = detect_bounds(ip_address)
+    add_metric("ExclusiveBounds", int(bounds == EXCLUSIVE_BOUNDS))
+
+    pending = [{
+        "year": [int(SEARCH_FILTERS["year"]["gt"]), int(SEARCH_FILTERS["year"]["lt"])],
+        "usdprice": [int(SEARCH_FILTERS["usdprice"]["gt"]), int(SEARCH_FILTERS["usdprice"]["lt"])],
+        "bounds": bounds
+    }]
+    shards = []
+
+    # Probe one level of shards at a time in parallel, subdividing the ones with more than max_pages pages
+    with ThreadPoolExecutor(max_workers=client.max_concurrency) as executor:
+        while pending:
+            pages_counts = list(executor.map(lambda shard: count_pages(ip_address, shard), pending))
+            add_metric("ShardProbes", len(pending))
+
+            next_pending = []
+            for shard, pages_count in zip(pending, pages_counts):
+                # Split into as many parts as the shard needs if its listings were spread evenly, at least in two
+                parts = split_shard(shard, max(-(-pages_count // max_pages), 2)) if pages_count > max_pages else None
+
+                if parts:
+                    next_pending += parts
+                elif pages_count > 0:
+                    shards.append((shard, pages_count))
+
+            pending = next_pending
 
+    # The largest shards start first, so the Map state does not end waiting on one long shard
+    return sorted(shards, key=lambda item: -item[1])
@@ -7,8 +7,25 @@ import string
 import requests
 import sys
 import psycopg2
+import psycopg2.errors
 import urllib3
 import traceback
+import re
+
+# A concurrent index build that failed leaves an invalid index behind, which IF NOT EXISTS would then skip forever
+CONCURRENT_INDEX_PATTERN = re.compile(r'CREATE\s+(?:UNIQUE\s+)?INDEX\s+CONCURRENTLY\s+IF\s+NOT\s+EXISTS\s+("?)(\w+)\1', re.IGNORECASE)
+# Scripts run again on every stack update, an object created by an earlier run is the only error that is not a failed migration
+ALREADY_EXISTS_ERRORS = (psycopg2.errors.DuplicateDatabase, psycopg2.errors.DuplicateTable, psycopg2.errors.DuplicateObject)
+
+def drop_invalid_index(cur, execute_script):
+    match = CONCURRENT_INDEX_PATTERN.search(execute_script)
+    if not match:
+        return
+
+    cur.execute("SELECT 1 FROM pg_index JOIN pg_class ON pg_class.oid = pg_index.indexrelid WHERE pg_class.relname = %s AND NOT pg_index.indisvalid", (match.group(2),))
+    if cur.fetchone():
+        print("Dropping invalid index %s before building it again" % match.group(2))
+        cur.execute('DROP INDEX CONCURRENTLY IF EXISTS "%s"' % match.group(2))
 
 def lambda_handler(event, context):
     responseBody = {
@@ -44,10 +61,10 @@ def lambda_handler(event, context):
                                 cur.execute(execute_script)
 
                                 cur.close()
-                            except:
+                            except ALREADY_EXISTS_ERRORS:
                                 traceback.print_exc()
 
-                    conn.close()
+                        conn.close()
                 for execute_item in event['ResourceProperties']['RdsProperties']['Execute']:
                     database_name = execute_item['DatabaseName']
                     if database_name != "postgres":
@@ -56,11 +73,12 @@ def lambda_handler(event, context):
                         for execute_script in execute_item['Scripts']:
                             try:
                                 cur = conn.cursor()
+                                drop_invalid_index(cur, execute_script)
                                 print("Executing SQL in database '%s': %s" % (database_name, execute_script))
                                 cur.execute(execute_script)
 
                                 cur.close()
-                            except:
+                            except ALREADY_EXISTS_ERRORS:
                                 traceback.print_exc()
 
                         conn.close()
@@ -123,11 +141,12 @@ def lambda_handler(event, context):
             
             print("Finished DB users")
             
-    except:
+    except Exception as e:
+        # A failed migration fails the stack update, so the schema is never left half migrated behind a SUCCESS
         traceback.print_exc()
         responseBody = {
             'Status': 'FAILED',
-            'Reason': '',
+            'Reason': str(e)[:1000],
             'PhysicalResourceId': event.get('PhysicalResourceId',event['LogicalResourceId']),
             'StackId': event['StackId'],
             'RequestId': event['RequestId'],
@@ -0,0 +1,268 @@
+import os
+import re
+import json
+import time
+import threading
+import requests
+from html import unescape
+from requests.adapters import HTTPAdapter
+from requests.packages.urllib3.exceptions import InsecureRequestWarning
+from rate_limiter import get_rate_limiter
+from fetch_policy import RetryPolicy, CircuitBreaker, parse_retry_after, get_max_wait
+from metrics import add_metric, stage, timed
+
+requests.packages.urllib3.disable_warnings(InsecureRequestWarning)
+
+# The CSRF token and session cookies are refreshed after this many seconds, or earlier if auto.am rejects them
+DEFAULT_TOKEN_TTL = 1800
+# Upper bound of in-flight requests to one auto.am host, shared by every thread using the client
+DEFAULT_MAX_CONCURRENCY = 4
+# Connecting to a healthy host takes milliseconds, the read timeout covers auto.am rendering the page
+DEFAULT_CONNECT_TIMEOUT = 3.05
+DEFAULT_REQUEST_TIMEOUT = 10
+DEFAULT_SCHEME = "https"
+TOKEN_EXPIRED_STATUS_CODES = (401, 419)
+
+CSRF_META_PATTERN = re.compile(r'<meta[^>]+name=["\']csrf-token["\'][^>]*>', re.IGNORECASE)
+CONTENT_ATTR_PATTERN = re.compile(r'content=["\']([^"\']*)["\']', re.IGNORECASE)
+MAKE_SELECT_PATTERN = re.compile(r'<select[^>]+name=["\']make["\'][^>]*>(.*?)</select>', re.IGNORECASE | re.DOTALL)
+OPTION_PATTERN = re.compile(r'<option[^>]*value=["\']([^"\']+)["\'][^>]*>([^<]*)</option>', re.IGNORECASE)
+
+SEARCH_FILTERS = {
+    "category": "1",
+    "sort": "latest",
+    "layout": "list",
+    "user": {"dealer": "0", "official": "0", "id": ""},
+    "year": {"gt": "1911", "lt": "2025"},
+    "usdprice": {"gt": "0", "lt": "100000000"},
+    "custcleared": "1",
+    "mileage": {"gt": "10", "lt": "10000000"}
+}
+
+
+# Whether auto.am treats the gt/lt bounds of a range filter as inclusive is not documented, GetPages detects it
+INCLUSIVE_BOUNDS = "inclusive"
+EXCLUSIVE_BOUNDS = "exclusive"
+
+
+def get_range_filter(low, high, bounds=INCLUSIVE_BOUNDS):
+    # The filter that matches exactly low..high, both ends included
+    if bounds == EXCLUSIVE_BOUNDS:
+        return {"gt": str(low - 1), "lt": str(high + 1)}
+
+    return {"gt": str(low), "lt": str(high)}
+
+
+def get_shard_filters(shard):
+    # A shard of the full crawl only overrides the year and price ranges of the default search, both ends of a shard
+    # are inclusive and a single year [y, y] is a valid shard. The bound semantics travel with the shard
+    bounds = shard.get("bounds", INCLUSIVE_BOUNDS)
+    filters = dict(SEARCH_FILTERS)
+    filters["year"] = get_range_filter(*shard["year"], bounds)
+    filters["usdprice"] = get_range_filter(*shard["usdprice"], bounds)
+
+    return filters
+
+
+def parse_csrf_token(html):
+    # Only the meta tag is needed, so avoid building a full BeautifulSoup tree of the homepage
+    meta_tag = CSRF_META_PATTERN.search(html)
+    content = CONTENT_ATTR_PATTERN.search(meta_tag.group(0)) if meta_tag else None
+
+    if not content:
+        raise Exception("Failed to find the CSRF token on the homepage.")
+
+    return content.group(1)
+
+
+def parse_makes(html):
+    # Names of the makes in the make filter of the search form, the empty option is the placeholder
+    select = MAKE_SELECT_PATTERN.search(html)
+    if not select:
+        return ()
+
+    return tuple(unescape(text).strip() for _, text in OPTION_PATTERN.findall(select.group(1)) if text.strip())
+
+
+class AutoAmClient:
+    def __init__(self, ip_address, token_ttl=None, max_concurrency=None, timeout=None, rate_limiter=None, scheme=None,
+                 connect_timeout=None, retry_policy=None, circuit_breaker=None, max_wait=None):
+        self.ip_address = ip_address
+        self.rate_limiter = rate_limiter
+        self.max_wait = max_wait if max_wait is not None else get_max_wait()
+        # http is only used against the local mock server of the benchmarks
+        self.scheme = scheme or os.environ.get("AUTOAM_SCHEME", DEFAULT_SCHEME)
+        self.base_url = "{}://{}/lang/en".format(self.scheme, ip_address)
+        self.token_ttl = token_ttl if token_ttl is not None else int(os.environ.get("AUTOAM_TOKEN_TTL", DEFAULT_TOKEN_TTL))
+        self.max_concurrency = max_concurrency if max_concurrency is not None else int(os.environ.get("AUTOAM_MAX_CONCURRENCY", DEFAULT_MAX_CONCURRENCY))
+        self.timeout = (
+            connect_timeout if connect_timeout is not None else float(os.environ.get("AUTOAM_CONNECT_TIMEOUT", DEFAULT_CONNECT_TIMEOUT)),
+            timeout if timeout is not None else float(os.environ.get("AUTOAM_REQUEST_TIMEOUT", DEFAULT_REQUEST_TIMEOUT))
+        )
+        self.retry_policy = retry_policy or RetryPolicy()
+        self.circuit_breaker = circuit_breaker or CircuitBreaker(rate_limiter, max_wait=self.max_wait)
+
+        # One keep-alive connection pool is reused for every request made through this client
+        self.session = requests.Session()
+        self.session.verify = False
+        self.session.mount("{}://".format(self.scheme), HTTPAdapter(pool_connections=1, pool_maxsize=self.max_concurrency))
+        self._slots = threading.BoundedSemaphore(self.max_concurrency)
+
+        self._lock = threading.Lock()
+        self._csrf_token = None
+        self._cookie_header = None
+        self._token_fetched_at = 0.0
+        self._refreshing = None
+        self.makes = ()
+
+    def wait_for_rate_limit(self):
+        # The rate limiter is shared by every worker talking to auto.am, not only this process
+        if self.rate_limiter is not None:
+            with stage("rate_limit_wait"):
+                self.rate_limiter.acquire(self.max_wait)
+
+    def send(self, method, url, **kwargs):
+        kwargs.setdefault("timeout", self.timeout)
+
+        for attempt in range(self.retry_policy.max_attempts):
+            # An open circuit holds back every request until auto.am had time to recover
+            self.circuit_breaker.wait()
+            self.wait_for_rate_limit()
+
+            try:
+                with self._slots, stage("http_request"):
+                    response = self.session.request(method, url, **kwargs)
+            except (requests.ConnectionError, requests.Timeout) as e:
+                response, error = None, e
+            else:
+                add_metric("BytesDownloaded", len(response.content), "Bytes")
+
+            if not self.retry_policy.is_retryable(response):
+                self.circuit_breaker.record_success()
+                return response
+
+            # 429 and 5xx responses, timeouts and refused connections are retried after a backoff
+            self.circuit_breaker.record_failure(parse_retry_after(response))
+            delay = self.retry_policy.get_delay(attempt, response)
+            if delay is None:
+                break
+
+            add_metric("Retries")
+            time.sleep(delay)
+
+        if response is None:
+            raise error
+
+        return response
+
+    @timed("cookie_fetch")
+    def refresh_token(self):
+        # Send an HTTP GET request to the homepage to obtain the cookies and CSRF token
+        response = self.send("GET", self.base_url)
+
+        # Check if the request was successful (status code 200)
+        if response.status_code != 200:
+            raise Exception("Failed to retrieve cookies. Status code: {}".format(response.status_code))
+
+        autoam_session_cookie = response.cookies.get("autoam_session")
+        xsrf_token_cookie = response.cookies.get("XSRF-TOKEN")
+
+        csrf_token = parse_csrf_token(response.text)
+        cookie_header = f'XSRF-TOKEN={xsrf_token_cookie}; autoam_session={autoam_session_cookie}'
+        makes = parse_makes(response.text)
+
+        with self._lock:
+            # A homepage without the make filter keeps the list of the previous visit
+            self.makes = makes or self.makes
+            self._csrf_token = csrf_token
+            self._cookie_header = cookie_header
+            self._token_fetched_at = time.monotonic()
+
+        return csrf_token, cookie_header
+
+    def get_token(self):
+        # The homepage is requested outside the lock, one thread refreshes the token while the others wait for it
+        while True:
+            with self._lock:
+                if self._csrf_token is not None and time.monotonic() - self._token_fetched_at <= self.token_ttl:
+                    return self._csrf_token, self._cookie_header
+
+                refreshing = self._refreshing
+                if refreshing is None:
+                    self._refreshing = refreshing = threading.Event()
+                    break
+
+                # A token past its TTL is still accepted by auto.am, keep using it until the refresh is done
+                if self._csrf_token is not None:
+                    return self._csrf_token, self._cookie_header
+
+            # A failed refresh leaves the token unset, the next waiter tries again
+            refreshing.wait()
+
+        try:
+            return self.refresh_token()
+        finally:
+            with self._lock:
+                self._refreshing = None
+            refreshing.set()
+
+    def invalidate_token(self, csrf_token):
+        with self._lock:
+            # Another thread may have refreshed the token already
+            if self._csrf_token == csrf_token:
+                self._csrf_token = None
+
+    def get_headers(self, csrf_token, cookie_header):
+        return {
+            'Host': 'auto.am',  # Set the Host header
+            'Accept': '*/*',
+            'Accept-Language': 'en-US,en;q=0.5',
+            'Accept-Encoding': 'gzip, deflate, br',
+            'Content-Type': 'application/x-www-form-urlencoded; charset=UTF-8',
+            'X-CSRF-Token': csrf_token,
+            'X-Requested-With': 'XMLHttpRequest',
+            'Origin': 'https://auto.am',
+            'Connection': 'keep-alive',
+            'Referer': self.base_url,
+            'Cookie': cookie_header
+        }
+
+    def request(self, method, path, headers=None, **kwargs):
+        url = "{}://{}{}".format(self.scheme, self.ip_address, path)
+
+        for attempt in range(2):
+            csrf_token, cookie_header = self.get_token()
+            request_headers = self.get_headers(csrf_token, cookie_header)
+            request_headers.update(headers or {})
+
+            response = self.send(method, url, headers=request_headers, **kwargs)
+
+            # An expired session is answered with 419/401, refresh the token once and try again
+            if response.status_code in TOKEN_EXPIRED_STATUS_CODES and attempt == 0:
+                self.invalidate_token(csrf_token)
+                add_metric("Retries")
+                continue
+
+            return response
+
+    def search(self, page_number, filters=None):
+        search = dict(SEARCH_FILTERS if filters is None else filters)
+        search["page"] = page_number
+
+        return self.request("POST", "/search", data={'search': json.dumps(search)})
+
+    def get_listing(self, listing_url, headers=None):
+        return self.request("GET", listing_url, headers=headers)
+
+
+# Clients are kept at module scope so warm Lambda invocations reuse the session, connections and token
+_clients = {}
+_clients_lock = threading.Lock()
+
+
+def get_client(ip_address):
+    with _clients_lock:
+        if ip_address not in _clients:
+            _clients[ip_address] = AutoAmClient(ip_address, rate_limiter=get_rate_limiter())
+
+        return _clients[ip_address]
@@ -0,0 +1,218 @@
+import os
+import json
+import hashlib
+from metrics import add_metric, stage
+from config_cache import get_secret, invalidate_secret
+
+# boto3 and psycopg2 are imported where they are used, so importing this module stays cheap
+
+LISTING_COLUMN_TYPES = (
+    ("listing_id", "int4"), ("year", "int4"), ("make", "varchar"), ("model", "varchar"),
+    ("vin", "varchar"), ("is_negotiable", "bool"), ("is_urgent", "bool"),
+    ("is_exchangable", "bool"), ("pay_with_installments", "bool"), ("insert_date", "date"),
+    ("location", "varchar"), ("price", "int4"), ("seller_id", "int4"), ("details", "jsonb"),
+    ("options", "text"), ("content_hash", "varchar")
+)
+LISTING_COLUMNS = tuple(column for column, _ in LISTING_COLUMN_TYPES)
+
+# Casts for the VALUES rows, a column that is NULL in every row would otherwise be typed as text
+LISTING_ROW_TEMPLATE = "({})".format(", ".join("%s::{}".format(column_type) for _, column_type in LISTING_COLUMN_TYPES))
+
+# The connection is kept at module scope so warm Lambda invocations reuse it, the secret is cached by config_cache
+_connection = None
+
+
+def get_master_credential():
+    # Get PostgreSQL credentials.
+    return get_secret(os.environ.get("RDS_SECRET_ARN"))
+
+
+def connect_with_secret(psycopg2):
+    master_credential = get_master_credential()
+
+    with stage("db_connect"):
+        return psycopg2.connect(
+            host=os.environ.get("RDS_ENDPOINT"),
+            port=os.environ.get("RDS_PORT"),
+            user=master_credential['username'],
+            password=master_credential['password'],
+            database=os.environ.get('RDS_DATABASE_NAME')
+        )
+
+
+def get_connection():
+    global _connection
+
+    if _connection is None or _connection.closed:
+        import psycopg2
+
+        # Local runs and benchmarks connect with a plain DSN instead of the RDS secret
+        if os.environ.get("DATABASE_URL"):
+            with stage("db_connect"):
+                _connection = psycopg2.connect(os.environ.get("DATABASE_URL"))
+            return _connection
+
+        # Connect to the PostgreSQL database
+        try:
+            _connection = connect_with_secret(psycopg2)
+        except psycopg2.OperationalError as e:
+            if "authentication failed" not in str(e):
+                raise
+
+            # The cached password was rotated, fetch the current secret and connect again
+            invalidate_secret(os.environ.get("RDS_SECRET_ARN"))
+            _connection = connect_with_secret(psycopg2)
+
+    return _connection
+
+
+def reset_connection():
+    global _connection
+
+    # Drop a connection that is broken or left in a failed transaction, the next call reconnects
+    if _connection is not None:
+        try:
+            _connection.close()
+        except Exception:
+            pass
+
+    _connection = None
+
+
+def listing_to_row(data):
+    row = (
+        data["listing_id"], data["car_year"], data["car_make"], data["car_model"],
+        data["car_vin"], data["car_is_negotiable"], data["car_is_urgent"],
+        data["car_is_exchangable"], data["car_pay_with_installments"],
+        data["car_insert_date"], data["car_location"],
+        data["car_price"], data["car_seller_id"],
+        json.dumps(data["car_details"], sort_keys=True), data["car_options"]
+    )
+
+    # The hash of the extracted fields tells whether a re-scraped listing changed
+    content_hash = hashlib.sha256(json.dumps([str(value) for value in row]).encode("utf-8")).hexdigest()
+
+    return row + (content_hash,)
+
+
+def upsert_sql(incoming_sql):
+    columns = ", ".join(LISTING_COLUMNS)
+    updates = ", ".join("{0} = EXCLUDED.{0}".format(column) for column in LISTING_COLUMNS if column != "listing_id")
+
+    # Rows are only rewritten when their content hash changed, or to clear removed_at of a listing that came back after
+    # a transient 404. Every statement of the WITH sees the table as it was before the upsert, so the join compares the
+    # new price with the previous one.
+    return """
+    WITH incoming ({columns}) AS ({incoming_sql}),
+    upserted AS (
+        INSERT INTO cars_raw_data ({columns})
+        SELECT {columns} FROM incoming
+        ON CONFLICT (listing_id) DO UPDATE SET {updates}, updated_at = now(), removed_at = NULL
+        WHERE cars_raw_data.content_hash IS DISTINCT FROM EXCLUDED.content_hash OR cars_raw_data.removed_at IS NOT NULL
+        RETURNING listing_id, price, is_negotiable
+    )
+    INSERT INTO cars_price_history (listing_id, price, is_negotiable)
+    SELECT upserted.listing_id, upserted.price, upserted.is_negotiable
+    FROM upserted
+    LEFT JOIN cars_raw_data previous ON previous.listing_id = upserted.listing_id
+    WHERE previous.listing_id IS NULL OR previous.price IS DISTINCT FROM upserted.price
+    """.format(columns=columns, updates=updates, incoming_sql=incoming_sql)
+
+
+def upsert_listings(cursor, listings):
+    from psycopg2.extras import execute_values
+
+    if not listings:
+        return
+
+    # Keep the last scraped version of a listing that shows up twice in the same batch
+    rows = {str(data["listing_id"]): listing_to_row(data) for data in listings}
+
+    execute_values(cursor, upsert_sql("VALUES %s"), list(rows.values()), template=LISTING_ROW_TEMPLATE, page_size=max(len(rows), 1))
+    add_metric("RowsWritten", len(rows))
+
+
+def mark_listings_removed(cursor, listing_ids):
+    if not listing_ids:
+        return
+
+    cursor.execute(
+        "UPDATE cars_raw_data SET removed_at = now() WHERE listing_id = ANY(%s) AND removed_at IS NULL",
+        ([int(listing_id) for listing_id in listing_ids],)
+    )
+    add_metric("RowsRemoved", cursor.rowcount)
+
+
+def write_listings(conn, listings):
+    # Scraped listings and the ones found removed are committed together
+    try:
+        with conn.cursor() as cursor:
+            upsert_listings(cursor, [data for data in listings if not data.get("removed")])
+            mark_listings_removed(cursor, [data["listing_id"] for data in listings if data.get("removed")])
+
+        conn.commit()
+    except Exception:
+        if not conn.closed:
+            conn.rollback()
+        raise
+
+
+def find_known_listing_ids(cursor, listing_ids):
+    if not listing_ids:
+        return set()
+
+    # One round trip for a whole page of listings instead of one query per listing
+    cursor.execute("SELECT listing_id FROM cars_raw_data WHERE listing_id = ANY(%s)", ([int(listing_id) for listing_id in listing_ids],))
+
+    return {str(row[0]) for row in cursor.fetchall()}
+
+
+def upsert_cards_sql():
+    # Listings from search result cards only carry the card fields. A listing already in the warehouse only gets its price
+    # updated, the rest of its columns come from the listing page. content_hash stays NULL until the listing page is scraped.
+    return """
+    WITH incoming (listing_id, "year", make, model, price, is_negotiable) AS (VALUES %s),
+    upserted AS (
+        INSERT INTO cars_raw_data (listing_id, "year", make, model, price, is_negotiable)
+        SELECT listing_id, "year", make, model, price, is_negotiable FROM incoming
+        ON CONFLICT (listing_id) DO UPDATE SET price = EXCLUDED.price, is_negotiable = EXCLUDED.is_negotiable, updated_at = now(), removed_at = NULL
+        WHERE EXCLUDED.price IS NOT NULL
+          AND (cars_raw_data.price IS DISTINCT FROM EXCLUDED.price OR cars_raw_data.removed_at IS NOT NULL)
+        RETURNING listing_id, price, is_negotiable
+    )
+    INSERT INTO cars_price_history (listing_id, price, is_negotiable)
+    SELECT upserted.listing_id, upserted.price, upserted.is_negotiable
+    FROM upserted
+    LEFT JOIN cars_raw_data previous ON previous.listing_id = upserted.listing_id
+    WHERE previous.listing_id IS NULL OR previous.price IS DISTINCT FROM upserted.price
+    """
+
+
+def upsert_cards(cursor, cards):
+    from psycopg2.extras import execute_values
+
+    if not cards:
+        return
+
+    rows = {
+        str(card["listing_id"]): (card["listing_id"], card["car_year"], card["car_make"], card["car_model"], card["car_price"], card["car_is_negotiable"])
+        for card in cards
+    }
+
+    execute_values(cursor, upsert_cards_sql(), list(rows.values()), template="(%s::int4, %s::int4, %s::varchar, %s::varchar, %s::int4, %s::bool)", page_size=max(len(rows), 1))
+    add_metric("CardRowsWritten", len(rows))
+
+
+def insert_cards(cards):
+    # The connection is cached at module scope and reused by warm invocations
+    conn = get_connection()
+
+    try:
+        with conn.cursor() as cursor:
+            upsert_cards(cursor, cards)
+
+        conn.commit()
+    except Exception:
+        # Nothing of the page is committed, the caller retries it and the next call reconnects
+        reset_connection()
+        raise
@@ -0,0 +1,217 @@
+"""Single-process crawl of auto.am straight into the warehouse.
+
+Runs the whole pipeline of the Step Functions crawl in one asyncio event loop,
+without Lambda invocations or SQS in between: search pages are scraped for
+listing URLs, the listings are fetched and extracted, and the results are
+upserted into cars_raw_data in batches. The stages are connected by bounded
+queues, so a slow stage holds back the ones before it instead of buffering the
+whole site in memory. The blocking client, extractor and database calls run in
+threads, the shared rate limiter still applies to every request.
+
+    python backfill.py 10.0.0.1 [--start 1] [--end 500] [--concurrency 16] [--skip-seen]
+"""
+import os
+import sys
+import time
+import asyncio
+import argparse
+from concurrent.futures import ThreadPoolExecutor
+from autoam_client import AutoAmClient
+from listing_fetcher import ListingNotFound, get_listing_id, get_page_urls, get_pages_count, fetch_listing
+from autoam_db import write_listings
+from rate_limiter import get_rate_limiter
+
+DEFAULT_CONCURRENCY = 8
+DEFAULT_PAGE_CONCURRENCY = 2
+DEFAULT_BATCH_SIZE = 500
+DEFAULT_FLUSH_INTERVAL = 5
+DEFAULT_QUEUE_SIZE = 1000
+
+# Marks the end of a queue for its consumers
+DONE = None
+
+
+class Stats:
+    def __init__(self):
+        self.started_at = time.monotonic()
+        self.pages = 0
+        self.failed_pages = 0
+        self.urls = 0
+        self.listings = 0
+        self.removed = 0
+        self.failed = 0
+        self.written = 0
+
+    def report(self):
+        elapsed = time.monotonic() - self.started_at
+        return "{} pages, {} failed pages, {} urls, {} listings, {} removed, {} failed, {} written in {:.1f}s ({:.1f} listings/s)".format(
+            self.pages, self.failed_pages, self.urls, self.listings, self.removed, self.failed, self.written, elapsed, self.written / max(elapsed, 1e-9)
+        )
+
+
+def fetch_listing_or_removed(client, listing_url):
+    try:
+        return fetch_listing(client, listing_url)
+    except ListingNotFound:
+        # The listing was sold or deleted, it is marked as removed
+        return {"listing_id": get_listing_id(listing_url), "removed": True}
+
+
+async def page_worker(client, pages, urls, seen, stats):
+    while True:
+        page_number = await pages.get()
+        if page_number is DONE:
+            return
+
+        try:
+            page_urls = await asyncio.to_thread(get_page_urls, client, page_number)
+        except Exception as e:
+            print("Error scraping page {}: {}".format(page_number, e), file=sys.stderr)
+            stats.failed_pages += 1
+            continue
+
+        stats.pages += 1
+        for listing_url in page_urls:
+            if seen is not None and listing_url.split("/")[2] in seen:
+                continue
+
+            # Blocks while the listing workers are behind
+            await urls.put(listing_url)
+            stats.urls += 1
+
+
+async def listing_worker(client, urls, results, stats):
+    while True:
+        listing_url = await urls.get()
+        if listing_url is DONE:
+            return
+
+        try:
+            data = await asyncio.to_thread(fetch_listing_or_removed, client, listing_url)
+        except Exception as e:
+            print("Error scraping {}: {}".format(listing_url, e), file=sys.stderr)
+            stats.failed += 1
+            continue
+
+        if data.get("removed"):
+            stats.removed += 1
+        else:
+            stats.listings += 1
+
+        await results.put(data)
+
+
+def write_split(write, batch):
+    # One bad row fails the whole transaction, the batch is halved until the bad rows are written alone.
+    # Returns the number of listings written and the number that failed
+    try:
+        write(batch)
+        return len(batch), 0
+    except Exception as e:
+        if len(batch) == 1:
+            print("Error writing listing {}: {}".format(batch[0].get("listing_id"), e), file=sys.stderr)
+            return 0, 1
+
+    middle = len(batch) // 2
+    written_first, failed_first = write_split(write, batch[:middle])
+    written_second, failed_second = write_split(write, batch[middle:])
+
+    return written_first + written_second, failed_first + failed_second
+
+
+async def writer(write, results, stats, batch_size, flush_interval):
+    batch = []
+    deadline = time.monotonic() + flush_interval
+    done = False
+
+    while not done:
+        try:
+            data = await asyncio.wait_for(results.get(), timeout=max(deadline - time.monotonic(), 0))
+        except asyncio.TimeoutError:
+            data = False
+
+        if data is DONE:
+            done = True
+        elif data:
+            batch.append(data)
+
+        # A batch is written when it is full, when it waited long enough or at the end
+        if batch and (done or len(batch) >= batch_size or time.monotonic() >= deadline):
+            # Failures never leave the writer, otherwise the listing workers would block forever on a full queue
+            written, failed = await asyncio.to_thread(write_split, write, batch)
+            stats.written += written
+            stats.failed += failed
+            batch = []
+
+        if time.monotonic() >= deadline:
+            deadline = time.monotonic() + flush_interval
+
+
+async def run(client, write, start_page, end_page, concurrency=DEFAULT_CONCURRENCY, page_concurrency=DEFAULT_PAGE_CONCURRENCY,
+              batch_size=DEFAULT_BATCH_SIZE, flush_interval=DEFAULT_FLUSH_INTERVAL, queue_size=DEFAULT_QUEUE_SIZE, seen=None):
+    # The blocking calls of every worker and the writer each get a thread
+    asyncio.get_running_loop().set_default_executor(ThreadPoolExecutor(max_workers=concurrency + page_concurrency + 1))
+
+    stats = Stats()
+    pages = asyncio.Queue()
+    urls = asyncio.Queue(maxsize=queue_size)
+    results = asyncio.Queue(maxsize=queue_size)
+
+    for page_number in range(start_page, end_page + 1):
+        pages.put_nowait(page_number)
+    for _ in range(page_concurrency):
+        pages.put_nowait(DONE)
+
+    page_workers = [asyncio.create_task(page_worker(client, pages, urls, seen, stats)) for _ in range(page_concurrency)]
+    listing_workers = [asyncio.create_task(listing_worker(client, urls, results, stats)) for _ in range(concurrency)]
+    writer_task = asyncio.create_task(writer(write, results, stats, batch_size, flush_interval))
+
+    # Each stage is closed once the stage before it has finished
+    await asyncio.gather(*page_workers)
+    for _ in listing_workers:
+        await urls.put(DONE)
+
+    await asyncio.gather(*listing_workers)
+    await results.put(DONE)
+
+    await writer_task
+    return stats
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("ip_address", nargs="?", default=os.environ.get("AUTOAM_IP_ADDRESS"))
+    parser.add_argument("--start", type=int, default=1)
+    parser.add_argument("--end", type=int, help="last search page, all pages by default")
+    parser.add_argument("--concurrency", type=int, default=DEFAULT_CONCURRENCY, help="listings fetched in parallel")
+    parser.add_argument("--page-concurrency", type=int, default=DEFAULT_PAGE_CONCURRENCY, help="search pages scraped in parallel")
+    parser.add_argument("--batch-size", type=int, default=DEFAULT_BATCH_SIZE)
+    parser.add_argument("--flush-interval", type=float, default=DEFAULT_FLUSH_INTERVAL, help="seconds before a partial batch is written")
+    parser.add_argument("--queue-size", type=int, default=DEFAULT_QUEUE_SIZE)
+    parser.add_argument("--skip-seen", action="store_true", help="skip the listings already in the seen index")
+    args = parser.parse_args()
+
+    if not args.ip_address:
+        raise Exception("AUTOAM_IP_ADDRESS environment variable is not set.")
+
+    from autoam_db import get_connection
+    from seen_index import load_index, record_listings
+
+    conn = get_connection()
+    client = AutoAmClient(args.ip_address, max_concurrency=args.concurrency + args.page_concurrency, rate_limiter=get_rate_limiter())
+    end_page = args.end or get_pages_count(client)
+    seen = load_index() if args.skip_seen else None
+
+    def write(batch):
+        write_listings(conn, batch)
+        record_listings([data["listing_id"] for data in batch if not data.get("removed")])
+
+    stats = asyncio.run(run(
+        client, write, args.start, end_page, args.concurrency, args.page_concurrency,
+        args.batch_size, args.flush_interval, args.queue_size, seen
+    ))
+    print(stats.report(), file=sys.stderr)
+
+
+if __name__ == "__main__":
+    main()
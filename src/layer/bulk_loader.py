@@ -0,0 +1,219 @@
+"""Bulk ingest of scraped listings through gzipped NDJSON files.
+
+Scraped listings are appended in batches to gzipped NDJSON files in S3 or a
+local directory, which also keeps a replayable raw archive. A scheduled load
+takes every file written since the last one, streams many files at a time into
+a temporary staging table with COPY FROM STDIN, and merges them into
+cars_raw_data with the same set-based upsert as the warehouse provisioner, in
+one transaction per group of files.
+
+    python bulk_loader.py listings/2024-03-12/ s3://bucket/listings/2024-03-12/batch.ndjson.gz [--files-per-load 100]
+"""
+import os
+import sys
+import gzip
+import json
+import uuid
+import argparse
+import itertools
+from datetime import date, datetime, timedelta, timezone
+from autoam_db import LISTING_COLUMNS, LISTING_COLUMN_TYPES, listing_to_row, upsert_sql, mark_listings_removed
+from storage import LocalStore, get_store, open_store
+
+DEFAULT_ARCHIVE_PREFIX = "listings/"
+STAGING_TABLE = "cars_raw_data_staging"
+DEFAULT_FILES_PER_LOAD = 100
+# Files named within this many seconds of a scheduled load are left for the next one
+DEFAULT_LOAD_LAG = 120
+# The key of the last loaded file, kept next to the files
+LOADED_KEY = "_loaded.json"
+
+
+def get_archive_store():
+    store = get_store("LISTINGS_ARCHIVE_BUCKET", "LISTINGS_ARCHIVE_DIR", DEFAULT_ARCHIVE_PREFIX)
+    if not store:
+        raise Exception("LISTINGS_ARCHIVE_BUCKET or LISTINGS_ARCHIVE_DIR environment variable is not set.")
+
+    return store
+
+
+def write_batch(listings, store=None):
+    store = store or get_archive_store()
+
+    # One gzipped NDJSON file per batch, partitioned by the day it was scraped and named in write order
+    now = datetime.now(timezone.utc)
+    key = "{}{}/{}-{}.ndjson.gz".format(store.prefix, now.date().isoformat(), now.strftime("%H%M%S%f"), uuid.uuid4().hex[:8])
+    body = "".join(json.dumps(data) + "\n" for data in listings)
+    store.put(key, gzip.compress(body.encode("utf-8")))
+
+    return key
+
+
+def copy_value(value):
+    # COPY text format: \N is NULL, backslash and control characters are escaped
+    if value is None:
+        return "\\N"
+    if isinstance(value, bool):
+        return "t" if value else "f"
+
+    return str(value).replace("\\", "\\\\").replace("\t", "\\t").replace("\n", "\\n").replace("\r", "\\r")
+
+
+class CopyStream:
+    # File-like object that renders COPY lines on demand, so a file is streamed instead of loaded into memory
+    def __init__(self, lines):
+        self.lines = lines
+        self.buffer = ""
+
+    def read(self, size=-1):
+        while size < 0 or len(self.buffer) < size:
+            line = next(self.lines, None)
+            if line is None:
+                break
+            self.buffer += line
+
+        if size < 0:
+            size = len(self.buffer)
+
+        chunk, self.buffer = self.buffer[:size], self.buffer[size:]
+        return chunk
+
+
+def copy_lines(fileobjs, removed_listing_ids):
+    # Lines are numbered across all the files of a load, in the order the files were written
+    seq = itertools.count()
+
+    for fileobj in fileobjs:
+        for line in gzip.GzipFile(fileobj=fileobj):
+            data = json.loads(line)
+
+            # Listings that answered 404/410 carry no fields, they are only marked as removed
+            if data.get("removed"):
+                removed_listing_ids[int(data["listing_id"])] = next(seq)
+                continue
+
+            yield "\t".join(copy_value(value) for value in listing_to_row(data) + (next(seq),)) + "\n"
+
+
+def load_files(conn, fileobjs):
+    # Every file is streamed into one staging table and merged into cars_raw_data in a single transaction
+    removed_listing_ids = {}
+    columns = ", ".join(LISTING_COLUMNS)
+
+    try:
+        with conn.cursor() as cursor:
+            cursor.execute("CREATE TEMP TABLE {} ({}, seq int8) ON COMMIT DROP".format(
+                STAGING_TABLE, ", ".join("{} {}".format(column, column_type) for column, column_type in LISTING_COLUMN_TYPES)
+            ))
+
+            cursor.copy_expert(
+                "COPY {} ({}, seq) FROM STDIN".format(STAGING_TABLE, columns),
+                CopyStream(copy_lines(fileobjs, removed_listing_ids))
+            )
+
+            # The last line of a listing wins, like the last write of the row-at-a-time path
+            cursor.execute(upsert_sql("SELECT DISTINCT ON (listing_id) {} FROM {} ORDER BY listing_id, seq DESC".format(columns, STAGING_TABLE)))
+
+            cursor.execute("SELECT listing_id, max(seq) FROM {} GROUP BY listing_id".format(STAGING_TABLE))
+            last_seq = dict(cursor.fetchall())
+
+            # A listing scraped again after it was gone in an earlier file of the same load stays listed
+            mark_listings_removed(cursor, [listing_id for listing_id, seq in removed_listing_ids.items() if last_seq.get(listing_id, -1) < seq])
+
+        conn.commit()
+    except Exception:
+        conn.rollback()
+        raise
+
+    return list(last_seq)
+
+
+def open_keys(store, keys):
+    # Files are opened one at a time while the COPY reads them, a load of many files holds one stream
+    for key in keys:
+        fileobj = store.open(key)
+        try:
+            yield fileobj
+        finally:
+            fileobj.close()
+
+
+def load_keys(conn, store, keys):
+    return load_files(conn, open_keys(store, keys))
+
+
+def get_loaded_key(store):
+    data = store.get(store.prefix + LOADED_KEY)
+    return json.loads(data)["key"] if data else None
+
+
+def put_loaded_key(store, key):
+    store.put(store.prefix + LOADED_KEY, json.dumps({"key": key}).encode("utf-8"))
+
+
+def pending_keys(store, lag=DEFAULT_LOAD_LAG):
+    loaded = get_loaded_key(store)
+    now = datetime.now(timezone.utc)
+
+    if loaded:
+        # Only the days from the last loaded file on are listed, not the whole archive
+        day = date.fromisoformat(loaded[len(store.prefix):].split("/")[0])
+        prefixes = ["{}{}/".format(store.prefix, (day + timedelta(days=days)).isoformat()) for days in range((now.date() - day).days + 1)]
+    else:
+        prefixes = [store.prefix]
+
+    # A file is named when its batch is written, before its upload completes. Files named less than lag seconds ago
+    # are left for the next run, so none shows up later with a name before the last loaded one
+    cutoff = now - timedelta(seconds=lag)
+    cutoff_key = "{}{}/{}".format(store.prefix, cutoff.date().isoformat(), cutoff.strftime("%H%M%S%f"))
+
+    keys = [key for prefix in prefixes for key, _ in store.list(prefix) if key.endswith(".ndjson.gz")]
+    return sorted(key for key in keys if (loaded is None or key > loaded) and key < cutoff_key)
+
+
+def load_pending(conn, store, files_per_load=DEFAULT_FILES_PER_LOAD, lag=DEFAULT_LOAD_LAG):
+    # Yields the keys and listing ids of every committed load, the caller can stop between two loads
+    keys = pending_keys(store, lag)
+
+    for start in range(0, len(keys), files_per_load):
+        batch = keys[start:start + files_per_load]
+        listing_ids = load_keys(conn, store, batch)
+
+        # The marker moves only once the files are committed, files loaded again after a failure are absorbed by the upsert
+        put_loaded_key(store, batch[-1])
+        yield batch, listing_ids
+
+
+def resolve_keys(path):
+    # s3://bucket/prefix, a local directory or a single local file
+    if path.startswith("s3://") or os.path.isdir(path):
+        store = open_store(path)
+    else:
+        return LocalStore(os.path.dirname(path) or "."), [os.path.basename(path)]
+
+    # Keys sort in write order, so later versions of a listing are loaded last
+    keys = sorted(key for key, _ in store.list(store.prefix) if key.endswith(".ndjson.gz"))
+    return store, keys
+
+
+def main():
+    from autoam_db import get_connection
+    from seen_index import record_listings
+
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("paths", nargs="+", help="NDJSON files, local directories or s3://bucket/prefix")
+    parser.add_argument("--files-per-load", type=int, default=DEFAULT_FILES_PER_LOAD, help="files merged in one transaction")
+    args = parser.parse_args()
+
+    conn = get_connection()
+    for path in args.paths:
+        store, keys = resolve_keys(path)
+        for start in range(0, len(keys), args.files_per_load):
+            batch = keys[start:start + args.files_per_load]
+            listing_ids = load_keys(conn, store, batch)
+            record_listings(listing_ids)
+            print("{} files up to {}: {} listings".format(len(batch), batch[-1], len(listing_ids)), file=sys.stderr)
+
+
+if __name__ == "__main__":
+    main()
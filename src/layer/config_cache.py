@@ -0,0 +1,86 @@
+import os
+import json
+import time
+import threading
+from metrics import add_metric, stage
+
+DEFAULT_SECRET_TTL = 3600
+DEFAULT_PARAMETER_TTL = 300
+
+# Everything is kept at module scope, so warm invocations make no control-plane calls
+_clients = {}
+_values = {}
+_lock = threading.Lock()
+
+
+def get_boto3_client(service_name):
+    # Creating a client costs tens of milliseconds of botocore loading, each one is created once per process.
+    # boto3 clients are thread-safe, the worker threads of a handler share them
+    with _lock:
+        if service_name not in _clients:
+            import boto3
+            _clients[service_name] = boto3.client(service_name)
+
+        return _clients[service_name]
+
+
+def get_cached(key, loader, ttl):
+    with _lock:
+        entry = _values.get(key)
+
+    if entry is not None and time.monotonic() < entry[1]:
+        return entry[0]
+
+    add_metric("ConfigCacheMisses")
+    value = loader()
+
+    with _lock:
+        _values[key] = (value, time.monotonic() + ttl)
+
+    return value
+
+
+def set_cached(key, value, ttl):
+    with _lock:
+        _values[key] = (value, time.monotonic() + ttl)
+
+
+def invalidate(key):
+    with _lock:
+        _values.pop(key, None)
+
+
+def get_secret(secret_id, ttl=None):
+    ttl = ttl if ttl is not None else int(os.environ.get("SECRET_CACHE_TTL", DEFAULT_SECRET_TTL))
+
+    def load():
+        with stage("get_secret"):
+            return json.loads(get_boto3_client('secretsmanager').get_secret_value(SecretId=secret_id)['SecretString'])
+
+    return get_cached(("secret", secret_id), load, ttl)
+
+
+def invalidate_secret(secret_id):
+    # Called when the cached credentials are rejected, the secret was most likely rotated
+    invalidate(("secret", secret_id))
+
+
+def get_parameter(name, default=None, ttl=None):
+    ttl = ttl if ttl is not None else int(os.environ.get("PARAMETER_CACHE_TTL", DEFAULT_PARAMETER_TTL))
+
+    def load():
+        ssm = get_boto3_client('ssm')
+        try:
+            with stage("get_parameter"):
+                return ssm.get_parameter(Name=name, WithDecryption=True)['Parameter']['Value']
+        except ssm.exceptions.ParameterNotFound:
+            return default
+
+    return get_cached(("parameter", name), load, ttl)
+
+
+def put_parameter(name, value, ttl=None):
+    ttl = ttl if ttl is not None else int(os.environ.get("PARAMETER_CACHE_TTL", DEFAULT_PARAMETER_TTL))
+
+    get_boto3_client('ssm').put_parameter(Name=name, Value=value, Type='String', Overwrite=True)
+    set_cached(("parameter", name), value, ttl)
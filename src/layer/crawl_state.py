@@ -0,0 +1,240 @@
+import os
+import json
+import time
+from config_cache import get_boto3_client
+from storage import update_json_file
+
+PENDING = "pending"
+RUNNING = "running"
+DONE = "done"
+FAILED = "failed"
+
+# The item pointing at the crawl in progress, next to the chunk items of every crawl
+CURRENT_KEY = {"crawl": {"S": "current"}, "chunk": {"S": "current"}}
+DEFAULT_STATE_TTL = 30 * 24 * 3600
+
+
+def new_crawl_id():
+    return time.strftime("%Y%m%dT%H%M%SZ", time.gmtime())
+
+
+def chunk_id(index):
+    # Zero padded so the chunks sort in the order GetPages listed them, largest shards first
+    return "{:06d}".format(index)
+
+
+def summarize(chunks):
+    summary = {PENDING: 0, RUNNING: 0, DONE: 0, FAILED: 0, "urls_count": 0}
+    for chunk in chunks:
+        summary[chunk["status"]] += 1
+        summary["urls_count"] += chunk.get("urls_count", 0)
+
+    return summary
+
+
+def unfinished(chunks):
+    # A chunk left running is one whose invocation timed out or crashed before recording its result
+    return [chunk for chunk in chunks if chunk["status"] != DONE]
+
+
+class DynamoDBCrawlState:
+    def __init__(self, table_name, ttl=DEFAULT_STATE_TTL):
+        self.table_name = table_name
+        self.ttl = ttl
+        self.dynamodb = get_boto3_client('dynamodb')
+
+    def chunk_key(self, crawl_id, chunk_id):
+        return {"crawl": {"S": crawl_id}, "chunk": {"S": chunk_id}}
+
+    def get_current_crawl(self):
+        item = self.dynamodb.get_item(TableName=self.table_name, Key=CURRENT_KEY, ConsistentRead=True).get("Item")
+        return item["crawl_id"]["S"] if item else None
+
+    def start_crawl(self, pages):
+        crawl_id = new_crawl_id()
+        expires_at = str(int(time.time()) + self.ttl)
+        requests = [{
+            "PutRequest": {"Item": dict(
+                self.chunk_key(crawl_id, chunk_id(index)),
+                pages={"S": json.dumps(chunk)},
+                status={"S": PENDING},
+                attempts={"N": "0"},
+                urls_count={"N": "0"},
+                expires_at={"N": expires_at}
+            )}
+        } for index, chunk in enumerate(pages)]
+
+        # Every chunk is written before the crawl becomes current, so a resumed crawl never misses one
+        for start in range(0, len(requests), 25):
+            pending = {self.table_name: requests[start:start + 25]}
+            while pending:
+                pending = self.dynamodb.batch_write_item(RequestItems=pending).get("UnprocessedItems")
+
+        self.dynamodb.put_item(TableName=self.table_name, Item=dict(CURRENT_KEY, crawl_id={"S": crawl_id}))
+        return crawl_id
+
+    def list_chunks(self, crawl_id):
+        chunks = []
+        paginator = self.dynamodb.get_paginator('query')
+        for page in paginator.paginate(
+            TableName=self.table_name,
+            KeyConditionExpression="crawl = :crawl",
+            ExpressionAttributeValues={":crawl": {"S": crawl_id}},
+            ConsistentRead=True
+        ):
+            chunks += [self.to_chunk(item) for item in page["Items"]]
+
+        return chunks
+
+    def to_chunk(self, item):
+        chunk = {
+            "chunk_id": item["chunk"]["S"],
+            "pages": json.loads(item["pages"]["S"]),
+            "status": item["status"]["S"],
+            "attempts": int(item["attempts"]["N"]),
+            "urls_count": int(item["urls_count"]["N"])
+        }
+        if "next_page" in item:
+            chunk["next_page"] = int(item["next_page"]["N"])
+        if "error" in item:
+            chunk["error"] = item["error"]["S"]
+
+        return chunk
+
+    def update_chunk(self, crawl_id, chunk_id, expression, values, condition=None):
+        # status and error are DynamoDB reserved words, only the placeholders used by the expressions may be passed
+        names = {"#" + name: name for name in ("status", "error") if "#" + name in expression + (condition or "")}
+        kwargs = {"ExpressionAttributeNames": names} if names else {}
+        if condition:
+            kwargs["ConditionExpression"] = condition
+
+        return self.dynamodb.update_item(
+            TableName=self.table_name,
+            Key=self.chunk_key(crawl_id, chunk_id),
+            UpdateExpression=expression,
+            ExpressionAttributeValues=values,
+            ReturnValues="ALL_NEW",
+            **kwargs
+        )["Attributes"]
+
+    def start_chunk(self, crawl_id, chunk_id):
+        # Returns the chunk with its progress, or None when it is already done
+        try:
+            return self.to_chunk(self.update_chunk(
+                crawl_id, chunk_id,
+                "SET #status = :running, attempts = attempts + :one",
+                {":running": {"S": RUNNING}, ":one": {"N": "1"}, ":done": {"S": DONE}},
+                "attribute_exists(crawl) AND #status <> :done"
+            ))
+        except self.dynamodb.exceptions.ConditionalCheckFailedException:
+            return None
+
+    def save_progress(self, crawl_id, chunk_id, next_page, urls_count):
+        self.update_chunk(
+            crawl_id, chunk_id,
+            "SET next_page = :next_page, urls_count = :urls_count",
+            {":next_page": {"N": str(next_page)}, ":urls_count": {"N": str(urls_count)}}
+        )
+
+    def finish_chunk(self, crawl_id, chunk_id, urls_count):
+        self.update_chunk(
+            crawl_id, chunk_id,
+            "SET #status = :done, urls_count = :urls_count REMOVE #error",
+            {":done": {"S": DONE}, ":urls_count": {"N": str(urls_count)}}
+        )
+
+    def fail_chunk(self, crawl_id, chunk_id, error):
+        self.update_chunk(crawl_id, chunk_id, "SET #status = :failed, #error = :error", {":failed": {"S": FAILED}, ":error": {"S": error[:1000]}})
+
+    def finish_crawl(self, crawl_id):
+        try:
+            # Only the crawl that is still current is finished, the chunk items expire with their TTL
+            self.dynamodb.delete_item(
+                TableName=self.table_name,
+                Key=CURRENT_KEY,
+                ConditionExpression="crawl_id = :crawl_id",
+                ExpressionAttributeValues={":crawl_id": {"S": crawl_id}}
+            )
+        except self.dynamodb.exceptions.ConditionalCheckFailedException:
+            pass
+
+
+class FileCrawlState:
+    # Local stand-in for the DynamoDB table, one JSON file shared between processes through an exclusive file lock
+    def __init__(self, path):
+        self.path = path
+
+    def update(self, change):
+        return update_json_file(self.path, change, lambda: {"current": None, "crawls": {}})
+
+    def get_current_crawl(self):
+        return self.update(lambda state: state["current"])
+
+    def start_crawl(self, pages):
+        crawl_id = new_crawl_id()
+
+        def change(state):
+            state["crawls"][crawl_id] = {
+                chunk_id(index): {"pages": chunk, "status": PENDING, "attempts": 0, "urls_count": 0}
+                for index, chunk in enumerate(pages)
+            }
+            state["current"] = crawl_id
+
+        self.update(change)
+        return crawl_id
+
+    def list_chunks(self, crawl_id):
+        def change(state):
+            chunks = state["crawls"].get(crawl_id, {})
+            return [dict(chunks[key], chunk_id=key) for key in sorted(chunks)]
+
+        return self.update(change)
+
+    def update_chunk(self, crawl_id, chunk_id, change):
+        def update(state):
+            chunk = state["crawls"].get(crawl_id, {}).get(chunk_id)
+            if chunk is None:
+                return None
+            return change(chunk)
+
+        return self.update(update)
+
+    def start_chunk(self, crawl_id, chunk_id):
+        def change(chunk):
+            if chunk["status"] == DONE:
+                return None
+            chunk["status"] = RUNNING
+            chunk["attempts"] += 1
+            return dict(chunk, chunk_id=chunk_id)
+
+        return self.update_chunk(crawl_id, chunk_id, change)
+
+    def save_progress(self, crawl_id, chunk_id, next_page, urls_count):
+        self.update_chunk(crawl_id, chunk_id, lambda chunk: chunk.update(next_page=next_page, urls_count=urls_count))
+
+    def finish_chunk(self, crawl_id, chunk_id, urls_count):
+        def change(chunk):
+            chunk.update(status=DONE, urls_count=urls_count)
+            chunk.pop("error", None)
+
+        self.update_chunk(crawl_id, chunk_id, change)
+
+    def fail_chunk(self, crawl_id, chunk_id, error):
+        self.update_chunk(crawl_id, chunk_id, lambda chunk: chunk.update(status=FAILED, error=error[:1000]))
+
+    def finish_crawl(self, crawl_id):
+        def change(state):
+            if state["current"] == crawl_id:
+                state["current"] = None
+
+        self.update(change)
+
+
+def get_crawl_state():
+    if os.environ.get("CRAWL_STATE_TABLE"):
+        return DynamoDBCrawlState(os.environ.get("CRAWL_STATE_TABLE"))
+    if os.environ.get("CRAWL_STATE_PATH"):
+        return FileCrawlState(os.environ.get("CRAWL_STATE_PATH"))
+
+    # Without a state store the full crawl is not checkpointed and a failed run starts over
+    return None
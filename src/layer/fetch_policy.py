@@ -0,0 +1,117 @@
+import os
+import time
+import random
+import threading
+from email.utils import parsedate_to_datetime
+from metrics import add_metric
+
+# Responses worth another try, anything else is returned to the caller as it is
+RETRY_STATUS_CODES = (429, 500, 502, 503, 504)
+
+DEFAULT_MAX_ATTEMPTS = 4
+DEFAULT_BACKOFF_BASE = 0.5
+DEFAULT_BACKOFF_MAX = 20
+DEFAULT_BREAKER_THRESHOLD = 5
+DEFAULT_BREAKER_COOLDOWN = 30
+# Longest a request waits for the circuit to close or for a token, a longer wait fails the request instead of the Lambda
+DEFAULT_MAX_WAIT = 10
+
+
+class CircuitOpen(Exception):
+    pass
+
+
+def get_max_wait():
+    return float(os.environ.get("AUTOAM_MAX_WAIT", DEFAULT_MAX_WAIT))
+
+
+def parse_retry_after(response):
+    value = response.headers.get("Retry-After") if response is not None else None
+
+    if not value:
+        return None
+    if value.strip().isdigit():
+        return float(value)
+
+    # An HTTP date instead of a number of seconds
+    try:
+        return max(parsedate_to_datetime(value).timestamp() - time.time(), 0)
+    except (TypeError, ValueError):
+        return None
+
+
+class RetryPolicy:
+    def __init__(self, max_attempts=None, backoff_base=None, backoff_max=None):
+        self.max_attempts = max_attempts if max_attempts is not None else int(os.environ.get("AUTOAM_MAX_ATTEMPTS", DEFAULT_MAX_ATTEMPTS))
+        self.backoff_base = backoff_base if backoff_base is not None else float(os.environ.get("AUTOAM_BACKOFF_BASE", DEFAULT_BACKOFF_BASE))
+        self.backoff_max = backoff_max if backoff_max is not None else float(os.environ.get("AUTOAM_BACKOFF_MAX", DEFAULT_BACKOFF_MAX))
+
+    def is_retryable(self, response):
+        # No response means the connection failed or timed out
+        return response is None or response.status_code in RETRY_STATUS_CODES
+
+    def get_delay(self, attempt, response):
+        # Returns the seconds to wait before the next attempt, or None when the request should not be tried again
+        if attempt + 1 >= self.max_attempts:
+            return None
+
+        retry_after = parse_retry_after(response)
+        if retry_after is not None and retry_after > self.backoff_max:
+            # Waiting that long would eat the Lambda timeout, leave the retry to the queue or the next run
+            return None
+
+        # Exponential backoff with full jitter, so workers that failed together don't retry together
+        delay = random.uniform(0, min(self.backoff_max, self.backoff_base * 2 ** attempt))
+        return max(delay, retry_after or 0)
+
+
+class CircuitBreaker:
+    # Opens after a run of failed requests, or when auto.am asks to retry later, and holds back every request until it
+    # closes again. With a shared rate limiter the pause is written to the token bucket, so every worker backs off together.
+    # A Retry-After longer than the cooldown only opens the circuit for the cooldown, the retry is left to the queue
+    def __init__(self, rate_limiter=None, threshold=None, cooldown=None, max_wait=None):
+        self.rate_limiter = rate_limiter
+        self.threshold = threshold if threshold is not None else int(os.environ.get("AUTOAM_BREAKER_THRESHOLD", DEFAULT_BREAKER_THRESHOLD))
+        self.cooldown = cooldown if cooldown is not None else float(os.environ.get("AUTOAM_BREAKER_COOLDOWN", DEFAULT_BREAKER_COOLDOWN))
+        self.max_wait = max_wait if max_wait is not None else get_max_wait()
+
+        self._lock = threading.Lock()
+        self._failures = 0
+        self._open_until = 0.0
+
+    def wait(self):
+        wait = self._open_until - time.monotonic()
+        if wait > self.max_wait:
+            # Fail fast instead of sleeping through the Lambda timeout
+            raise CircuitOpen("Circuit to auto.am is open for another {:.1f} seconds".format(wait))
+        if wait > 0:
+            time.sleep(wait)
+
+    def record_success(self):
+        with self._lock:
+            self._failures = 0
+
+    def record_failure(self, retry_after=None):
+        with self._lock:
+            self._failures += 1
+
+            if retry_after:
+                seconds = min(retry_after, self.cooldown)
+            elif self._failures >= self.threshold:
+                seconds = self.cooldown
+            else:
+                return
+
+            self._failures = 0
+            if time.monotonic() + seconds <= self._open_until:
+                return
+
+            self._open_until = time.monotonic() + seconds
+
+        add_metric("CircuitOpened")
+        if self.rate_limiter is not None:
+            try:
+                self.rate_limiter.pause(seconds)
+            except Exception as e:
+                # The local breaker still holds back this worker
+                print(f"Error pausing the shared rate limiter: {str(e)}")
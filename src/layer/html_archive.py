@@ -0,0 +1,147 @@
+"""Raw HTML archive of listing pages and offline re-extraction.
+
+Every listing page fetched by the warehouse provisioner can be kept gzipped in
+S3 or a local directory under <listing_id>/<sha256 of the page>.html.gz, so an
+unchanged page is stored once however often it is scraped. When a selector
+breaks or a new field is added, the latest page of every listing is extracted
+again on all cores and upserted into cars_raw_data, without touching auto.am.
+
+    python html_archive.py s3://bucket/html/ [--workers 8] [--batch-size 1000]
+"""
+import os
+import sys
+import gzip
+import argparse
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor
+from response_cache import body_hash
+from storage import get_store, open_store
+
+DEFAULT_ARCHIVE_PREFIX = "html/"
+LISTING_URL_FORMAT = "/offer/{}"
+DEFAULT_BATCH_SIZE = 1000
+
+
+def archive_key(prefix, listing_id, html):
+    return "{}{}/{}.html.gz".format(prefix, listing_id, body_hash(html))
+
+
+def parse_key(key):
+    # <prefix><listing_id>/<hash>.html.gz
+    listing_id, name = key.rsplit("/", 2)[-2:]
+    return listing_id, name
+
+
+class HtmlArchive:
+    def __init__(self, store):
+        self.store = store
+
+    def put(self, listing_id, html):
+        # The same page again overwrites itself, which only marks it as the latest version
+        key = archive_key(self.store.prefix, listing_id, html)
+        self.store.put(key, gzip.compress(html.encode("utf-8")), ContentType="text/html", ContentEncoding="gzip")
+        return key
+
+    def get(self, key):
+        return gzip.decompress(self.store.get(key)).decode("utf-8")
+
+    def list(self):
+        # Yields (key, last modified) of every archived page
+        for key, modified in self.store.list(self.store.prefix):
+            if key.endswith(".html.gz"):
+                yield key, modified
+
+
+def get_html_archive():
+    store = get_store("HTML_ARCHIVE_BUCKET", "HTML_ARCHIVE_DIR", DEFAULT_ARCHIVE_PREFIX)
+
+    # The archive is optional, without it listing pages are dropped once extracted
+    return HtmlArchive(store) if store else None
+
+
+def open_archive(path):
+    # s3://bucket/prefix or a local directory
+    return HtmlArchive(open_store(path))
+
+
+def latest_keys(archive):
+    # The most recently written version of every listing
+    latest = {}
+    for key, modified in archive.list():
+        listing_id, _ = parse_key(key)
+        if listing_id not in latest or modified > latest[listing_id][1]:
+            latest[listing_id] = (key, modified)
+
+    return sorted(key for key, _ in latest.values())
+
+
+_worker_archive = None
+
+
+def init_worker(path):
+    # Every worker process opens the archive once
+    global _worker_archive
+    _worker_archive = open_archive(path)
+
+
+def extract_key(key):
+    from listing_extractor import extract_listing
+
+    listing_id, _ = parse_key(key)
+    try:
+        return extract_listing(_worker_archive.get(key), LISTING_URL_FORMAT.format(listing_id))
+    except Exception as e:
+        print("{}: {}".format(key, e), file=sys.stderr)
+        return None
+
+
+def reextract(conn, path, workers=None, batch_size=DEFAULT_BATCH_SIZE, dry_run=False):
+    from autoam_db import upsert_listings
+
+    keys = latest_keys(open_archive(path))
+    extracted = failed = 0
+    batch = []
+
+    def flush():
+        if batch and not dry_run:
+            with conn.cursor() as cursor:
+                upsert_listings(cursor, batch)
+            conn.commit()
+        batch.clear()
+
+    # Parsing is CPU bound, the pages are spread over one process per core. The workers are spawned rather than forked,
+    # so none of them inherits the S3 client and its connections from this process
+    with ProcessPoolExecutor(max_workers=workers, initializer=init_worker, initargs=(path,), mp_context=multiprocessing.get_context("spawn")) as executor:
+        for data in executor.map(extract_key, keys, chunksize=64):
+            if data is None:
+                failed += 1
+                continue
+
+            extracted += 1
+            batch.append(data)
+            if len(batch) >= batch_size:
+                flush()
+
+    flush()
+    return extracted, failed
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("path", help="s3://bucket/prefix or a local directory")
+    parser.add_argument("--workers", type=int, default=os.cpu_count())
+    parser.add_argument("--batch-size", type=int, default=DEFAULT_BATCH_SIZE)
+    parser.add_argument("--dry-run", action="store_true", help="extract the pages without writing to the database")
+    args = parser.parse_args()
+
+    conn = None
+    if not args.dry_run:
+        from autoam_db import get_connection
+        conn = get_connection()
+
+    extracted, failed = reextract(conn, args.path, args.workers, args.batch_size, args.dry_run)
+    print("{} listings extracted, {} failed".format(extracted, failed), file=sys.stderr)
+
+
+if __name__ == "__main__":
+    main()
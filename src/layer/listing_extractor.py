@@ -0,0 +1,201 @@
+import re
+from datetime import datetime
+from selectolax.lexbor import LexborHTMLParser
+from metrics import timed
+
+# The price column holds US dollars, like the usdprice filter of the search
+PRICE_CURRENCY = "usd"
+CURRENCY_SIGNS = {"$": "usd", "usd": "usd", "֏": "amd", "amd": "amd", "€": "eur", "eur": "eur", "₽": "rub", "rub": "rub"}
+
+
+def node_text(node):
+    return node.text(deep=True, separator='', strip=False)
+
+
+def parse_price(text):
+    # (amount, currency, is_negotiable), an amount shown without a currency sign is in US dollars
+    text = text.lower()
+    digits = "".join(c for c in text if c.isdigit())
+
+    if not digits:
+        return None, None, True
+
+    currency = next((code for sign, code in CURRENCY_SIGNS.items() if sign in text), PRICE_CURRENCY)
+    return int(digits), currency, False
+
+
+def parse_mileage(text):
+    # "84 000 km" is the number 84000 measured in km, the digits are grouped with spaces
+    parts = text.split()
+    if parts and not parts[-1].replace(",", "").isdigit():
+        return "".join(parts[:-1]).replace(",", ""), parts[-1]
+
+    return "".join(parts).replace(",", ""), None
+
+
+@timed("parse_listing")
+def extract_listing(html, listing_url):
+    # Parse the page once with the lexbor backend and evaluate each selector only once
+    tree = LexborHTMLParser(html)
+
+    title_links = tree.css('h1 a')
+    car_year = node_text(title_links[-3])
+    car_make = node_text(title_links[-2])
+    car_model = node_text(title_links[-1])
+
+    attrs = tree.css('.attrs span')
+    car_insert_date = node_text(attrs[0])
+    location_parts = node_text(attrs[1]).split(", ")
+    car_location = location_parts[1] if len(location_parts) > 1 else None
+
+    car_price, car_price_currency, car_is_negotiable = parse_price(node_text(tree.css('.offer-top-price .price span, .offer-top-price .price small')[0]))
+    car_seller_id = tree.css('.ad-seller-details a.call-seller')[0].attributes.get('data-sellerid')
+    car_pricing_attributes = node_text(tree.css('.offer-top-price .price-attrs')[0]).lower()
+
+    vin_node = tree.css_first('.pad-left-6')
+    car_vin = node_text(vin_node).strip() if vin_node is not None else None
+    options_node = tree.css_first('.ad-options')
+    car_options = node_text(options_node).strip() if options_node is not None else None
+
+    car_is_exchangable = "exchange" in car_pricing_attributes
+    car_pay_with_installments = "installments" in car_pricing_attributes
+    car_is_urgent = tree.css_first('.urgent-stiker') is not None
+
+    # A price to be negotiated is stored as -1
+    if car_is_negotiable:
+        car_price = -1
+
+    # Extract additional details from the listing page
+    car_details = {}
+    for detail in tree.css('.ad-det tr'):
+        cells = detail.css('td')
+        key = node_text(cells[0]).lower().replace(" ", "_")
+        value_span = cells[1].css_first('span')
+        value = node_text(value_span).strip().lower().strip('"') if value_span is not None else node_text(cells[1]).strip().lower()
+        car_details[key] = value
+
+    if car_details["mileage"]:
+        # Split the mileage number from its measurement type
+        car_details["mileage"], car_details["milage_measurement"] = parse_mileage(car_details["mileage"])
+
+    # A price in another currency is kept in the details, the price column only holds US dollars
+    if car_price_currency not in (None, PRICE_CURRENCY):
+        car_details["price"] = str(car_price)
+        car_details["price_currency"] = car_price_currency
+        car_price = None
+
+    return {
+        "listing_id": listing_url.split("/")[2],
+        "car_year": car_year,
+        "car_make": car_make,
+        "car_model": car_model,
+        "car_vin": car_vin,
+        "car_is_urgent": car_is_urgent,
+        "car_is_negotiable": car_is_negotiable,
+        "car_is_exchangable": car_is_exchangable,
+        "car_pay_with_installments": car_pay_with_installments,
+        "car_insert_date": datetime.strptime(car_insert_date, "%d.%m.%Y").strftime("%Y-%m-%d"),
+        "car_location": car_location,
+        "car_price": car_price,
+        "car_seller_id": car_seller_id,
+        "car_details": car_details,
+        "car_options": car_options
+    }
+
+
+@timed("parse_search_page")
+def extract_listing_urls(html):
+    # Listing links of the cards on a search results page
+    tree = LexborHTMLParser(html)
+
+    return [card.css_first('.card-image a').attributes.get('href') for card in tree.css('.card')]
+
+
+# The alias of a make follows it in parentheses, "Lada (VAZ) 2107"
+MAKE_ALIAS_PATTERN = re.compile(r"(\([^)]*\))\s*(.*)", re.DOTALL)
+
+
+def split_make(name, makes):
+    # The longest make of the site that starts the name, "Great Wall Hover" is not the make "Great"
+    lower_name = name.lower()
+    matches = [make for make in makes if lower_name == make.lower() or lower_name.startswith(make.lower() + " ")]
+    if matches:
+        make = max(matches, key=len)
+        return name[:len(make)], name[len(make) + 1:]
+
+    # Without the make list only "<make> <model>" is certain, a wrong split would stay in the warehouse
+    if makes or len(name.split()) > 2:
+        return None, None
+
+    make, _, model = name.partition(" ")
+    return make, model
+
+
+def parse_card_title(title, makes=()):
+    # Card titles are "<year> <make> <model>", makes come from the make filter of the site when it is known
+    parts = title.split(None, 1)
+    car_year = int(parts[0]) if parts and parts[0].isdigit() else None
+    name = parts[1] if car_year is not None and len(parts) > 1 else title
+
+    # A make alias is part of the make, "Lada (VAZ) 2107" is the make "Lada (VAZ)" and the model "2107"
+    first_word, _, rest = name.partition(" ")
+    alias = MAKE_ALIAS_PATTERN.match(rest)
+    if alias:
+        make, model = "{} {}".format(first_word, alias.group(1)), alias.group(2)
+    else:
+        make, model = split_make(name, makes)
+
+    return car_year, make or None, model or None
+
+
+def parse_card_price(text):
+    car_price, car_price_currency, car_is_negotiable = parse_price(text)
+
+    # Same convention as the listing page, a price to be negotiated is stored as -1
+    if car_is_negotiable:
+        return -1, True
+
+    # A price in another currency is left out, the card upsert keeps the price already known
+    if car_price_currency != PRICE_CURRENCY:
+        return None, False
+
+    return car_price, False
+
+
+@timed("parse_search_page")
+def extract_listing_cards(html, makes=()):
+    # The fields every card of a search results page shows, without fetching the listing page
+    tree = LexborHTMLParser(html)
+    cards = []
+
+    for card in tree.css('.card'):
+        listing_url = card.css_first('.card-image a').attributes.get('href')
+        title_node = card.css_first('.card-title')
+        price_node = card.css_first('.price')
+
+        car_year, car_make, car_model = parse_card_title(node_text(title_node).strip(), makes) if title_node is not None else (None, None, None)
+        car_price, car_is_negotiable = parse_card_price(node_text(price_node)) if price_node is not None else (None, None)
+
+        cards.append({
+            "listing_id": listing_url.split("/")[2],
+            "listing_url": listing_url,
+            "car_year": car_year,
+            "car_make": car_make,
+            "car_model": car_model,
+            "car_price": car_price,
+            "car_is_negotiable": car_is_negotiable
+        })
+
+    return cards
+
+
+def extract_pages_count(html):
+    # The last link of the pagination is "next", the one before it is the last page number
+    tree = LexborHTMLParser(html)
+    links = tree.css('.pagination li a')
+
+    # A single page of results has no pagination
+    if len(links) < 2:
+        return 1
+
+    return int(node_text(links[-2]))
@@ -0,0 +1,91 @@
+from listing_extractor import extract_listing, extract_listing_urls, extract_listing_cards, extract_pages_count
+from response_cache import get_response_cache, conditional_headers, body_hash, make_entry
+from html_archive import get_html_archive
+from metrics import add_metric
+
+LISTING_GONE_STATUS_CODES = (404, 410)
+
+
+class ListingNotFound(Exception):
+    pass
+
+
+def get_listing_id(listing_url):
+    # /offer/<listing_id>, anything else can never be written to the integer listing_id column
+    parts = listing_url.split("/")
+    if len(parts) < 3 or not parts[2].isdigit():
+        raise Exception("Not a listing URL: {}".format(listing_url))
+
+    return parts[2]
+
+
+def search_page(client, page_number, filters=None):
+    # Send an HTTP POST request to the search endpoint with CSRF token, cookies, and data
+    post_response = client.search(page_number, filters)
+
+    # Check if the POST request was successful (status code 200)
+    if post_response.status_code == 200:
+        return post_response.text
+    else:
+        raise Exception("Failed to make the POST request to the search endpoint. Status code: {}".format(post_response.status_code))
+
+
+def get_page_urls(client, page_number, filters=None):
+    # Extract URLs from the search results
+    return extract_listing_urls(search_page(client, page_number, filters))
+
+
+def get_page_cards(client, page_number, filters=None):
+    # Extract the card fields, with the listing URLs, from the search results
+    html = search_page(client, page_number, filters)
+
+    # The make list is read from the homepage with the CSRF token, so it is known once a search was sent
+    return extract_listing_cards(html, client.makes)
+
+
+def get_pages_count(client, filters=None):
+    html = search_page(client, "1", filters)
+
+    # An empty search has nothing to scrape
+    if not extract_listing_urls(html):
+        return 0
+
+    return extract_pages_count(html)
+
+
+def fetch_listing(client, listing_url):
+    # A cached response of the previous visit turns the request into a conditional one
+    cache = get_response_cache()
+    cache_entry = cache.get(listing_url) if cache else None
+
+    # Send an HTTP GET request to the listing endpoint with CSRF token, cookies, and headers
+    listing_response = client.get_listing(listing_url, headers=conditional_headers(cache_entry))
+
+    # Not modified since the last visit, the cached extraction is still valid
+    if listing_response.status_code == 304 and cache_entry:
+        add_metric("CacheHits")
+        return cache_entry["data"]
+
+    # Check if the request was successful (status code 200)
+    if listing_response.status_code == 200:
+        # The page did not change, skip the parse
+        if cache_entry and cache_entry["body_hash"] == body_hash(listing_response.text):
+            add_metric("CacheHits")
+            return cache_entry["data"]
+
+        # Keep the raw page, so the listing can be extracted again without scraping it
+        archive = get_html_archive()
+        if archive:
+            archive.put(get_listing_id(listing_url), listing_response.text)
+
+        # Extract relevant information from the listing page
+        data = extract_listing(listing_response.text, listing_url)
+
+        if cache:
+            cache.put(listing_url, make_entry(listing_response, data))
+
+        return data
+    elif listing_response.status_code in LISTING_GONE_STATUS_CODES:
+        raise ListingNotFound(listing_url)
+    else:
+        raise Exception("Failed to make the GET request to the listing endpoint. Status code: {}".format(listing_response.status_code))
@@ -0,0 +1,128 @@
+import io
+import os
+import sys
+import json
+import time
+import random
+import threading
+import functools
+from contextlib import contextmanager
+
+DEFAULT_NAMESPACE = "AutoAmScrapper"
+DEFAULT_PROFILE_DIR = "/tmp"
+DEFAULT_PROFILE_TOP = 25
+
+# Lambda runs one invocation per process at a time, the metrics of the running invocation are kept at module scope
+# so the worker threads of a handler record into the same scope
+_scope = None
+_lock = threading.Lock()
+
+
+class MetricScope:
+    def __init__(self, function_name):
+        self.function_name = function_name
+        self.values = {}
+        self.units = {}
+
+    def add(self, name, value, unit):
+        with _lock:
+            self.values[name] = self.values.get(name, 0) + value
+            self.units[name] = unit
+
+    def to_emf(self, namespace):
+        # CloudWatch embedded metric format, CloudWatch Logs turns the line into metrics without any API call
+        record = {
+            "_aws": {
+                "Timestamp": int(time.time() * 1000),
+                "CloudWatchMetrics": [{
+                    "Namespace": namespace,
+                    "Dimensions": [["Function"]],
+                    "Metrics": [{"Name": name, "Unit": unit} for name, unit in self.units.items()]
+                }]
+            },
+            "Function": self.function_name
+        }
+        record.update(self.values)
+
+        return json.dumps(record)
+
+
+def add_metric(name, value=1, unit="Count"):
+    scope = _scope
+    if scope is not None:
+        scope.add(name, value, unit)
+
+
+@contextmanager
+def stage(name):
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        # Stages that run several times per invocation are summed, the count tells them apart
+        add_metric(name + ".Duration", (time.perf_counter() - start) * 1000, "Milliseconds")
+        add_metric(name + ".Count")
+
+
+def timed(name):
+    def decorator(function):
+        @functools.wraps(function)
+        def wrapper(*args, **kwargs):
+            with stage(name):
+                return function(*args, **kwargs)
+
+        return wrapper
+
+    return decorator
+
+
+def profile_call(function_name, function, *args, **kwargs):
+    import cProfile
+    import pstats
+
+    # cProfile only sees the handler's own thread, the worker threads show up as time waiting on their results
+    profiler = cProfile.Profile()
+    try:
+        return profiler.runcall(function, *args, **kwargs)
+    finally:
+        profile_path = os.path.join(os.environ.get("PROFILE_DIR", DEFAULT_PROFILE_DIR), "{}-{}.prof".format(function_name, int(time.time() * 1000)))
+        profiler.dump_stats(profile_path)
+
+        # /tmp does not outlive the Lambda environment, the hottest functions are logged as well
+        output = io.StringIO()
+        pstats.Stats(profiler, stream=output).sort_stats("cumulative").print_stats(int(os.environ.get("PROFILE_TOP", DEFAULT_PROFILE_TOP)))
+        print("Profile written to {}\n{}".format(profile_path, output.getvalue()), file=sys.stderr)
+
+
+def metric_scope(function_name):
+    # Wraps a lambda handler, every stage recorded during the invocation is emitted as one EMF line at the end
+    def decorator(handler):
+        @functools.wraps(handler)
+        def wrapper(*args, **kwargs):
+            global _scope
+
+            scope = _scope = MetricScope(function_name)
+            start = time.perf_counter()
+            try:
+                # A share of the invocations runs under cProfile
+                if random.random() < float(os.environ.get("PROFILE_SAMPLE_RATE", 0)):
+                    result = profile_call(function_name, handler, *args, **kwargs)
+                else:
+                    result = handler(*args, **kwargs)
+            except Exception:
+                scope.add("Errors", 1, "Count")
+                raise
+            else:
+                # Most handlers report failures in the response instead of raising
+                if isinstance(result, dict) and result.get("statusCode", 200) >= 500:
+                    scope.add("Errors", 1, "Count")
+            finally:
+                scope.add("Duration", (time.perf_counter() - start) * 1000, "Milliseconds")
+                _scope = None
+                print(scope.to_emf(os.environ.get("METRICS_NAMESPACE", DEFAULT_NAMESPACE)))
+
+            return result
+
+        return wrapper
+
+    return decorator
@@ -0,0 +1,164 @@
+"""Incremental Parquet export of cars_raw_data for analytics.
+
+Rows created since the last export are streamed from a server-side cursor and
+written as zstd compressed Parquet files partitioned by insert_date, with the
+typed and flattened details columns, to S3 or a local directory. The created_at
+watermark of the last export is kept next to the files, so every run only reads
+the new rows and analysts query the files instead of the production database.
+
+    python parquet_export.py s3://bucket/cars_raw_data/ [--batch-size 10000]
+"""
+import os
+import sys
+import json
+import argparse
+import tempfile
+import itertools
+from metrics import add_metric, stage
+from storage import get_store, open_store
+
+DEFAULT_EXPORT_PREFIX = "cars_raw_data/"
+DEFAULT_BATCH_SIZE = 10000
+# Rows are exported up to this many seconds before the export starts, so a transaction that took its created_at
+# before the watermark but commits after the export is not skipped
+DEFAULT_WATERMARK_LAG = 300
+WATERMARK_KEY = "_watermark.json"
+# Hive convention for rows without a partition value, readers turn it back into NULL
+NULL_PARTITION = "__HIVE_DEFAULT_PARTITION__"
+
+# (column, SQL expression, arrow type), insert_date is the partition and is not repeated in the files
+EXPORT_COLUMNS = (
+    ("listing_id", "listing_id", "int32"), ("year", '"year"', "int32"), ("make", "make", "string"),
+    ("model", "model", "string"), ("vin", "vin", "string"), ("is_negotiable", "is_negotiable", "bool"),
+    ("is_urgent", "is_urgent", "bool"), ("is_exchangable", "is_exchangable", "bool"),
+    ("pay_with_installments", "pay_with_installments", "bool"), ("location", '"location"', "string"),
+    ("price", "price", "int32"), ("seller_id", "seller_id", "int32"), ("mileage_km", "mileage_km", "int32"),
+    ("engine_volume", "engine_volume::float8", "float64"), ("body_type", "body_type", "string"),
+    ("transmission", "transmission", "string"), ("fuel_type", "fuel_type", "string"),
+    ("drive_type", "drive_type", "string"), ("color", "details->>'color'", "string"),
+    ("steering_wheel", "details->>'steering_wheel'", "string"), ("options", '"options"', "string"),
+    # Keys without a column of their own stay available in the raw details
+    ("details", "details::text", "string"), ("created_at", "created_at", "timestamp"),
+    ("updated_at", "updated_at", "timestamp"), ("removed_at", "removed_at", "timestamp")
+)
+
+
+def export_sql():
+    # Sorted by partition, so one partition file is open at a time however many dates the rows span
+    return """
+    SELECT insert_date, {}
+    FROM cars_raw_data
+    WHERE created_at > %s AND created_at <= %s
+    ORDER BY insert_date NULLS FIRST, created_at, listing_id
+    """.format(", ".join(expression for _, expression, _ in EXPORT_COLUMNS))
+
+
+def export_schema():
+    import pyarrow as pa
+
+    types = {"int32": pa.int32(), "float64": pa.float64(), "string": pa.string(), "bool": pa.bool_(), "timestamp": pa.timestamp("us", tz="UTC")}
+    return pa.schema([(column, types[arrow_type]) for column, _, arrow_type in EXPORT_COLUMNS])
+
+
+def get_export_store():
+    store = get_store("EXPORT_BUCKET", "EXPORT_DIR", DEFAULT_EXPORT_PREFIX)
+    if not store:
+        raise Exception("EXPORT_BUCKET or EXPORT_DIR environment variable is not set.")
+
+    return store
+
+
+def get_watermark(store):
+    data = store.get(store.prefix + WATERMARK_KEY)
+    return json.loads(data)["created_at"] if data else None
+
+
+def put_watermark(store, created_at):
+    store.put(store.prefix + WATERMARK_KEY, json.dumps({"created_at": created_at}).encode("utf-8"))
+
+
+class PartitionWriter:
+    # Writes the rows of one partition at a time to a local file, and hands the finished file to the store
+    def __init__(self, store, file_name, tmp_dir):
+        self.store = store
+        self.file_name = file_name
+        self.tmp_dir = tmp_dir
+        self.schema = export_schema()
+        self.partition = None
+        self.writer = None
+        self.rows = {}
+
+    def write(self, partition, rows):
+        import pyarrow as pa
+        import pyarrow.parquet as pq
+
+        if self.writer is None or partition != self.partition:
+            self.close()
+            self.partition = partition
+            self.writer = pq.ParquetWriter(os.path.join(self.tmp_dir, self.file_name), self.schema, compression="zstd")
+
+        # Every batch of the cursor is one row group, memory stays bounded by the batch size
+        columns = list(zip(*rows))
+        self.writer.write_table(pa.Table.from_arrays([pa.array(values, type=field.type) for values, field in zip(columns, self.schema)], schema=self.schema))
+        self.rows[partition] = self.rows.get(partition, 0) + len(rows)
+
+    def close(self):
+        if self.writer is None:
+            return
+
+        self.writer.close()
+        self.writer = None
+
+        with stage("export_upload"):
+            key = "insert_date={}/{}".format(self.partition or NULL_PARTITION, self.file_name)
+            self.store.put_file(os.path.join(self.tmp_dir, self.file_name), self.store.prefix + key)
+
+
+def export(conn, store, batch_size=DEFAULT_BATCH_SIZE, lag=DEFAULT_WATERMARK_LAG):
+    watermark = get_watermark(store) or "-infinity"
+
+    with conn.cursor() as cursor:
+        cursor.execute("SELECT now() - %s * interval '1 second'", (lag,))
+        next_watermark = cursor.fetchone()[0].isoformat()
+
+    # Files of a run are named after the watermark it started from, a run repeated after a failure
+    # overwrites them with a superset of their rows instead of duplicating them
+    file_name = "part-{}.parquet".format("".join(c for c in watermark if c.isalnum()) or "0")
+
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        writer = PartitionWriter(store, file_name, tmp_dir)
+
+        # Stream the rows through a server-side cursor so memory stays bounded on large exports
+        with conn.cursor(name="parquet_export") as cursor:
+            cursor.itersize = batch_size
+            cursor.execute(export_sql(), (watermark, next_watermark))
+
+            for rows in iter(lambda: cursor.fetchmany(batch_size), []):
+                for insert_date, group in itertools.groupby(rows, key=lambda row: row[0]):
+                    writer.write(insert_date.isoformat() if insert_date else None, [row[1:] for row in group])
+
+        writer.close()
+        conn.rollback()
+
+    # The watermark only moves once every file is written
+    put_watermark(store, next_watermark)
+    add_metric("RowsExported", sum(writer.rows.values()))
+
+    return watermark, next_watermark, writer.rows
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("path", help="s3://bucket/prefix or a local directory")
+    parser.add_argument("--batch-size", type=int, default=DEFAULT_BATCH_SIZE)
+    parser.add_argument("--lag", type=int, default=DEFAULT_WATERMARK_LAG, help="seconds before now the export stops at")
+    args = parser.parse_args()
+
+    from autoam_db import get_connection
+
+    watermark, next_watermark, rows = export(get_connection(), open_store(args.path), args.batch_size, args.lag)
+    print("{} rows created after {} up to {} exported to {} partitions".format(sum(rows.values()), watermark, next_watermark, len(rows)), file=sys.stderr)
+
+
+if __name__ == "__main__":
+    main()
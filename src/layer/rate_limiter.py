@@ -0,0 +1,158 @@
+import os
+import abc
+import time
+import random
+from config_cache import get_boto3_client
+from storage import update_json_file
+
+DEFAULT_BUCKET_NAME = "auto.am"
+
+
+class RateLimitTimeout(Exception):
+    pass
+
+
+class TokenBucket(abc.ABC):
+    # Subclasses keep the bucket state somewhere every worker can see
+    def __init__(self, rate, burst=None):
+        self.rate = float(rate)
+        self.burst = float(burst) if burst else max(self.rate, 1.0)
+
+    def refill(self, tokens, updated_at, now):
+        return min(self.burst, tokens + max(now - updated_at, 0) * self.rate)
+
+    @abc.abstractmethod
+    def try_acquire(self):
+        # Returns 0 when a token was taken, otherwise the number of seconds to wait before trying again
+        pass
+
+    @abc.abstractmethod
+    def pause(self, seconds):
+        # Hands out no tokens for the given number of seconds, to every worker sharing the bucket
+        pass
+
+    def acquire(self, max_wait=None):
+        deadline = time.time() + max_wait if max_wait is not None else None
+
+        while True:
+            wait = self.try_acquire()
+            if wait <= 0:
+                return
+
+            # Jitter keeps concurrent workers from waking up at the same moment
+            wait *= random.uniform(1.0, 1.5)
+            if deadline is not None and time.time() + wait > deadline:
+                raise RateLimitTimeout("No token for auto.am within {} seconds".format(max_wait))
+
+            time.sleep(wait)
+
+
+class DynamoDBTokenBucket(TokenBucket):
+    def __init__(self, table_name, rate, burst=None, bucket_name=DEFAULT_BUCKET_NAME):
+        super().__init__(rate, burst)
+        self.table_name = table_name
+        self.bucket_name = bucket_name
+        self.dynamodb = get_boto3_client('dynamodb')
+
+    def try_acquire(self):
+        now = time.time()
+        item = self.dynamodb.get_item(
+            TableName=self.table_name,
+            Key={"bucket": {"S": self.bucket_name}},
+            ConsistentRead=True
+        ).get("Item")
+
+        previous_updated_at = item["updated_at"]["N"] if item else None
+        tokens = self.refill(float(item["tokens"]["N"]), float(previous_updated_at), now) if item else self.burst
+        paused_until = item["paused_until"]["N"] if item and "paused_until" in item else "0"
+
+        if float(paused_until) > now:
+            return float(paused_until) - now
+        if tokens < 1:
+            return (1 - tokens) / self.rate
+
+        try:
+            # The write only succeeds if nobody else took a token since we read the bucket
+            self.dynamodb.put_item(
+                TableName=self.table_name,
+                Item={
+                    "bucket": {"S": self.bucket_name},
+                    "tokens": {"N": repr(tokens - 1)},
+                    "updated_at": {"N": repr(now)},
+                    "paused_until": {"N": paused_until}
+                },
+                ConditionExpression="attribute_not_exists(#bucket) OR updated_at = :previous",
+                ExpressionAttributeNames={"#bucket": "bucket"},
+                ExpressionAttributeValues={":previous": {"N": previous_updated_at or "0"}}
+            )
+            return 0
+        except self.dynamodb.exceptions.ConditionalCheckFailedException:
+            # Lost the race against another worker, read the bucket again
+            return 1 / (self.rate * 10)
+
+    def pause(self, seconds):
+        now = time.time()
+
+        try:
+            # Moving updated_at makes a concurrent try_acquire fail its condition, so the pause is never overwritten
+            self.dynamodb.update_item(
+                TableName=self.table_name,
+                Key={"bucket": {"S": self.bucket_name}},
+                UpdateExpression="SET paused_until = :until, updated_at = :now, tokens = if_not_exists(tokens, :burst)",
+                ConditionExpression="attribute_not_exists(paused_until) OR paused_until < :until",
+                ExpressionAttributeValues={
+                    ":until": {"N": repr(now + seconds)},
+                    ":now": {"N": repr(now)},
+                    ":burst": {"N": repr(self.burst)}
+                }
+            )
+        except self.dynamodb.exceptions.ConditionalCheckFailedException:
+            # Another worker already paused the bucket for longer
+            pass
+
+
+class FileTokenBucket(TokenBucket):
+    # Local stand-in for the DynamoDB bucket, shared between processes through an exclusive file lock
+    def __init__(self, path, rate, burst=None):
+        super().__init__(rate, burst)
+        self.path = path
+
+    def try_acquire(self):
+        def change(state):
+            now = time.time()
+            tokens = self.refill(state.get("tokens", self.burst), state.get("updated_at", now), now)
+            paused_until = state.get("paused_until", 0)
+
+            if paused_until > now:
+                return paused_until - now
+            if tokens < 1:
+                return (1 - tokens) / self.rate
+
+            state.update(tokens=tokens - 1, updated_at=now, paused_until=paused_until)
+            return 0
+
+        return update_json_file(self.path, change)
+
+    def pause(self, seconds):
+        def change(state):
+            now = time.time()
+            state.setdefault("tokens", self.burst)
+            state.setdefault("updated_at", now)
+            state["paused_until"] = max(state.get("paused_until", 0), now + seconds)
+
+        update_json_file(self.path, change)
+
+
+def get_rate_limiter():
+    rate = os.environ.get("AUTOAM_REQUESTS_PER_SECOND")
+    burst = os.environ.get("AUTOAM_REQUESTS_BURST")
+
+    if not rate:
+        return None
+
+    if os.environ.get("RATE_LIMITER_TABLE"):
+        return DynamoDBTokenBucket(os.environ.get("RATE_LIMITER_TABLE"), rate, burst)
+    if os.environ.get("RATE_LIMITER_PATH"):
+        return FileTokenBucket(os.environ.get("RATE_LIMITER_PATH"), rate, burst)
+
+    return None
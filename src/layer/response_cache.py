@@ -0,0 +1,71 @@
+import re
+import json
+import hashlib
+from autoam_client import CSRF_META_PATTERN
+from storage import get_store
+
+DEFAULT_CACHE_PREFIX = "response-cache/"
+# The view counter of a listing goes up on nearly every visit
+VIEWS_PATTERN = re.compile(r"Views:\s*\d[\d\s,]*")
+LISTING_START_MARKER = "<main"
+LISTING_END_MARKERS = ('<div class="related"', "</main>")
+
+
+def cache_key(url):
+    return hashlib.sha256(url.encode("utf-8")).hexdigest()
+
+
+def listing_content(text):
+    # The listing itself, without the header, the related listings and the footer, which change independently of it
+    start = text.find(LISTING_START_MARKER)
+    if start < 0:
+        # The CSRF token changes on every response, leave it out so an unchanged page hashes the same
+        return CSRF_META_PATTERN.sub("", text)
+
+    ends = [end for end in (text.find(marker, start) for marker in LISTING_END_MARKERS) if end >= 0]
+    return text[start:min(ends)] if ends else text[start:]
+
+
+def body_hash(text):
+    # An unchanged listing hashes the same however often it was viewed in between
+    return hashlib.sha256(VIEWS_PATTERN.sub("", listing_content(text)).encode("utf-8")).hexdigest()
+
+
+class ResponseCache:
+    # One JSON entry per listing URL
+    def __init__(self, store):
+        self.store = store
+
+    def get(self, url):
+        body = self.store.get(self.store.prefix + cache_key(url))
+        return json.loads(body) if body else None
+
+    def put(self, url, entry):
+        self.store.put(self.store.prefix + cache_key(url), json.dumps(entry).encode("utf-8"))
+
+
+def get_response_cache():
+    store = get_store("RESPONSE_CACHE_BUCKET", "RESPONSE_CACHE_DIR", DEFAULT_CACHE_PREFIX)
+
+    # The cache is optional, without it every listing page is downloaded and parsed
+    return ResponseCache(store) if store else None
+
+
+def conditional_headers(entry):
+    headers = {}
+
+    if entry and entry.get("etag"):
+        headers["If-None-Match"] = entry["etag"]
+    if entry and entry.get("last_modified"):
+        headers["If-Modified-Since"] = entry["last_modified"]
+
+    return headers
+
+
+def make_entry(response, data):
+    return {
+        "etag": response.headers.get("ETag"),
+        "last_modified": response.headers.get("Last-Modified"),
+        "body_hash": body_hash(response.text),
+        "data": data
+    }
@@ -0,0 +1,139 @@
+import time
+import uuid
+import zlib
+from concurrent.futures import ThreadPoolExecutor
+from storage import get_store
+
+MAGIC = b"SEEN1"
+DEFAULT_INDEX_PREFIX = "seen-index/"
+INDEX_NAME = "listings.bin"
+# Every batch of committed listings is a small index of its own under this prefix, until the next rebuild
+DELTAS_PREFIX = "deltas/"
+DELTA_LOAD_WORKERS = 16
+
+
+class SeenIndex:
+    # A bitmap indexed by listing_id, listing ids are dense integers so it stays small and has no false positives
+    def __init__(self, bitmap=None):
+        self.bitmap = bytearray(bitmap or b"")
+
+    def add(self, listing_id):
+        listing_id = int(listing_id)
+        byte_index = listing_id >> 3
+
+        if byte_index >= len(self.bitmap):
+            # Grow in 64 KiB steps so sequential adds don't reallocate every time
+            self.bitmap.extend(bytes(byte_index - len(self.bitmap) + 65536))
+
+        self.bitmap[byte_index] |= 1 << (listing_id & 7)
+
+    def update(self, listing_ids):
+        for listing_id in listing_ids:
+            self.add(listing_id)
+
+    def merge(self, other):
+        # A bitwise OR of the two bitmaps, done on integers instead of byte by byte
+        size = max(len(self.bitmap), len(other.bitmap))
+        merged = int.from_bytes(self.bitmap, "little") | int.from_bytes(other.bitmap, "little")
+        self.bitmap = bytearray(merged.to_bytes(size, "little"))
+
+    def __contains__(self, listing_id):
+        listing_id = int(listing_id)
+        byte_index = listing_id >> 3
+
+        return byte_index < len(self.bitmap) and bool(self.bitmap[byte_index] & (1 << (listing_id & 7)))
+
+    def to_bytes(self):
+        return MAGIC + zlib.compress(bytes(self.bitmap.rstrip(b"\x00")))
+
+    @classmethod
+    def from_bytes(cls, data):
+        if not data.startswith(MAGIC):
+            raise Exception("Unknown seen index format.")
+
+        return cls(zlib.decompress(data[len(MAGIC):]))
+
+
+def get_index_store():
+    # The index is optional, without it every listing is enqueued
+    return get_store("SEEN_INDEX_BUCKET", "SEEN_INDEX_DIR", DEFAULT_INDEX_PREFIX)
+
+
+def list_deltas(store):
+    return [key for key, _ in store.list(store.prefix + DELTAS_PREFIX) if key.endswith(".bin")]
+
+
+def load_index(store=None):
+    store = store or get_index_store()
+    data = store.get(store.prefix + INDEX_NAME) if store else None
+
+    # Without the full index the deltas alone would let most known listings through, the index is built first
+    if not data:
+        return None
+
+    index = SeenIndex.from_bytes(data)
+    with ThreadPoolExecutor(max_workers=DELTA_LOAD_WORKERS) as executor:
+        for delta in executor.map(store.get, list_deltas(store)):
+            # A delta removed by a rebuild since it was listed is already part of the full index
+            if delta:
+                index.merge(SeenIndex.from_bytes(delta))
+
+    return index
+
+
+def save_index(index, store=None):
+    store = store or get_index_store()
+
+    if store:
+        store.put(store.prefix + INDEX_NAME, index.to_bytes())
+
+
+def build_index(conn):
+    index = SeenIndex()
+
+    # Stream the ids through a server-side cursor so memory stays bounded on large tables
+    with conn.cursor(name="seen_index_build") as cursor:
+        cursor.itersize = 50000
+        cursor.execute("SELECT listing_id FROM cars_raw_data")
+        for row in cursor:
+            index.add(row[0])
+
+    conn.rollback()
+
+    return index
+
+
+def rebuild_index(conn, store=None):
+    store = store or get_index_store()
+
+    if not store:
+        return None
+
+    # The deltas are listed before the warehouse is read, their listings were committed before they were written, so
+    # the rebuilt index covers them and they can go. Deltas written in the meantime stay for the next rebuild
+    deltas = list_deltas(store)
+    index = build_index(conn)
+    save_index(index, store)
+    store.delete(deltas)
+
+    return index
+
+
+def record_listings(listing_ids, store=None):
+    store = store or get_index_store()
+
+    if not store or not listing_ids:
+        return
+
+    # A new object per batch instead of a read-modify-write of the full index, so concurrent writers never lose an update
+    delta = SeenIndex()
+    delta.update(listing_ids)
+    key = "{}{}{}-{}.bin".format(store.prefix, DELTAS_PREFIX, time.strftime("%Y%m%dT%H%M%S", time.gmtime()), uuid.uuid4().hex[:8])
+    store.put(key, delta.to_bytes())
+
+
+def filter_unseen(listing_urls, index):
+    if index is None:
+        return list(listing_urls)
+
+    return [listing_url for listing_url in listing_urls if listing_url.split("/")[2] not in index]
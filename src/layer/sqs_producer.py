@@ -0,0 +1,76 @@
+import os
+import json
+import time
+import random
+from concurrent.futures import ThreadPoolExecutor
+from metrics import add_metric, stage
+from config_cache import get_boto3_client
+
+# SendMessageBatch accepts at most 10 entries per call
+MAX_BATCH_SIZE = 10
+DEFAULT_SEND_CONCURRENCY = 4
+DEFAULT_SEND_ATTEMPTS = 3
+DEFAULT_SEND_BACKOFF_BASE = 0.2
+
+
+def get_sqs_client():
+    # One client is shared by every sender thread and warm invocation
+    return get_boto3_client('sqs')
+
+
+def pack_urls(urls, pack_size):
+    if pack_size <= 1:
+        return list(urls)
+
+    # Several listing URLs share one message body, the provisioner unpacks the JSON list
+    return [json.dumps(urls[i:i+pack_size]) for i in range(0, len(urls), pack_size)]
+
+
+def send_batch(queue_url, bodies, max_attempts, backoff_base=DEFAULT_SEND_BACKOFF_BASE):
+    sqs = get_sqs_client()
+    entries = [{"Id": str(index), "MessageBody": body} for index, body in enumerate(bodies)]
+    rejected = []
+
+    for attempt in range(max_attempts):
+        response = sqs.send_message_batch(QueueUrl=queue_url, Entries=entries)
+        failed = response.get("Failed", [])
+
+        # A sender fault (message too large, invalid body) fails again however often it is sent
+        rejected += [entry for entry in failed if entry.get("SenderFault")]
+        failed = [entry for entry in failed if not entry.get("SenderFault")]
+
+        if not failed or attempt + 1 >= max_attempts:
+            break
+
+        # Only the failed entries are sent again, after a jittered exponential backoff
+        add_metric("Retries", len(failed))
+        failed_ids = {entry["Id"] for entry in failed}
+        entries = [entry for entry in entries if entry["Id"] in failed_ids]
+        time.sleep(random.uniform(0, backoff_base * 2 ** attempt))
+
+    if failed or rejected:
+        raise Exception("Failed to send {} messages to SQS: {}".format(len(failed) + len(rejected), rejected + failed))
+
+
+def send_messages(queue_url, bodies, concurrency=None, max_attempts=None):
+    concurrency = concurrency or int(os.environ.get("SQS_SEND_CONCURRENCY", DEFAULT_SEND_CONCURRENCY))
+    max_attempts = max_attempts or int(os.environ.get("SQS_SEND_ATTEMPTS", DEFAULT_SEND_ATTEMPTS))
+    batches = [bodies[i:i+MAX_BATCH_SIZE] for i in range(0, len(bodies), MAX_BATCH_SIZE)]
+
+    if not batches:
+        return
+
+    # The batch calls are sent in parallel, list() re-raises the first failure
+    with stage("sqs_send"), ThreadPoolExecutor(max_workers=min(concurrency, len(batches))) as executor:
+        list(executor.map(lambda batch: send_batch(queue_url, batch, max_attempts), batches))
+
+    add_metric("MessagesSent", len(bodies))
+
+
+def put_urls_to_sqs(urls):
+    sqs_queue_url = os.environ.get("SQS_QUEUE_URL")
+
+    if not sqs_queue_url:
+        raise Exception("SQS_QUEUE_URL environment variable is not set.")
+
+    send_messages(sqs_queue_url, pack_urls(list(urls), int(os.environ.get("SQS_PACK_SIZE", 1))))
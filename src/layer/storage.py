@@ -0,0 +1,141 @@
+import os
+import json
+import uuid
+import fcntl
+import shutil
+from datetime import datetime, timezone
+from config_cache import get_boto3_client
+
+
+class S3Store:
+    # Objects of a bucket, keys are full object keys and prefix is where the owner of the store keeps its own
+    def __init__(self, bucket, prefix=""):
+        self.bucket = bucket
+        self.prefix = prefix
+        self.s3 = get_boto3_client('s3')
+
+    def get(self, key):
+        try:
+            return self.s3.get_object(Bucket=self.bucket, Key=key)['Body'].read()
+        except self.s3.exceptions.ClientError as e:
+            if e.response['Error']['Code'] in ('NoSuchKey', '404'):
+                return None
+            raise
+
+    def open(self, key):
+        # The body is streamed, the object is never fully held in memory
+        return self.s3.get_object(Bucket=self.bucket, Key=key)['Body']
+
+    def put(self, key, data, **options):
+        # options are extra put_object arguments, such as ContentType
+        self.s3.put_object(Bucket=self.bucket, Key=key, Body=data, **options)
+
+    def put_file(self, file_path, key):
+        # upload_file switches to a multipart upload for large files
+        self.s3.upload_file(file_path, self.bucket, key)
+
+    def list(self, prefix):
+        # Yields (key, last modified) of every object under the prefix
+        paginator = self.s3.get_paginator('list_objects_v2')
+        for page in paginator.paginate(Bucket=self.bucket, Prefix=prefix):
+            for item in page.get('Contents', []):
+                yield item['Key'], item['LastModified']
+
+    def delete(self, keys):
+        # DeleteObjects takes at most 1000 keys per request
+        for start in range(0, len(keys), 1000):
+            self.s3.delete_objects(Bucket=self.bucket, Delete={"Objects": [{"Key": key} for key in keys[start:start + 1000]], "Quiet": True})
+
+
+class LocalStore:
+    # The same interface over a local directory, a key is a path relative to it
+    def __init__(self, path, prefix=""):
+        self.path = path
+        self.prefix = prefix
+
+    def get(self, key):
+        file_path = os.path.join(self.path, key)
+        if not os.path.exists(file_path):
+            return None
+
+        with open(file_path, "rb") as f:
+            return f.read()
+
+    def open(self, key):
+        return open(os.path.join(self.path, key), "rb")
+
+    def put(self, key, data, **options):
+        def write(tmp_path):
+            with open(tmp_path, "wb") as f:
+                f.write(data)
+
+        replace_file(os.path.join(self.path, key), write)
+
+    def put_file(self, file_path, key):
+        replace_file(os.path.join(self.path, key), lambda tmp_path: shutil.copyfile(file_path, tmp_path))
+
+    def list(self, prefix):
+        for root, _, files in os.walk(os.path.join(self.path, prefix)):
+            for name in sorted(files):
+                if not name.endswith(".tmp"):
+                    file_path = os.path.join(root, name)
+                    yield os.path.relpath(file_path, self.path), datetime.fromtimestamp(os.path.getmtime(file_path), timezone.utc)
+
+    def delete(self, keys):
+        for key in keys:
+            try:
+                os.remove(os.path.join(self.path, key))
+            except FileNotFoundError:
+                pass
+
+
+def get_store(bucket_variable, dir_variable, prefix=""):
+    # The bucket in AWS, a local directory when running outside of it, None when neither is configured
+    if os.environ.get(bucket_variable):
+        return S3Store(os.environ.get(bucket_variable), prefix)
+    if os.environ.get(dir_variable):
+        return LocalStore(os.environ.get(dir_variable), prefix)
+
+    return None
+
+
+def open_store(path):
+    # s3://bucket/prefix or a local directory
+    if path.startswith("s3://"):
+        bucket, _, prefix = path[len("s3://"):].partition("/")
+        return S3Store(bucket, prefix)
+
+    return LocalStore(path)
+
+
+def replace_file(path, write):
+    # write fills a temporary file next to the target first, so readers never see a partial file. The temporary
+    # name is unique, processes writing the same file at once each replace it with a complete one
+    os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+    tmp_path = "{}.{}.tmp".format(path, uuid.uuid4().hex[:8])
+
+    try:
+        write(tmp_path)
+        os.replace(tmp_path, path)
+    finally:
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+
+
+def update_json_file(path, change, default=dict):
+    # Read-modify-write of a JSON file under an exclusive lock, so processes sharing the file never lose an update.
+    # change gets the decoded state to modify in place, default builds it when the file is new, change's result is returned
+    with open(path, "a+") as f:
+        fcntl.flock(f, fcntl.LOCK_EX)
+        try:
+            f.seek(0)
+            content = f.read()
+            state = json.loads(content) if content else default()
+            result = change(state)
+
+            f.seek(0)
+            f.truncate()
+            f.write(json.dumps(state))
+            return result
+        finally:
+            fcntl.flock(f, fcntl.LOCK_UN)
@@ -1,12 +1,14 @@
 import os
-import requests
-from bs4 import BeautifulSoup
-import boto3
 import json
-from requests.packages.urllib3.exceptions import InsecureRequestWarning
-
-requests.packages.urllib3.disable_warnings(InsecureRequestWarning)
-
+from autoam_client import get_client, get_shard_filters
+from listing_fetcher import get_page_urls, get_page_cards
+from sqs_producer import put_urls_to_sqs
+from seen_index import load_index, filter_unseen
+from crawl_state import get_crawl_state
+from autoam_db import insert_cards
+from metrics import metric_scope, timed
+
+@metric_scope("page-scrapper")
 def lambda_handler(event, context):
     try:
         # Read the IP address from Lambda environment variables
@@ -15,95 +17,83 @@ def lambda_handler(event, context):
         if not ip_address:
             raise Exception("AUTOAM_IP_ADDRESS environment variable is not set.")
 
-        page_number = event['page']
-        # Hardcoded website URL (using the IP address)
-        url = "https://{}/lang/en".format(ip_address)
+        # Each invocation walks a range of pages, single page events are still accepted
+        pages = event.get('pages') or {"start": event['page'], "end": event['page']}
+
+        # Pages of a shard of the full crawl are pages of that shard's search
+        filters = get_shard_filters(pages['filters']) if pages.get('filters') else None
+
+        # Pages listed by a checkpointed crawl record their progress, a retried chunk starts after its last done page
+        state = get_crawl_state() if pages.get('crawl_id') else None
+        start_page, done_count = int(pages['start']), 0
 
-        # Call the function to get urls from the page
-        page_urls = get_urls_from_page(url, ip_address, page_number)
+        if state:
+            chunk = state.start_chunk(pages['crawl_id'], pages['chunk_id'])
 
-        # Put the URLs into an SQS queue
-        put_urls_to_sqs(page_urls)
-                
-        # Return the result
-        return {"statusCode": 200, "body": json.dumps({"page_urls": page_urls})}
+            if chunk is None:
+                return {"statusCode": 200, "body": json.dumps({"pages": pages, "urls_count": 0, "skipped": True})}
+
+            start_page, done_count = chunk.get('next_page', start_page), chunk['urls_count']
+
+            def checkpoint(next_page, page_urls_count):
+                state.save_progress(pages['crawl_id'], pages['chunk_id'], next_page, done_count + page_urls_count)
+        else:
+            checkpoint = None
+
+        try:
+            # Call the function to scrape the pages and put the URLs into an SQS queue
+            urls_count = done_count + scrape_pages(ip_address, start_page, int(pages['end']), filters, checkpoint)
+        except Exception as e:
+            if state:
+                state.fail_chunk(pages['crawl_id'], pages['chunk_id'], str(e))
+            raise
+
+        if state:
+            state.finish_chunk(pages['crawl_id'], pages['chunk_id'], urls_count)
+
+        # Return the result, only counts are returned to keep the Map state output small
+        return {"statusCode": 200, "body": json.dumps({"pages": pages, "urls_count": urls_count})}
     except Exception as e:
         # Handle exceptions and return an error response
         return {"statusCode": 500, "body": json.dumps({"error": str(e)})}
 
-def get_urls_from_page(url, ip_address, page_number):
-    # Step 1: Send an HTTP GET request to the URL
-    response = requests.get(url, verify=False)
-
-    # Check if the request was successful (status code 200)
-    if response.status_code == 200:
-        # Extract the cookies and CSRF token from the response
-        autoam_session_cookie = response.cookies.get("autoam_session")
-        xsrf_token_cookie = response.cookies.get("XSRF-TOKEN")
-        soup = BeautifulSoup(response.text, 'html.parser')
-        csrf_token = soup.find('meta', {'name': 'csrf-token'})['content']
-
-        # Step 2: Make a POST request to the search endpoint using the obtained CSRF token and cookies
-        post_url = "https://{}/search".format(ip_address)  # Update URL for the POST request
-        post_headers = {
-            'Host': 'auto.am',  # Set the Host header
-            'Accept': '*/*',
-            'Accept-Language': 'en-US,en;q=0.5',
-            'Accept-Encoding': 'gzip, deflate, br',
-            'Content-Type': 'application/x-www-form-urlencoded; charset=UTF-8',
-            'X-CSRF-Token': csrf_token,
-            'X-Requested-With': 'XMLHttpRequest',
-            'Origin': 'https://auto.am',
-            'Connection': 'keep-alive',
-            'Referer': url,
-            'Cookie': f'XSRF-TOKEN={xsrf_token_cookie}; autoam_session={autoam_session_cookie}'
-        }
-
-        post_data = {
-            'search': json.dumps({
-                "category": "1",
-                "page": page_number,
-                "sort": "latest",
-                "layout": "list",
-                "user": {"dealer": "0", "official": "0", "id": ""},
-                "year": {"gt": "1911", "lt": "2025"},
-                "usdprice": {"gt": "0", "lt": "100000000"},
-                "custcleared": "1",
-                "mileage": {"gt": "10", "lt": "10000000"}
-            })
-        }
-
-        # Step 3: Send an HTTP POST request to the search endpoint with CSRF token, cookies, and data
-        post_response = requests.post(post_url, headers=post_headers, data=post_data, verify=False)
-
-        # Check if the POST request was successful (status code 200)
-        if post_response.status_code == 200:
-            # Extract URLs from the search results
-            soup = BeautifulSoup(post_response.text, 'html.parser')
-            cars = soup.find_all(class_="card")
-            page_urls = [car.select(".card-image a")[0].get("href") for car in cars]
-
-            return page_urls
+def scrape_pages(ip_address, start_page, end_page, filters=None, checkpoint=None):
+    # With LISTING_DETAILS set to deferred or skip the card fields are written straight to the warehouse
+    cards_only = os.environ.get("LISTING_DETAILS", "fetch") != "fetch"
+
+    # The index of listings already in the warehouse is loaded once for the whole range
+    seen = load_index() if not cards_only else None
+    urls_count = 0
+
+    for page_number in range(start_page, end_page + 1):
+        if cards_only:
+            # One upsert per page instead of two requests per listing, known listings get their price updated
+            page_cards = get_cards_from_page(ip_address, page_number, filters)
+            insert_cards(page_cards)
+            urls_count += len(page_cards)
         else:
-            raise Exception("Failed to make the POST request to the search endpoint. Status code: {}".format(post_response.status_code))
-    else:
-        raise Exception("Failed to retrieve cookies. Status code: {}".format(response.status_code))
+            # Call the function to get urls from the page
+            page_urls = get_urls_from_page(ip_address, page_number, filters)
+
+            # Skip the listings that are already in the warehouse
+            page_urls = filter_unseen(page_urls, seen)
 
+            # Put the URLs into an SQS queue as soon as the page is scraped
+            put_urls_to_sqs(page_urls)
+            urls_count += len(page_urls)
 
-def put_urls_to_sqs(urls):
-    sqs_queue_url = os.environ.get("SQS_QUEUE_URL")
+        # The page is enqueued, a retry of the range continues from the next one
+        if checkpoint:
+            checkpoint(page_number + 1, urls_count)
 
-    if not sqs_queue_url:
-        raise Exception("SQS_QUEUE_URL environment variable is not set.")
+    return urls_count
 
-    # Initialize SQS client
-    sqs = boto3.client('sqs')
+@timed("get_urls_from_page")
+def get_urls_from_page(ip_address, page_number, filters=None):
+    # The shared client reuses cached cookies and CSRF token across warm invocations
+    return get_page_urls(get_client(ip_address), page_number, filters)
 
-    # Put each URL to the SQS queue
-    for url in urls:
-        # Send the message to SQS
-        sqs.send_message(
-            QueueUrl=sqs_queue_url,
-            MessageBody=url
-        )
-        
\ No newline at end of file
+@timed("get_cards_from_page")
+def get_cards_from_page(ip_address, page_number, filters=None):
+    # Extract the card fields from the search results
+    return get_page_cards(get_client(ip_address), page_number, filters)
@@ -1,13 +1,13 @@
 import os
-import requests
-from bs4 import BeautifulSoup
-import boto3
 import json
-import psycopg2
-from requests.packages.urllib3.exceptions import InsecureRequestWarning
-
-requests.packages.urllib3.disable_warnings(InsecureRequestWarning)
-
+from autoam_client import get_client
+from listing_fetcher import get_page_cards
+from sqs_producer import put_urls_to_sqs
+from autoam_db import get_connection, reset_connection, find_known_listing_ids, insert_cards
+from seen_index import get_index_store, load_index, rebuild_index
+from metrics import metric_scope, timed
+
+@metric_scope("process-new-listings")
 def lambda_handler(event, context):
     try:
         # Read the IP address from Lambda environment variables
@@ -16,138 +16,85 @@ def lambda_handler(event, context):
         if not ip_address:
             raise Exception("AUTOAM_IP_ADDRESS environment variable is not set.")
 
-        # Hardcoded website URL (using the IP address)
-        url = "https://{}/lang/en".format(ip_address)
+        # Call the function to get the cards of the new listings
+        page_cards = get_new_cards_from_page(ip_address)
+        page_urls = [card["listing_url"] for card in page_cards]
 
-        # Call the function to get urls from the page
-        page_urls = get_new_urls_from_page(url, ip_address)
+        if os.environ.get("LISTING_DETAILS", "fetch") != "fetch":
+            # Write the card fields straight to the warehouse, the listing pages are fetched later or not at all
+            insert_cards(page_cards)
+        else:
+            # Put the URLs into an SQS queue
+            put_urls_to_sqs(page_urls)
 
-        # Put the URLs into an SQS queue
-        put_urls_to_sqs(page_urls)
-                
         # Return the result
         return {"statusCode": 200, "body": json.dumps({"page_urls": page_urls})}
     except Exception as e:
         # Handle exceptions and return an error response
         return {"statusCode": 500, "body": json.dumps({"error": str(e)})}
 
-def get_new_urls_from_page(url, ip_address):
-    page_urls = []
+@timed("get_new_cards_from_page")
+def get_new_cards_from_page(ip_address):
+    page_cards = []
     page_number = 1
 
-    while True:
-        # Step 1: Send an HTTP GET request to the URL
-        response = requests.get(url, verify=False)
-
-        # Check if the request was successful (status code 200)
-        if response.status_code == 200:
-            # Extract the cookies and CSRF token from the response
-            autoam_session_cookie = response.cookies.get("autoam_session")
-            xsrf_token_cookie = response.cookies.get("XSRF-TOKEN")
-            soup = BeautifulSoup(response.text, 'html.parser')
-            csrf_token = soup.find('meta', {'name': 'csrf-token'})['content']
-
-            # Step 2: Make a POST request to the search endpoint using the obtained CSRF token and cookies
-            post_url = "https://{}/search".format(ip_address)  # Update URL for the POST request
-            post_headers = {
-                'Host': 'auto.am',  # Set the Host header
-                'Accept': '*/*',
-                'Accept-Language': 'en-US,en;q=0.5',
-                'Accept-Encoding': 'gzip, deflate, br',
-                'Content-Type': 'application/x-www-form-urlencoded; charset=UTF-8',
-                'X-CSRF-Token': csrf_token,
-                'X-Requested-With': 'XMLHttpRequest',
-                'Origin': 'https://auto.am',
-                'Connection': 'keep-alive',
-                'Referer': url,
-                'Cookie': f'XSRF-TOKEN={xsrf_token_cookie}; autoam_session={autoam_session_cookie}'
-            }
-
-            post_data = {
-                'search': json.dumps({
-                    "category": "1",
-                    "page": page_number,
-                    "sort": "latest",
-                    "layout": "list",
-                    "user": {"dealer": "0", "official": "0", "id": ""},
-                    "year": {"gt": "1911", "lt": "2025"},
-                    "usdprice": {"gt": "0", "lt": "100000000"},
-                    "custcleared": "1",
-                    "mileage": {"gt": "10", "lt": "10000000"}
-                })
-            }
-
-            # Step 3: Send an HTTP POST request to the search endpoint with CSRF token, cookies, and data
-            post_response = requests.post(post_url, headers=post_headers, data=post_data, verify=False)
-
-            # Check if the POST request was successful (status code 200)
-            if post_response.status_code == 200:
-                # Extract URLs from the search results
-                soup = BeautifulSoup(post_response.text, 'html.parser')
-                cars = soup.find_all(class_="card")
-                page_new_urls = [car.select(".card-image a")[0].get("href") for car in cars]
-                if check_has_matching(page_new_urls):
-                    page_urls+=page_new_urls
-                    return page_urls
-                page_number+=1
-            else:
-                raise Exception("Failed to make the POST request to the search endpoint. Status code: {}".format(post_response.status_code))
-        else:
-            raise Exception("Failed to retrieve cookies. Status code: {}".format(response.status_code))
-
+    # The shared client fetches cookies and CSRF token once for the whole pagination walk
+    client = get_client(ip_address)
 
-def check_has_matching(page_urls):
-    # Get PostgreSQL credentials.
-    smclient = boto3.client('secretsmanager')
-    master_credential = json.loads(smclient.get_secret_value(SecretId=os.environ.get("RDS_SECRET_ARN"))['SecretString'])
+    # One database connection is used for the whole pagination walk
+    conn = get_connection()
 
-    # Connect to the PostgreSQL database
-    conn = psycopg2.connect(
-        host=os.environ.get("RDS_ENDPOINT"),
-        port=os.environ.get("RDS_PORT"),
-        user=master_credential['username'],
-        password=master_credential['password'],
-        database=os.environ.get('RDS_DATABASE_NAME')
-    )
-
-    has_matching = False
     try:
-        # Create a cursor object to execute SQL queries
+        seen = get_seen_index(conn)
+
         with conn.cursor() as cursor:
-            for page_url in page_urls:
-                listing_id = page_url.split("/")[2]
-                
-                # Execute a query to check if the listing_id exists in the database
-                cursor.execute("SELECT COUNT(*) FROM cars_raw_data WHERE listing_id = %s", (listing_id,))
-                count = cursor.fetchone()[0]
+            while True:
+                # Extract the cards, with their URLs, from the search results
+                page_new_cards = get_page_cards(client, page_number)
 
-                if count > 0:
-                    has_matching = True
-                    break
+                # Past the last page there is nothing left to compare against
+                if not page_new_cards:
+                    return page_cards
 
-    except Exception as e:
-        print(f"Error: {e}")
-        has_matching = False
+                # Listings are sorted by latest, so everything after the first known listing was scraped before
+                known_listing_ids = find_known_on_page(cursor, seen, [card["listing_id"] for card in page_new_cards])
+                for card in page_new_cards:
+                    if card["listing_id"] in known_listing_ids:
+                        return page_cards
+                    page_cards.append(card)
 
+                page_number+=1
+    except Exception:
+        reset_connection()
+        raise
     finally:
-        # Close the database connection
-        conn.close()
+        # Close the read-only transaction, the connection stays open for warm invocations
+        if not conn.closed:
+            conn.rollback()
+
+def get_seen_index(conn):
+    store = get_index_store()
+    if not store:
+        return None
+
+    seen = load_index(store)
+    if seen is None:
+        # First run with an index store configured, build the index from the warehouse
+        seen = rebuild_index(conn, store)
 
-    return has_matching
+    return seen
 
-def put_urls_to_sqs(urls):
-    sqs_queue_url = os.environ.get("SQS_QUEUE_URL")
 
-    if not sqs_queue_url:
-        raise Exception("SQS_QUEUE_URL environment variable is not set.")
+def find_known_on_page(cursor, seen, listing_ids):
+    if seen is None:
+        return find_known_listing_ids(cursor, listing_ids)
 
-    # Initialize SQS client
-    sqs = boto3.client('sqs')
+    candidate_ids = []
+    for listing_id in listing_ids:
+        # The index only contains committed listings, so a hit needs no DB lookup
+        if listing_id in seen:
+            return find_known_listing_ids(cursor, candidate_ids) | {listing_id}
+        candidate_ids.append(listing_id)
 
-    # Put each URL to the SQS queue
-    for url in urls:
-        # Send the message to SQS
-        sqs.send_message(
-            QueueUrl=sqs_queue_url,
-            MessageBody=url
-        )
+    # The index may lag behind the provisioner, confirm the misses against the database
+    return find_known_listing_ids(cursor, candidate_ids)
@@ -0,0 +1,60 @@
+import os
+import json
+from autoam_db import get_connection, reset_connection
+from sqs_producer import put_urls_to_sqs
+from metrics import metric_scope, timed
+
+LISTING_URL_FORMAT = "/offer/{}"
+
+@metric_scope("refresh-listings")
+def lambda_handler(event, context):
+    try:
+        limit = int(event.get("limit") or os.environ.get("REFRESH_LIMIT", 5000))
+        max_age_days = int(event.get("max_age_days") or os.environ.get("REFRESH_MAX_AGE_DAYS", 30))
+
+        # Pick the listings worth re-scraping today
+        listing_ids = get_listings_to_refresh(limit, max_age_days)
+
+        # Put the URLs into the SQS queue, the provisioner only rewrites listings whose content changed
+        put_urls_to_sqs([LISTING_URL_FORMAT.format(listing_id) for listing_id in listing_ids])
+
+        # Return the result
+        return {"statusCode": 200, "body": json.dumps({"refreshed": len(listing_ids)})}
+    except Exception as e:
+        # Handle exceptions and return an error response
+        return {"statusCode": 500, "body": json.dumps({"error": str(e)})}
+
+@timed("get_listings_to_refresh")
+def get_listings_to_refresh(limit, max_age_days):
+    # Listings written from search result cards have no content hash until their listing page is scraped.
+    # deferred fetches their listing pages before anything else, skip leaves them as they are
+    details_mode = os.environ.get("LISTING_DETAILS", "fetch")
+
+    conn = get_connection()
+
+    try:
+        with conn.cursor() as cursor:
+            # Listings whose price already changed come first, then the newest ones, which change the most
+            cursor.execute("""
+                SELECT c.listing_id
+                FROM cars_raw_data c
+                LEFT JOIN (
+                    SELECT listing_id, count(*) - 1 AS price_changes
+                    FROM cars_price_history
+                    GROUP BY listing_id
+                ) h ON h.listing_id = c.listing_id
+                WHERE c.removed_at IS NULL
+                  AND (%(skip_cards)s = false OR c.content_hash IS NOT NULL)
+                  AND (h.price_changes > 0 OR c.insert_date >= current_date - %(max_age_days)s OR (%(cards_first)s AND c.content_hash IS NULL))
+                ORDER BY (%(cards_first)s AND c.content_hash IS NULL) DESC, COALESCE(h.price_changes, 0) DESC, c.insert_date DESC NULLS LAST
+                LIMIT %(limit)s
+            """, {"max_age_days": max_age_days, "limit": limit, "cards_first": details_mode == "deferred", "skip_cards": details_mode == "skip"})
+
+            return [row[0] for row in cursor.fetchall()]
+    except Exception:
+        reset_connection()
+        raise
+    finally:
+        # Close the read-only transaction, the connection stays open for warm invocations
+        if not conn.closed:
+            conn.rollback()
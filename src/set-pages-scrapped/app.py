@@ -1,21 +1,34 @@
-import boto3
 import json
+from config_cache import put_parameter
+from crawl_state import get_crawl_state, unfinished
+from metrics import metric_scope
 
-def lambda_handler(event, context):
-    ssm = boto3.client('ssm')
+PARAMETER_NAME = '/auto.am/pages-scrapped'
 
+@metric_scope("set-pages-scrapped")
+def lambda_handler(event, context):
     # Extract parameter details from the event or context
-    parameter_name = '/auto.am/pages-scrapped'
     parameter_value = "true"
 
     try:
-        # Write parameter to Parameter Store
-        ssm.put_parameter(
-            Name=parameter_name,
-            Value=parameter_value,
-            Type='String',
-            Overwrite=True
-        )
+        # The flag is only set once every chunk of the checkpointed crawl is done
+        state = get_crawl_state()
+        crawl_id = state.get_current_crawl() if state else None
+
+        if crawl_id:
+            unfinished_count = len(unfinished(state.list_chunks(crawl_id)))
+
+            if unfinished_count:
+                return {
+                    'statusCode': 409,
+                    'body': json.dumps({'error': '{} chunks of crawl {} are not done'.format(unfinished_count, crawl_id)}),
+                }
+
+        # Write parameter to Parameter Store, the cached flag is updated with it
+        put_parameter(PARAMETER_NAME, parameter_value)
+
+        if crawl_id:
+            state.finish_crawl(crawl_id)
 
         return {
             'statusCode': 200,
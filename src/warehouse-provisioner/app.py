@@ -1,192 +1,191 @@
 import os
-import requests
-from bs4 import BeautifulSoup
-import boto3
 import json
-import psycopg2
-from datetime import datetime
-from requests.packages.urllib3.exceptions import InsecureRequestWarning
+from concurrent.futures import ThreadPoolExecutor
+from autoam_client import get_client
+from listing_fetcher import ListingNotFound, get_listing_id, fetch_listing
+from autoam_db import get_connection, reset_connection, write_listings
+from seen_index import record_listings
+from bulk_loader import write_batch
+from sqs_producer import get_sqs_client
+from fetch_policy import CircuitOpen
+from rate_limiter import RateLimitTimeout
+from metrics import metric_scope, timed
+
+# Seconds before a failed message is retried, doubled on every receive up to the SQS limit of 12 hours
+DEFAULT_LISTING_RETRY_DELAY = 30
+MAX_VISIBILITY_TIMEOUT = 43200
+
+# Marks a record held back by the circuit breaker or the rate limiter, auto.am is not answering right now
+THROTTLED = object()
+
+@metric_scope("warehouse-provisioner")
+def lambda_handler(event, context):
+    # Read the IP address from Lambda environment variables
+    ip_address = os.environ.get("AUTOAM_IP_ADDRESS")
+
+    # A misconfigured function fails the whole batch, so every message is retried
+    if not ip_address:
+        raise Exception("AUTOAM_IP_ADDRESS environment variable is not set.")
+
+    # Scrape every record first, so the whole batch is written in one transaction
+    scraped = []
+    failed_records = []
+    throttled_records = []
+    for record, data in fetch_listings(event['Records'], ip_address):
+        if data is THROTTLED:
+            throttled_records.append(record)
+        elif data is not None:
+            scraped.append((record, data))
+        else:
+            failed_records.append(record)
 
-requests.packages.urllib3.disable_warnings(InsecureRequestWarning)
+    listings = [listing for _, data in scraped for listing in data]
 
-def lambda_handler(event, context):
     try:
-        # Read the IP address from Lambda environment variables
-        ip_address = os.environ.get("AUTOAM_IP_ADDRESS")
-        sqs_queue_url = os.environ.get("SQS_QUEUE_URL")
+        if os.environ.get("INGEST_MODE") == "archive":
+            # Append the batch to the NDJSON archive, the bulk loader COPYs it into the database
+            archive_listings(listings)
+        else:
+            # Insert data into PostgreSQL database
+            insert_into_database(listings)
+            update_seen_index(listings)
+    except Exception:
+        if os.environ.get("INGEST_MODE") == "archive":
+            failed_records += [record for record, _ in scraped]
+        else:
+            # One bad row fails the whole transaction, write the records one by one so only the bad ones are retried
+            failed_records += insert_records(scraped)
 
-        if not ip_address:
-            raise Exception("AUTOAM_IP_ADDRESS environment variable is not set.")
-        
-        if not sqs_queue_url:
-            raise Exception("SQS_QUEUE_URL environment variable is not set.")
+    # Retry the failed messages after a backoff instead of the queue visibility timeout. Throttled messages are not
+    # released, they stay hidden for the whole visibility timeout while auto.am recovers
+    release_failed_records(failed_records)
 
-        # Initialize SQS client
-        sqs = boto3.client('sqs')
+    # Lambda deletes every message that is not reported as failed
+    return {"batchItemFailures": [{"itemIdentifier": record['messageId']} for record in failed_records + throttled_records]}
 
-        for record in event['Records']:
-            listing_url = record['body']
-            data = get_data_from_listing(listing_url, ip_address)
+def get_retry_delay(record):
+    # Exponential backoff on the receive count, so a message reaches the dead-letter queue after minutes, not seconds
+    base_delay = int(os.environ.get("LISTING_RETRY_DELAY", DEFAULT_LISTING_RETRY_DELAY))
+    receive_count = int(record.get('attributes', {}).get('ApproximateReceiveCount', 1))
 
-            # Insert data into PostgreSQL database
-            insert_into_database(data)
+    return min(base_delay * 2 ** (max(receive_count, 1) - 1), MAX_VISIBILITY_TIMEOUT)
+
+def release_failed_records(records):
+    sqs_queue_url = os.environ.get("SQS_QUEUE_URL")
 
-            # If processing is successful, delete the message from the queue
-            sqs.delete_message(
+    if not records or not sqs_queue_url:
+        return
+
+    # The client is shared with the producer and created only when a batch has failures
+    sqs = get_sqs_client()
+
+    try:
+        for i in range(0, len(records), 10):
+            sqs.change_message_visibility_batch(
                 QueueUrl=sqs_queue_url,
-                ReceiptHandle=record['receiptHandle']
+                Entries=[
+                    {
+                        "Id": str(index),
+                        "ReceiptHandle": record['receiptHandle'],
+                        "VisibilityTimeout": get_retry_delay(record)
+                    }
+                    for index, record in enumerate(records[i:i+10])
+                ]
             )
-
-        # Return the result
-        return {"statusCode": 200, "body": json.dumps({"records": event['Records']})}
     except Exception as e:
-        # Handle exceptions and return an error response
-        return {"statusCode": 500, "body": json.dumps({"error": str(e)})}
+        # The messages are still retried once the visibility timeout expires
+        print(f"Error releasing failed messages: {str(e)}")
 
-def get_data_from_listing(listing_url, ip_address):
-    # Step 1: Send an HTTP GET request to obtain cookies and CSRF token
-    base_url = f"https://{ip_address}/lang/en"
-    response = requests.get(base_url, verify=False)
-
-    # Check if the initial request was successful (status code 200)
-    if response.status_code == 200:
-        # Extract cookies and CSRF token from the response
-        autoam_session_cookie = response.cookies.get("autoam_session")
-        xsrf_token_cookie = response.cookies.get("XSRF-TOKEN")
-        soup = BeautifulSoup(response.text, 'html.parser')
-        csrf_token = soup.find('meta', {'name': 'csrf-token'})['content']
-
-        # Step 2: Make a GET request to the listing endpoint using CSRF token and cookies
-        listing_page_url = f"https://{ip_address}{listing_url}"
-        listing_headers = {
-            'Host': 'auto.am',
-            'Accept': '*/*',
-            'Accept-Language': 'en-US,en;q=0.5',
-            'Accept-Encoding': 'gzip, deflate, br',
-            'Content-Type': 'application/x-www-form-urlencoded; charset=UTF-8',
-            'X-CSRF-Token': csrf_token,
-            'X-Requested-With': 'XMLHttpRequest',
-            'Origin': 'https://auto.am',
-            'Connection': 'keep-alive',
-            'Referer': base_url,
-            'Cookie': f'XSRF-TOKEN={xsrf_token_cookie}; autoam_session={autoam_session_cookie}'
-        }
-
-        # Step 3: Send an HTTP GET request to the listing endpoint with CSRF token, cookies, and headers
-        listing_response = requests.get(listing_page_url, headers=listing_headers, verify=False)
-
-        # Check if the second request was successful (status code 200)
-        if listing_response.status_code == 200:
-            # Extract relevant information from the listing page
-            soup = BeautifulSoup(listing_response.text, 'html.parser')
-            car_year = soup.select('h1 a')[-3].text
-            car_make = soup.select('h1 a')[-2].text
-            car_model = soup.select('h1 a')[-1].text
-            car_insert_date = soup.select('.attrs span')[0].text
-            car_location = soup.select('.attrs span')[1].text.split(", ")[1] if len(soup.select('.attrs span')[1].text.split(", ")) > 1 else None
-            car_price = soup.select('.offer-top-price .price span, .offer-top-price .price small')[0].text.replace(" ", "").lower()
-            car_seller_id = soup.select('.ad-seller-details a.call-seller')[0].get('data-sellerid')
-            car_pricing_attributes = soup.select('.offer-top-price .price-attrs')[0].text.lower()
-            car_vin = soup.select('.pad-left-6')[0].text.strip() if len(soup.select('.pad-left-6')) > 0 else None
-            car_is_exchangable = False
-            car_pay_with_installments = False
-            car_is_negotiable = False
-            car_is_urgent = False
-            car_options = soup.select('.ad-options')[0].text.strip() if len(soup.select('.ad-options')) > 0 else None
-
-            if "exchange" in car_pricing_attributes:
-                car_is_exchangable = True
-            if "installments" in car_pricing_attributes:
-                car_pay_with_installments = True
-            if car_price == "negotiable":
-                car_price = -1
-                car_is_negotiable = True
-            if len(soup.select('.urgent-stiker')) > 0:
-                car_is_urgent = True
-
-            # Extract additional details from the listing page
-            car_details = {}
-            car_details_table = soup.select('.ad-det tr')
-            for detail in car_details_table:
-                key = detail.select('td')[0].text.lower().replace(" ", "_")
-                value = detail.select('td')[1].span.text.strip().lower().strip('"') if detail.select('td')[1].span else detail.select('td')[1].text.strip().lower()
-                car_details[key] = value
-
-            if car_details["mileage"]:
-                # Define a regex pattern to capture the mileage number and measurement type
-                milage_list = car_details["mileage"].split()
-                car_details["mileage"] = milage_list[0]
-                car_details["milage_measurement"] = milage_list[1]
-
-            return {
-                "listing_id": listing_url.split("/")[2],
-                "car_year": car_year,
-                "car_make": car_make,
-                "car_model": car_model,
-                "car_vin": car_vin,
-                "car_is_urgent": car_is_urgent,
-                "car_is_negotiable": car_is_negotiable,
-                "car_is_exchangable": car_is_exchangable,
-                "car_pay_with_installments": car_pay_with_installments,
-                "car_insert_date": datetime.strptime(car_insert_date, "%d.%m.%Y").strftime("%Y-%m-%d"), 
-                "car_location": car_location,
-                "car_price": car_price,
-                "car_seller_id": car_seller_id,
-                "car_details": car_details,
-                "car_options": car_options
-            }
+def insert_records(scraped):
+    written = []
+    failed_records = []
+
+    for record, data in scraped:
+        try:
+            insert_into_database(data)
+            written += data
+        except Exception:
+            failed_records.append(record)
+
+    # The index is rewritten once for every record that made it
+    update_seen_index(written)
+
+    return failed_records
+
+def get_listing_urls(record):
+    body = record['body']
+
+    # A message carries either a single listing URL or a JSON list of URLs packed by the producer
+    return json.loads(body) if body.startswith("[") else [body]
+
+def fetch_listings(records, ip_address):
+    # Listings are fetched in parallel, the client caps in-flight requests to auto.am and applies the request timeout
+    client = get_client(ip_address)
+
+    def fetch(listing_url):
+        try:
+            listing_id = get_listing_id(listing_url)
+            return get_data_from_listing(listing_url, ip_address)
+        except ListingNotFound:
+            # The listing was sold or deleted, it is marked as removed instead of being retried
+            return {"listing_id": listing_id, "removed": True}
+        except (CircuitOpen, RateLimitTimeout) as e:
+            # auto.am asked to back off, the listing itself is fine
+            print(f"Throttled {listing_url}: {str(e)}")
+            return THROTTLED
+        except Exception as e:
+            # Leave the message on the queue, it becomes visible again for a retry
+            print(f"Error scraping {listing_url}: {str(e)}")
+            return None
+
+    record_urls = [get_listing_urls(record) for record in records]
+    with ThreadPoolExecutor(max_workers=client.max_concurrency) as executor:
+        results = iter(list(executor.map(fetch, [listing_url for listing_urls in record_urls for listing_url in listing_urls])))
+
+    # A record only succeeds when every listing packed into it was scraped
+    fetched = []
+    for record, listing_urls in zip(records, record_urls):
+        data = [next(results) for _ in listing_urls]
+        if any(listing is THROTTLED for listing in data):
+            fetched.append((record, THROTTLED))
         else:
-            raise Exception(f"Failed to make the GET request to the listing endpoint. Status code: {listing_response.status_code}")
-    else:
-        raise Exception(f"Failed to retrieve cookies. Status code: {response.status_code}")
-
-def insert_into_database(data):
-    # Get PostgreSQL credentials.
-    smclient = boto3.client('secretsmanager')
-    master_credential = json.loads(smclient.get_secret_value(SecretId=os.environ.get("RDS_SECRET_ARN"))['SecretString'])
-
-    # Connect to the PostgreSQL database
-    conn = psycopg2.connect(
-        host=os.environ.get("RDS_ENDPOINT"),
-        port=os.environ.get("RDS_PORT"),
-        user=master_credential['username'],
-        password=master_credential['password'],
-        database=os.environ.get('RDS_DATABASE_NAME')
-    )
+            fetched.append((record, None if None in data else data))
+
+    return fetched
+
+@timed("get_data_from_listing")
+def get_data_from_listing(listing_url, ip_address):
+    # The shared client reuses cached cookies and CSRF token, so only the listing page itself is requested
+    return fetch_listing(get_client(ip_address), listing_url)
 
+def update_seen_index(listings):
     try:
-        # Create a cursor object to interact with the database
-        cur = conn.cursor()
-
-        # Define the SQL query for insertion (modify this according to your table structure)
-        sql = """
-        INSERT INTO cars_raw_data (
-            listing_id, year, make, model, vin, is_negotiable, is_urgent,
-            is_exchangable, pay_with_installments, insert_date,
-            location, price, seller_id, details, options
-        ) VALUES (
-            %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s
-        ) ON CONFLICT (listing_id) DO NOTHING
-        """
-
-        # Execute the query with the data
-        cur.execute(sql, (
-            data["listing_id"], data["car_year"], data["car_make"], data["car_model"],
-            data["car_vin"], data["car_is_negotiable"], data["car_is_urgent"],
-            data["car_is_exchangable"], data["car_pay_with_installments"],
-            data["car_insert_date"], data["car_location"],
-            data["car_price"], data["car_seller_id"],
-            json.dumps(data["car_details"]), data["car_options"]
-        ))
-
-        # Commit the changes
-        conn.commit()
+        # Committed listings are added to the index, so the scrapers stop enqueueing them
+        record_listings([data["listing_id"] for data in listings if not data.get("removed")])
+    except Exception as e:
+        # A stale index only costs duplicate fetches, the rows are already committed
+        print(f"Error updating seen index: {str(e)}")
+
+def archive_listings(listings):
+    if listings:
+        write_batch(listings)
 
+@timed("insert_into_database")
+def insert_into_database(listings):
+    if not listings:
+        return
+
+    # The connection is cached at module scope and reused by warm invocations
+    conn = get_connection()
+
+    try:
+        # Insert all rows with a single multi-row statement and commit them together
+        write_listings(conn, listings)
     except Exception as e:
-        # Handle database insertion errors
+        # Handle database insertion errors, none of the records are acknowledged
         print(f"Error inserting into database: {str(e)}")
 
-    finally:
-        # Close the database connection
-        cur.close()
-        conn.close()
\ No newline at end of file
+        # A bad row only aborts the transaction, a broken connection is opened again on the next call
+        if conn.closed:
+            reset_connection()
+        raise
@@ -0,0 +1,30 @@
+import os
+import sys
+import importlib.util
+import pytest
+
+ROOT_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..")
+
+# Layer modules import each other by name, like they do inside the Lambda layer
+sys.path.insert(0, os.path.join(ROOT_DIR, "src", "layer"))
+# The mock auto.am server and its HTML fixtures are shared with the benchmarks
+sys.path.insert(0, os.path.join(ROOT_DIR, "benchmarks"))
+
+FIXTURES_DIR = os.path.join(ROOT_DIR, "benchmarks", "fixtures")
+
+
+def load_handler(function_dir):
+    # Every function is an app.py in its own directory, so each is loaded under a name of its own
+    spec = importlib.util.spec_from_file_location(function_dir.replace("-", "_"), os.path.join(ROOT_DIR, "src", function_dir, "app.py"))
+    module = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(module)
+    return module
+
+
+@pytest.fixture
+def read_fixture():
+    def read(name):
+        with open(os.path.join(FIXTURES_DIR, name), encoding="utf-8") as f:
+            return f.read()
+
+    return read
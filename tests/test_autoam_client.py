@@ -0,0 +1,28 @@
+from autoam_client import EXCLUSIVE_BOUNDS, get_shard_filters, parse_csrf_token, parse_makes
+
+
+def test_shard_filters_cover_exactly_the_shard():
+    filters = get_shard_filters({"year": [2010, 2010], "usdprice": [0, 4999]})
+
+    # Without detected semantics the bounds are sent as they are, inclusive
+    assert filters["year"] == {"gt": "2010", "lt": "2010"}
+    assert filters["usdprice"] == {"gt": "0", "lt": "4999"}
+    assert filters["category"] == "1"
+
+    filters = get_shard_filters({"year": [2010, 2010], "usdprice": [0, 4999], "bounds": EXCLUSIVE_BOUNDS})
+
+    assert filters["year"] == {"gt": "2009", "lt": "2011"}
+    assert filters["usdprice"] == {"gt": "-1", "lt": "5000"}
+
+
+def test_parse_csrf_token():
+    html = '<head><meta name="csrf-token" content="fixtureCsrfToken"></head>'
+
+    assert parse_csrf_token(html) == "fixtureCsrfToken"
+
+
+def test_parse_makes():
+    html = '<select name="make"><option value="">Make</option><option value="great-wall">Great Wall</option><option value="lada">Lada (VAZ)</option></select>'
+
+    assert parse_makes(html) == ("Great Wall", "Lada (VAZ)")
+    assert parse_makes("<html></html>") == ()
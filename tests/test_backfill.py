@@ -0,0 +1,70 @@
+import asyncio
+import pytest
+import backfill
+from autoam_client import AutoAmClient
+import mock_autoam
+
+
+@pytest.fixture
+def server():
+    server = mock_autoam.start_server()
+    yield server
+    server.shutdown()
+    server.server_close()
+
+
+def get_client(server):
+    return AutoAmClient("127.0.0.1:{}".format(server.server_address[1]), max_concurrency=6, scheme="http")
+
+
+def test_every_listing_of_the_pages_is_written(server):
+    written = []
+
+    stats = asyncio.run(backfill.run(get_client(server), written.extend, 1, 5, concurrency=4, flush_interval=0.1))
+
+    assert (stats.pages, stats.failed_pages, stats.urls, stats.failed) == (5, 0, 100, 0)
+    assert stats.written == len(written) == 100
+    assert len({data["listing_id"] for data in written}) == 100
+    assert all(data["car_year"] for data in written)
+
+
+def test_failed_pages_are_counted(server):
+    class FailingPageClient(AutoAmClient):
+        def search(self, page_number, filters=None):
+            if page_number == 3:
+                raise Exception("search page unavailable")
+            return super().search(page_number, filters)
+
+    client = FailingPageClient("127.0.0.1:{}".format(server.server_address[1]), max_concurrency=6, scheme="http")
+    written = []
+
+    stats = asyncio.run(backfill.run(client, written.extend, 1, 5, concurrency=4, flush_interval=0.1))
+
+    assert (stats.pages, stats.failed_pages, stats.urls) == (4, 1, 80)
+    assert len(written) == 80
+    assert "1 failed pages" in stats.report()
+
+
+def test_removed_listings_are_marked(server, monkeypatch):
+    monkeypatch.setattr(server.RequestHandlerClass, "gone_rate", 1.0)
+    written = []
+
+    stats = asyncio.run(backfill.run(get_client(server), written.extend, 1, 1, flush_interval=0.1))
+
+    assert (stats.removed, stats.listings) == (20, 0)
+    assert all(data["removed"] and data["listing_id"].isdigit() for data in written)
+
+
+def test_a_bad_row_only_fails_itself(server):
+    written = []
+
+    def write(batch):
+        # Like a transaction, the batch is written whole or not at all
+        if any(data["listing_id"] == "3000042" for data in batch):
+            raise Exception("invalid input syntax for type integer")
+        written.extend(batch)
+
+    stats = asyncio.run(backfill.run(get_client(server), write, 1, 5, concurrency=4, batch_size=500, flush_interval=10))
+
+    assert (stats.written, stats.failed) == (99, 1)
+    assert len(written) == 99
@@ -0,0 +1,74 @@
+import io
+import gzip
+import json
+from datetime import datetime, timedelta, timezone
+import bulk_loader
+from bulk_loader import CopyStream, copy_lines, copy_value, pending_keys, put_loaded_key
+from autoam_db import LISTING_COLUMNS, listing_to_row
+from listing_extractor import extract_listing
+from storage import LocalStore
+
+
+def archive_key(moment):
+    return "listings/{}/{}-0000abcd.ndjson.gz".format(moment.date().isoformat(), moment.strftime("%H%M%S%f"))
+
+
+def test_pending_keys_start_after_the_last_loaded_file(tmp_path):
+    store = LocalStore(str(tmp_path), bulk_loader.DEFAULT_ARCHIVE_PREFIX)
+    now = datetime.now(timezone.utc)
+    keys = [archive_key(now - timedelta(days=days, minutes=10)) for days in (3, 2, 1, 0)] + [archive_key(now)]
+    for key in keys:
+        store.put(key, b"")
+
+    assert pending_keys(store, lag=60) == keys[:4]
+
+    put_loaded_key(store, keys[1])
+    # The file written just now is left for the next run, its upload may not be complete everywhere yet
+    assert pending_keys(store, lag=60) == keys[2:4]
+    assert pending_keys(store, lag=0) == keys[2:]
+
+
+def test_copy_value_escapes_the_text_format():
+    assert copy_value(None) == "\\N"
+    assert (copy_value(True), copy_value(False)) == ("t", "f")
+    assert copy_value(18500) == "18500"
+    assert copy_value("a\\b\tc\nd\re") == "a\\\\b\\tc\\nd\\re"
+    # A literal \N in a value is not NULL
+    assert copy_value("\\N") == "\\\\N"
+
+
+def test_listing_to_row_hashes_the_content(read_fixture):
+    data = extract_listing(read_fixture("listing-3125001.html"), "/offer/3125001")
+    row = listing_to_row(data)
+
+    assert len(row) == len(LISTING_COLUMNS)
+    # The details are serialized with sorted keys, so the hash does not depend on their order
+    reordered = dict(data, car_details=dict(reversed(list(data["car_details"].items()))))
+    assert listing_to_row(reordered) == row
+    assert listing_to_row(dict(data, car_price=17900))[-1] != row[-1]
+
+
+def test_copy_lines_skip_removed_listings_and_number_lines_across_files(read_fixture):
+    data = extract_listing(read_fixture("listing-3125001.html"), "/offer/3125001")
+    data["car_options"] = "ABS\tClimate\ncontrol \\ leather"
+
+    def ndjson(*listings):
+        return io.BytesIO(gzip.compress("".join(json.dumps(listing) + "\n" for listing in listings).encode("utf-8")))
+
+    removed = {}
+    lines = list(copy_lines([ndjson(data, {"listing_id": "3125002", "removed": True}), ndjson(data)], removed))
+
+    assert removed == {3125002: 1}
+    assert [line.split("\t")[-1] for line in lines] == ["0\n", "2\n"]
+    # Every line has one field per column plus seq, tabs and newlines inside values are escaped
+    fields = lines[0].rstrip("\n").split("\t")
+    assert len(fields) == len(LISTING_COLUMNS) + 1
+    assert fields[LISTING_COLUMNS.index("options")] == "ABS\\tClimate\\ncontrol \\\\ leather"
+
+
+def test_copy_stream_reads_in_chunks():
+    stream = CopyStream(iter(["ab\n", "cde\n", "f\n"]))
+
+    assert stream.read(4) == "ab\nc"
+    assert stream.read() == "de\nf\n"
+    assert stream.read(10) == ""
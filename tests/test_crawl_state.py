@@ -0,0 +1,44 @@
+from crawl_state import FileCrawlState, summarize, unfinished, PENDING, RUNNING, DONE, FAILED
+
+
+def test_start_resume_and_finish_a_crawl(tmp_path):
+    path = str(tmp_path / "crawl-state.json")
+    state = FileCrawlState(path)
+    assert state.get_current_crawl() is None
+
+    crawl_id = state.start_crawl([{"start": 1, "end": 2}, {"start": 3, "end": 4}])
+    assert state.get_current_crawl() == crawl_id
+
+    chunks = state.list_chunks(crawl_id)
+    assert [(chunk["chunk_id"], chunk["pages"], chunk["status"]) for chunk in chunks] == [
+        ("000000", {"start": 1, "end": 2}, PENDING),
+        ("000001", {"start": 3, "end": 4}, PENDING)
+    ]
+
+    # The first round finishes one chunk and fails the other after its first page
+    assert state.start_chunk(crawl_id, "000000")["status"] == RUNNING
+    state.finish_chunk(crawl_id, "000000", 40)
+    state.start_chunk(crawl_id, "000001")
+    state.save_progress(crawl_id, "000001", 4, 20)
+    state.fail_chunk(crawl_id, "000001", "Failed to make the POST request to the search endpoint. Status code: 503")
+
+    # The next round, from another process sharing the file, resumes only the failed chunk after its last done page
+    resumed = FileCrawlState(path)
+    assert resumed.get_current_crawl() == crawl_id
+    assert [chunk["chunk_id"] for chunk in unfinished(resumed.list_chunks(crawl_id))] == ["000001"]
+    assert resumed.start_chunk(crawl_id, "000000") is None
+
+    chunk = resumed.start_chunk(crawl_id, "000001")
+    assert (chunk["attempts"], chunk["next_page"], chunk["urls_count"]) == (2, 4, 20)
+
+    resumed.finish_chunk(crawl_id, "000001", 40)
+    chunks = resumed.list_chunks(crawl_id)
+    assert unfinished(chunks) == []
+    assert "error" not in chunks[1]
+    assert summarize(chunks) == {PENDING: 0, RUNNING: 0, DONE: 2, FAILED: 0, "urls_count": 80}
+
+    # Only the current crawl is finished
+    resumed.finish_crawl("20000101T000000Z")
+    assert resumed.get_current_crawl() == crawl_id
+    resumed.finish_crawl(crawl_id)
+    assert state.get_current_crawl() is None
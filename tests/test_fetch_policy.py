@@ -0,0 +1,95 @@
+import threading
+import pytest
+import fetch_policy
+from fetch_policy import CircuitBreaker, CircuitOpen
+from autoam_client import AutoAmClient
+
+
+class FakeClock:
+    def __init__(self, now=1000.0):
+        self.now = now
+        self.sleeps = []
+
+    def monotonic(self):
+        return self.now
+
+    def sleep(self, seconds):
+        self.sleeps.append(seconds)
+        self.now += seconds
+
+
+class RecordingBucket:
+    def __init__(self):
+        self.pauses = []
+
+    def pause(self, seconds):
+        self.pauses.append(seconds)
+
+
+@pytest.fixture
+def clock(monkeypatch):
+    clock = FakeClock()
+    monkeypatch.setattr(fetch_policy.time, "monotonic", clock.monotonic)
+    monkeypatch.setattr(fetch_policy.time, "sleep", clock.sleep)
+    return clock
+
+
+def test_retry_after_is_capped_at_the_cooldown(clock):
+    bucket = RecordingBucket()
+    breaker = CircuitBreaker(bucket, threshold=5, cooldown=30, max_wait=10)
+
+    breaker.record_failure(retry_after=3600)
+
+    assert bucket.pauses == [30]
+    with pytest.raises(CircuitOpen):
+        breaker.wait()
+
+    clock.now += 25
+    breaker.wait()
+    assert clock.sleeps == [pytest.approx(5)]
+
+
+def test_breaker_opens_after_a_run_of_failures(clock):
+    breaker = CircuitBreaker(threshold=3, cooldown=4, max_wait=10)
+
+    breaker.record_failure()
+    breaker.record_failure()
+    breaker.wait()
+    assert clock.sleeps == []
+
+    breaker.record_failure()
+    breaker.wait()
+    assert clock.sleeps == [pytest.approx(4)]
+
+
+def test_token_refresh_does_not_block_other_threads():
+    started = threading.Event()
+    release = threading.Event()
+
+    class SlowHomepageClient(AutoAmClient):
+        def refresh_token(self):
+            started.set()
+            release.wait(5)
+            with self._lock:
+                self._csrf_token, self._cookie_header, self._token_fetched_at = "new", "cookie", fetch_policy.time.monotonic()
+            return "new", "cookie"
+
+    client = SlowHomepageClient("127.0.0.1:1", token_ttl=60, scheme="http")
+    client._csrf_token, client._cookie_header, client._token_fetched_at = "old", "cookie", -1000.0
+
+    refresher = threading.Thread(target=client.get_token)
+    refresher.start()
+    assert started.wait(5)
+
+    # The expired token is handed out, and the homepage is not requested again, while the refresh is in flight
+    assert client.get_token() == ("old", "cookie")
+    client.invalidate_token("old")
+
+    waiter_result = []
+    waiter = threading.Thread(target=lambda: waiter_result.append(client.get_token()))
+    waiter.start()
+
+    release.set()
+    refresher.join(5)
+    waiter.join(5)
+    assert waiter_result == [("new", "cookie")]
@@ -0,0 +1,83 @@
+import types
+import pytest
+from conftest import load_handler
+from autoam_client import INCLUSIVE_BOUNDS, EXCLUSIVE_BOUNDS
+
+LISTINGS_PER_PAGE = 20
+
+
+class FakeSite:
+    # Answers page counts of a search over a fixed set of (year, price) listings, with either bound semantics
+    def __init__(self, listings, bounds):
+        self.listings = listings
+        self.bounds = bounds
+        self.searches = 0
+
+    def matches(self, value, range_filter):
+        low, high = int(range_filter["gt"]), int(range_filter["lt"])
+        if self.bounds == INCLUSIVE_BOUNDS:
+            return low <= value <= high
+        return low < value < high
+
+    def get_pages_count(self, client, filters=None):
+        self.searches += 1
+        count = sum(1 for year, price in self.listings if self.matches(year, filters["year"]) and self.matches(price, filters["usdprice"]))
+        return -(-count // LISTINGS_PER_PAGE)
+
+    def count_in(self, shard):
+        return sum(1 for year, price in self.listings if shard["year"][0] <= year <= shard["year"][1] and shard["usdprice"][0] <= price <= shard["usdprice"][1])
+
+
+@pytest.fixture
+def get_pages(monkeypatch):
+    app = load_handler("get-pages")
+    monkeypatch.setattr(app, "get_client", lambda ip_address: types.SimpleNamespace(max_concurrency=4))
+    return app
+
+
+def listings():
+    # Most listings in a few recent years and cheap prices, a long tail of old and expensive ones
+    return [(2005 + i % 15, 1000 + (i * 7919) % 60000) for i in range(3000)] + [(1990, 500), (2018, 250000), (2024, 99999999)]
+
+
+def test_split_range(get_pages):
+    assert get_pages.split_range(2000, 2009, 2, False) == [[2000, 2004], [2005, 2009]]
+    assert get_pages.split_range(2010, 2010, 3, False) == [[2010, 2010]]
+
+    parts = get_pages.split_range(0, 100000000, 4, True)
+    assert parts[0][0] == 0 and parts[-1][1] == 100000000
+    assert all(previous[1] + 1 == part[0] for previous, part in zip(parts, parts[1:]))
+
+
+def test_split_shard(get_pages):
+    shard = {"year": [2000, 2003], "usdprice": [0, 1000], "bounds": EXCLUSIVE_BOUNDS}
+
+    assert get_pages.split_shard(shard, 2) == [dict(shard, year=[2000, 2001]), dict(shard, year=[2002, 2003])]
+    # A single year is split by price, and the bound semantics stay with every part
+    by_price = get_pages.split_shard(dict(shard, year=[2001, 2001]), 2)
+    assert [part["year"] for part in by_price] == [[2001, 2001], [2001, 2001]]
+    assert all(part["bounds"] == EXCLUSIVE_BOUNDS for part in by_price)
+    assert get_pages.split_shard(dict(shard, year=[2001, 2001], usdprice=[5, 5]), 2) is None
+
+
+@pytest.mark.parametrize("bounds", [INCLUSIVE_BOUNDS, EXCLUSIVE_BOUNDS])
+def test_shards_cover_every_listing_once(get_pages, monkeypatch, bounds):
+    site = FakeSite(listings(), bounds)
+    monkeypatch.setattr(get_pages, "get_pages_count", site.get_pages_count)
+
+    shards = get_pages.get_shards("127.0.0.1", 5)
+
+    assert all(shard["bounds"] == bounds for shard, _ in shards)
+    assert sum(site.count_in(shard) for shard, _ in shards) == len(site.listings)
+    # Every shard is searched with its exact range, so the counted pages match the listings inside it
+    assert all(pages_count == -(-site.count_in(shard) // LISTINGS_PER_PAGE) for shard, pages_count in shards)
+    assert all(pages_count <= 5 for _, pages_count in shards)
+
+
+def test_bounds_are_probed_until_a_year_has_listings(get_pages, monkeypatch):
+    site = FakeSite([(2012, 9000)], EXCLUSIVE_BOUNDS)
+    monkeypatch.setattr(get_pages, "get_pages_count", site.get_pages_count)
+
+    assert get_pages.detect_bounds("127.0.0.1") == EXCLUSIVE_BOUNDS
+    # 2018 and 2015 are empty either way, 2012 is empty with exact bounds and found with widened ones
+    assert site.searches == 6
@@ -0,0 +1,73 @@
+from listing_extractor import extract_listing, extract_listing_cards, parse_price, parse_mileage, parse_card_title, parse_card_price
+
+
+def test_listing_price_and_mileage(read_fixture):
+    data = extract_listing(read_fixture("listing-3125001.html"), "/offer/3125001")
+
+    assert (data["car_price"], data["car_is_negotiable"]) == (18500, False)
+    assert (data["car_details"]["mileage"], data["car_details"]["milage_measurement"]) == ("84000", "km")
+    assert "price_currency" not in data["car_details"]
+
+
+def test_negotiable_listing_in_miles(read_fixture):
+    data = extract_listing(read_fixture("listing-3125002.html"), "/offer/3125002")
+
+    assert (data["car_price"], data["car_is_negotiable"]) == (-1, True)
+    assert (data["car_details"]["mileage"], data["car_details"]["milage_measurement"]) == ("210000", "mi")
+
+
+def test_price_in_another_currency_stays_out_of_the_price_column(read_fixture):
+    html = read_fixture("listing-3125001.html").replace("$ 18 500", "7 200 000 ֏")
+    data = extract_listing(html, "/offer/3125001")
+
+    assert data["car_price"] is None
+    assert (data["car_details"]["price"], data["car_details"]["price_currency"]) == ("7200000", "amd")
+
+
+def test_parse_price():
+    assert parse_price("$ 18 500") == (18500, "usd", False)
+    assert parse_price("18 500") == (18500, "usd", False)
+    assert parse_price("2 500 000 ֏") == (2500000, "amd", False)
+    assert parse_price("€12 000") == (12000, "eur", False)
+    assert parse_price("Negotiable") == (None, None, True)
+
+
+def test_parse_mileage():
+    assert parse_mileage("84 000 km") == ("84000", "km")
+    assert parse_mileage("1,200 mi") == ("1200", "mi")
+    assert parse_mileage("15000") == ("15000", None)
+
+
+def test_search_page_cards(read_fixture):
+    cards = extract_listing_cards(read_fixture("search.html"))
+
+    assert len(cards) == 20
+    assert cards[0]["listing_url"] == "/offer/" + cards[0]["listing_id"]
+    assert (cards[0]["car_year"], cards[0]["car_make"], cards[0]["car_model"]) == (2004, "Toyota", "Camry")
+    assert (cards[0]["car_price"], cards[0]["car_is_negotiable"]) == (9000, False)
+
+
+def test_parse_card_title_with_the_make_list():
+    makes = ("Great Wall", "Great", "Rolls Royce", "Land Rover", "Toyota")
+
+    assert parse_card_title("2015 Toyota Camry", makes) == (2015, "Toyota", "Camry")
+    assert parse_card_title("2012 Great Wall Hover", makes) == (2012, "Great Wall", "Hover")
+    assert parse_card_title("2019 Rolls Royce Ghost", makes) == (2019, "Rolls Royce", "Ghost")
+    assert parse_card_title("2012 Land Rover Range Rover Sport", makes) == (2012, "Land Rover", "Range Rover Sport")
+    # A make the site does not list is not guessed
+    assert parse_card_title("2010 Tesla Model S", makes) == (2010, None, None)
+
+
+def test_parse_card_title_without_the_make_list():
+    assert parse_card_title("2015 Toyota Camry") == (2015, "Toyota", "Camry")
+    assert parse_card_title("2008 Mercedes-Benz") == (2008, "Mercedes-Benz", None)
+    assert parse_card_title("1985 Lada (VAZ) 2107") == (1985, "Lada (VAZ)", "2107")
+    # Which words are the make is ambiguous, nothing is stored rather than a wrong split
+    assert parse_card_title("2012 Great Wall Hover") == (2012, None, None)
+
+
+def test_parse_card_price():
+    assert parse_card_price("$9 000") == (9000, False)
+    assert parse_card_price("Negotiable") == (-1, True)
+    # Only US dollars go into the price column
+    assert parse_card_price("2 500 000 ֏") == (None, False)
@@ -0,0 +1,83 @@
+import os
+from datetime import date, datetime, timezone
+import pytest
+import parquet_export
+from parquet_export import EXPORT_COLUMNS, NULL_PARTITION, export, get_watermark
+from storage import LocalStore
+
+pq = pytest.importorskip("pyarrow.parquet")
+
+NOW = datetime(2024, 3, 3, 12, 0, tzinfo=timezone.utc)
+
+
+class FakeCursor:
+    def __init__(self, rows):
+        self.rows = list(rows)
+        self.executed = []
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        pass
+
+    def execute(self, sql, params=None):
+        self.executed.append(params)
+
+    def fetchone(self):
+        return (NOW,)
+
+    def fetchmany(self, size):
+        rows, self.rows = self.rows[:size], self.rows[size:]
+        return rows
+
+
+class FakeConnection:
+    # The rows the export query returns, already in partition order
+    def __init__(self, rows):
+        self.export_cursor = FakeCursor(rows)
+
+    def cursor(self, name=None):
+        return self.export_cursor if name else FakeCursor([])
+
+    def rollback(self):
+        pass
+
+
+def export_row(insert_date, listing_id):
+    values = dict.fromkeys(column for column, _, _ in EXPORT_COLUMNS)
+    values.update(listing_id=listing_id, make="Toyota", created_at=NOW)
+    return (insert_date,) + tuple(values[column] for column, _, _ in EXPORT_COLUMNS)
+
+
+def read_partitions(path):
+    return {
+        name: sorted(pq.read_table(os.path.join(path, name, file_name)).column("listing_id").to_pylist())
+        for name in os.listdir(path) if name.startswith("insert_date=")
+        for file_name in os.listdir(os.path.join(path, name))
+    }
+
+
+def test_rows_are_partitioned_by_insert_date(tmp_path):
+    store = LocalStore(str(tmp_path), parquet_export.DEFAULT_EXPORT_PREFIX)
+    rows = [export_row(None, 1), export_row(date(2024, 3, 1), 2), export_row(date(2024, 3, 1), 3), export_row(date(2024, 3, 2), 4)]
+
+    # A batch of two rows splits the 2024-03-01 partition over two fetches, it still ends up in one file
+    _, next_watermark, counts = export(FakeConnection(rows), store, batch_size=2)
+
+    assert counts == {None: 1, "2024-03-01": 2, "2024-03-02": 1}
+    assert read_partitions(os.path.join(str(tmp_path), "cars_raw_data")) == {
+        "insert_date=" + NULL_PARTITION: [1], "insert_date=2024-03-01": [2, 3], "insert_date=2024-03-02": [4]
+    }
+    assert get_watermark(store) == next_watermark == NOW.isoformat()
+
+
+def test_a_repeated_run_overwrites_its_files(tmp_path):
+    store = LocalStore(str(tmp_path), parquet_export.DEFAULT_EXPORT_PREFIX)
+    export(FakeConnection([export_row(date(2024, 3, 1), 2)]), store)
+    parquet_export.put_watermark(store, "-infinity")
+
+    # Files are named after the watermark the run started from, the retry replaces the file with a superset
+    export(FakeConnection([export_row(date(2024, 3, 1), 2), export_row(date(2024, 3, 1), 3)]), store)
+
+    assert read_partitions(os.path.join(str(tmp_path), "cars_raw_data")) == {"insert_date=2024-03-01": [2, 3]}
@@ -0,0 +1,60 @@
+import contextlib
+import types
+import pytest
+from conftest import load_handler
+from seen_index import SeenIndex
+
+
+class FakeConnection:
+    closed = False
+
+    def cursor(self):
+        return contextlib.nullcontext("cursor")
+
+    def rollback(self):
+        pass
+
+
+@pytest.fixture
+def app(monkeypatch):
+    app = load_handler("process-new-listings")
+    # Listings 100 and 101 are in the warehouse, the lookups made against it are recorded
+    app.lookups = []
+
+    def find_known_listing_ids(cursor, listing_ids):
+        app.lookups.append(list(listing_ids))
+        return {listing_id for listing_id in listing_ids if listing_id in (100, 101)}
+
+    monkeypatch.setattr(app, "find_known_listing_ids", find_known_listing_ids)
+    monkeypatch.setattr(app, "get_client", lambda ip_address: types.SimpleNamespace())
+    monkeypatch.setattr(app, "get_connection", FakeConnection)
+    return app
+
+
+def index_of(*listing_ids):
+    index = SeenIndex()
+    index.update(listing_ids)
+    return index
+
+
+def test_an_index_hit_skips_the_rest_of_the_page(app):
+    known = app.find_known_on_page("cursor", index_of(101), [105, 104, 101, 100])
+
+    # Only the listings before the hit are confirmed against the database
+    assert known == {101}
+    assert app.lookups == [[105, 104]]
+
+
+def test_index_misses_are_confirmed_against_the_database(app):
+    assert app.find_known_on_page("cursor", index_of(), [102, 100]) == {100}
+    assert app.find_known_on_page("cursor", None, [103, 101]) == {101}
+
+
+def test_the_walk_stops_at_the_first_known_listing(app, monkeypatch):
+    pages = {1: [107, 106, 105], 2: [104, 101, 103], 3: [102]}
+    monkeypatch.setattr(app, "get_seen_index", lambda conn: index_of(101))
+    monkeypatch.setattr(app, "get_page_cards", lambda client, page_number: [{"listing_id": listing_id} for listing_id in pages.get(page_number, [])])
+
+    cards = app.get_new_cards_from_page("127.0.0.1")
+
+    assert [card["listing_id"] for card in cards] == [107, 106, 105, 104]
@@ -0,0 +1,83 @@
+import json
+import pytest
+import rate_limiter
+from rate_limiter import FileTokenBucket
+
+
+class FakeClock:
+    def __init__(self, now=1000.0):
+        self.now = now
+        self.sleeps = []
+
+    def time(self):
+        return self.now
+
+    def sleep(self, seconds):
+        self.sleeps.append(seconds)
+        self.now += seconds
+
+
+@pytest.fixture
+def clock(monkeypatch):
+    clock = FakeClock()
+    monkeypatch.setattr(rate_limiter.time, "time", clock.time)
+    monkeypatch.setattr(rate_limiter.time, "sleep", clock.sleep)
+    return clock
+
+
+def test_refill_is_capped_at_burst():
+    bucket = FileTokenBucket("unused", rate=2, burst=3)
+
+    assert bucket.refill(0, 100, 100.5) == 1.0
+    assert bucket.refill(1, 100, 200) == 3.0
+
+
+def test_burst_then_wait_for_a_token(tmp_path, clock):
+    bucket = FileTokenBucket(str(tmp_path / "bucket.json"), rate=10, burst=2)
+
+    assert bucket.try_acquire() == 0
+    assert bucket.try_acquire() == 0
+    assert bucket.try_acquire() == pytest.approx(0.1)
+
+    clock.now += 0.1
+    assert bucket.try_acquire() == 0
+
+
+def test_acquire_sleeps_until_a_token_is_refilled(tmp_path, clock):
+    bucket = FileTokenBucket(str(tmp_path / "bucket.json"), rate=1, burst=1)
+
+    bucket.acquire()
+    bucket.acquire()
+
+    assert len(clock.sleeps) == 1
+    assert clock.sleeps[0] >= 1
+
+
+def test_pause_holds_back_every_worker(tmp_path, clock):
+    path = str(tmp_path / "bucket.json")
+    FileTokenBucket(path, rate=10).pause(5)
+
+    # Another worker sharing the file sees the pause
+    assert FileTokenBucket(path, rate=10).try_acquire() == pytest.approx(5)
+
+    with open(path) as f:
+        assert json.load(f)["paused_until"] == pytest.approx(clock.now + 5)
+
+
+def test_acquire_gives_up_after_max_wait(tmp_path, clock):
+    bucket = FileTokenBucket(str(tmp_path / "bucket.json"), rate=10)
+    bucket.pause(60)
+
+    with pytest.raises(rate_limiter.RateLimitTimeout):
+        bucket.acquire(max_wait=5)
+
+    assert clock.sleeps == []
+
+
+def test_token_bucket_needs_both_operations():
+    class AcquireOnly(rate_limiter.TokenBucket):
+        def try_acquire(self):
+            return 0
+
+    with pytest.raises(TypeError):
+        AcquireOnly(rate=1)
@@ -0,0 +1,19 @@
+from response_cache import body_hash
+
+
+def test_views_csrf_and_related_listings_do_not_change_the_hash(read_fixture):
+    html = read_fixture("listing-3125001.html")
+    revisited = (
+        html.replace("Views: 1342", "Views: 1 377")
+        .replace("/offer/3100000", "/offer/3199999")
+        .replace("fixtureCsrfToken0123456789abcdefghijklmn", "otherCsrfToken")
+    )
+
+    assert body_hash(revisited) == body_hash(html)
+
+
+def test_a_changed_listing_changes_the_hash(read_fixture):
+    html = read_fixture("listing-3125001.html")
+
+    assert body_hash(html.replace("18 500", "17 900")) != body_hash(html)
+    assert body_hash(html.replace("84 000 km", "85 000 km")) != body_hash(html)
@@ -0,0 +1,74 @@
+import pytest
+import seen_index
+from seen_index import SeenIndex, filter_unseen, load_index, save_index, record_listings, rebuild_index, list_deltas
+from storage import LocalStore
+
+
+@pytest.fixture
+def store(tmp_path):
+    return LocalStore(str(tmp_path), seen_index.DEFAULT_INDEX_PREFIX)
+
+
+def test_round_trip():
+    index = SeenIndex()
+    index.update([1, 8, 3125001])
+
+    loaded = SeenIndex.from_bytes(index.to_bytes())
+
+    assert all(listing_id in loaded for listing_id in (1, 8, "3125001"))
+    assert not any(listing_id in loaded for listing_id in (0, 2, 9, 3125000, 99999999))
+
+
+def test_unknown_format():
+    with pytest.raises(Exception):
+        SeenIndex.from_bytes(b"not an index")
+
+
+def test_merge():
+    index, other = SeenIndex(), SeenIndex()
+    index.update([3, 700000])
+    other.update([5, 900000])
+
+    index.merge(other)
+
+    assert all(listing_id in index for listing_id in (3, 5, 700000, 900000))
+
+
+def test_filter_unseen():
+    index = SeenIndex()
+    index.add(3125001)
+    urls = ["/offer/3125001", "/offer/3125002"]
+
+    assert filter_unseen(urls, index) == ["/offer/3125002"]
+    assert filter_unseen(urls, None) == urls
+
+
+def test_recorded_listings_are_merged_on_load(store):
+    record_listings([7], store)
+    # Deltas alone are not an index, the full index is built first
+    assert load_index(store) is None
+
+    save_index(SeenIndex(b"\x02"), store)
+    record_listings([3125001], store)
+
+    index = load_index(store)
+    assert (1 in index, 7 in index, 3125001 in index) == (True, True, True)
+    assert len(list_deltas(store)) == 2
+
+
+def test_rebuild_drops_only_the_deltas_it_covers(store, monkeypatch):
+    record_listings([7], store)
+
+    def build_index(conn):
+        # A batch committed while the warehouse is read keeps its delta
+        record_listings([11], store)
+        index = SeenIndex()
+        index.update([7, 9])
+        return index
+
+    monkeypatch.setattr(seen_index, "build_index", build_index)
+    rebuild_index(None, store)
+
+    index = load_index(store)
+    assert (7 in index, 9 in index, 11 in index) == (True, True, True)
+    assert len(list_deltas(store)) == 1
@@ -0,0 +1,70 @@
+import json
+import pytest
+import sqs_producer
+from sqs_producer import pack_urls, send_batch, send_messages
+from conftest import load_handler
+
+
+class FakeSQS:
+    # Answers every SendMessageBatch call with the next scripted list of failed entry ids, as (id, sender fault)
+    def __init__(self, failures=()):
+        self.failures = list(failures)
+        self.calls = []
+
+    def send_message_batch(self, QueueUrl, Entries):
+        self.calls.append([entry["MessageBody"] for entry in Entries])
+        failed = self.failures.pop(0) if self.failures else []
+        return {"Failed": [{"Id": entry_id, "SenderFault": sender_fault, "Code": "Error"} for entry_id, sender_fault in failed]}
+
+
+@pytest.fixture
+def sqs(monkeypatch):
+    sqs = FakeSQS()
+    monkeypatch.setattr(sqs_producer, "get_sqs_client", lambda: sqs)
+    monkeypatch.setattr(sqs_producer.time, "sleep", lambda seconds: None)
+    return sqs
+
+
+def test_pack_urls_round_trip():
+    urls = ["/offer/{}".format(listing_id) for listing_id in range(7)]
+    get_listing_urls = load_handler("warehouse-provisioner").get_listing_urls
+
+    assert pack_urls(urls, 1) == urls
+    packed = pack_urls(urls, 3)
+    assert len(packed) == 3
+    # The provisioner reads packed and plain bodies alike
+    assert [url for body in packed for url in get_listing_urls({"body": body})] == urls
+    assert get_listing_urls({"body": urls[0]}) == [urls[0]]
+    assert json.loads(packed[-1]) == urls[6:]
+
+
+def test_only_failed_entries_are_retried(sqs):
+    sqs.failures = [[("1", False), ("2", False)], [("1", False)]]
+
+    send_batch("queue", ["a", "b", "c"], max_attempts=3)
+
+    assert sqs.calls == [["a", "b", "c"], ["b", "c"], ["b"]]
+
+
+def test_sender_faults_are_not_retried(sqs):
+    sqs.failures = [[("0", True), ("1", False)]]
+
+    with pytest.raises(Exception, match="Failed to send 1 messages"):
+        send_batch("queue", ["too large", "b"], max_attempts=3)
+
+    assert sqs.calls == [["too large", "b"], ["b"]]
+
+
+def test_gives_up_after_the_last_attempt(sqs):
+    sqs.failures = [[("0", False)]] * 3
+
+    with pytest.raises(Exception, match="Failed to send 1 messages"):
+        send_batch("queue", ["a"], max_attempts=2)
+
+    assert len(sqs.calls) == 2
+
+
+def test_messages_are_split_into_batches_of_ten(sqs):
+    send_messages("queue", [str(index) for index in range(23)], concurrency=2, max_attempts=1)
+
+    assert sorted(len(call) for call in sqs.calls) == [3, 10, 10]
@@ -0,0 +1,103 @@
+import json
+import types
+import pytest
+from conftest import load_handler
+from fetch_policy import CircuitOpen
+from listing_fetcher import ListingNotFound
+
+
+class FakeSQS:
+    def __init__(self):
+        self.visibility = {}
+
+    def change_message_visibility_batch(self, QueueUrl, Entries):
+        for entry in Entries:
+            self.visibility[entry["ReceiptHandle"]] = entry["VisibilityTimeout"]
+
+
+@pytest.fixture
+def provisioner(monkeypatch):
+    app = load_handler("warehouse-provisioner")
+    monkeypatch.setenv("AUTOAM_IP_ADDRESS", "127.0.0.1:1")
+    monkeypatch.setenv("SQS_QUEUE_URL", "queue")
+    monkeypatch.delenv("INGEST_MODE", raising=False)
+    monkeypatch.delenv("LISTING_RETRY_DELAY", raising=False)
+
+    app.sqs = FakeSQS()
+    app.written = []
+    app.indexed = []
+    monkeypatch.setattr(app, "get_sqs_client", lambda: app.sqs)
+    monkeypatch.setattr(app, "get_client", lambda ip_address: types.SimpleNamespace(max_concurrency=4))
+    monkeypatch.setattr(app, "update_seen_index", lambda listings: app.indexed.extend(listings))
+    return app
+
+
+def record(message_id, body, receive_count=1):
+    return {"messageId": message_id, "receiptHandle": "handle-" + message_id, "body": body, "attributes": {"ApproximateReceiveCount": str(receive_count)}}
+
+
+def fetch_by_id(listing_url, ip_address):
+    listing_id = listing_url.split("/")[2]
+    if listing_id.startswith("404"):
+        raise ListingNotFound(listing_url)
+    if listing_id.startswith("503"):
+        raise Exception("Status code: 503")
+    if listing_id.startswith("999"):
+        raise CircuitOpen("open")
+    return {"listing_id": listing_id, "car_price": "bad" if listing_id.startswith("777") else 1}
+
+
+def insert_rejecting_bad_prices(app):
+    def insert(listings):
+        if any(listing.get("car_price") == "bad" for listing in listings):
+            raise Exception("invalid input syntax for type integer")
+        app.written.extend(listings)
+
+    return insert
+
+
+def test_only_the_records_with_a_bad_row_fail(provisioner, monkeypatch):
+    monkeypatch.setattr(provisioner, "get_data_from_listing", fetch_by_id)
+    monkeypatch.setattr(provisioner, "insert_into_database", insert_rejecting_bad_prices(provisioner))
+
+    records = [
+        record("single", "/offer/1001"),
+        record("packed", json.dumps(["/offer/1002", "/offer/4041003"])),
+        record("bad-row", json.dumps(["/offer/1004", "/offer/7771005"])),
+        record("not-a-listing", "/offer/xyz")
+    ]
+    result = provisioner.lambda_handler({"Records": records}, None)
+
+    assert sorted(item["itemIdentifier"] for item in result["batchItemFailures"]) == ["bad-row", "not-a-listing"]
+    assert sorted(listing["listing_id"] for listing in provisioner.written) == ["1001", "1002", "4041003"]
+    assert {"listing_id": "4041003", "removed": True} in provisioner.written
+    # The seen index is updated once, with the records that were committed
+    assert len(provisioner.indexed) == 3
+
+
+def test_a_packed_record_fails_with_any_of_its_listings(provisioner, monkeypatch):
+    monkeypatch.setattr(provisioner, "get_data_from_listing", fetch_by_id)
+    monkeypatch.setattr(provisioner, "insert_into_database", insert_rejecting_bad_prices(provisioner))
+
+    result = provisioner.lambda_handler({"Records": [record("packed", json.dumps(["/offer/1001", "/offer/5031002"]))]}, None)
+
+    assert result["batchItemFailures"] == [{"itemIdentifier": "packed"}]
+    assert provisioner.written == []
+
+
+def test_failed_records_back_off_and_throttled_records_are_not_released(provisioner, monkeypatch):
+    monkeypatch.setattr(provisioner, "get_data_from_listing", fetch_by_id)
+    monkeypatch.setattr(provisioner, "insert_into_database", insert_rejecting_bad_prices(provisioner))
+
+    records = [record("first", "/offer/5031001", 1), record("third", "/offer/5031002", 3), record("throttled", "/offer/9991003", 1)]
+    result = provisioner.lambda_handler({"Records": records}, None)
+
+    assert len(result["batchItemFailures"]) == 3
+    assert provisioner.sqs.visibility == {"handle-first": 30, "handle-third": 120}
+
+
+def test_retry_delay_is_capped(provisioner, monkeypatch):
+    monkeypatch.setenv("LISTING_RETRY_DELAY", "60")
+
+    assert provisioner.get_retry_delay(record("m", "/offer/1", 1)) == 60
+    assert provisioner.get_retry_delay(record("m", "/offer/1", 30)) == provisioner.MAX_VISIBILITY_TIMEOUT